@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+""" Benchmark building Google API services per call against reusing
+a cached ApiClient.
+
+A local stub transport serves the Sheets discovery document and canned
+responses, so only client-side overhead (discovery parsing, service
+building) is measured. Credential loading is not included.
+
+Usage: python benchmarks/bench_api_client.py [calls]
+"""
+from __future__ import print_function
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+import workloads  # noqa: F401 - adds the source checkout to sys.path
+
+import httplib2
+from apiclient import discovery
+from googleapiclient import discovery_cache
+
+from scheduler import retry
+from scheduler.google_api import (
+    ApiClient, SHEETS_DISCOVERY_URL, get_tasks_from_sheet
+)
+
+DOC_PATH = os.path.join(
+    os.path.dirname(discovery_cache.__file__), 'documents', 'sheets.v4.json'
+    )
+SIZE = json.dumps({'sheets': [
+    {'properties': {'gridProperties': {'rowCount': 1000}}}
+    ]}).encode('utf-8')
+VALUES = json.dumps({'values': [
+    ['T1', 'Type', 'Test', '2', '20 October 2010']
+    ]}).encode('utf-8')
+
+
+class StubHttp(object):
+    """ Minimal httplib2.Http stand-in serving canned responses."""
+
+    def __init__(self):
+        with open(DOC_PATH, 'rb') as f:
+            self.doc = f.read()
+        self.requests = 0
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=1, connection_type=None):
+        self.requests += 1
+        if '$discovery' in uri:
+            content = self.doc
+        elif '/values/' in uri:
+            content = VALUES
+        else:
+            content = SIZE
+        return httplib2.Response({'status': '200'}), content
+
+
+def per_call(http, calls):
+    for _ in range(calls):
+        service = discovery.build(
+            'sheets', 'v4', http=http, cache_discovery=False,
+            discoveryServiceUrl=SHEETS_DISCOVERY_URL
+            )
+        get_tasks_from_sheet('sheet', service=service)
+
+
+def cached(http, calls):
+    client = ApiClient(http=http, cache_dir=tempfile.mkdtemp())
+    for _ in range(calls):
+        get_tasks_from_sheet('sheet', service=client.sheets)
+
+
+def measure(name, func, calls):
+    http = StubHttp()
+    started = time.time()
+    func(http, calls)
+    elapsed = time.time() - started
+    print("{0:<10} requests={1:<5} total={2:.3f}s per call={3:.2f}ms".format(
+        name, http.requests, elapsed, 1000 * elapsed / calls))
+
+
+if __name__ == '__main__':
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    # Measure the client, not the shared rate limit
+    retry.set_executor(retry.RequestExecutor(rate=1e9, burst=1e9))
+    measure("per-call", per_call, calls)
+    measure("cached", cached, calls)
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+""" End-to-end benchmark of core.run and its stages against the local
+fake Google backend (scheduler.fakes).
+
+Workloads of N tasks x M work blocks are generated in the fake sheet and
+input calendar. The full run, schedule_all, schedule_task and each
+posting stage are timed separately and the results are written to a JSON
+file so they can be compared between versions.
+
+Usage: python benchmarks/bench_e2e.py [--tasks N] [--blocks M]
+           [--repeat R] [--output results.json]
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+os.chdir(tempfile.mkdtemp())
+
+import workloads  # noqa: E402,F401 - adds the source checkout to sys.path
+
+from scheduler import retry  # noqa: E402
+from scheduler.core import (  # noqa: E402
+    run, schedule_all, schedule_task
+)
+from scheduler.db_conf import session, unit_of_work  # noqa: E402
+from scheduler.fakes import FakeGoogle  # noqa: E402
+from scheduler.google_api import (  # noqa: E402
+    WORK_BLOCK_HORIZON_DAYS, clear_events, post_assigned_time, sync_events,
+    tasks_from_values, timeperiods_from_events
+)
+from scheduler.models import Task, TimePeriod  # noqa: E402
+
+HEADER = ['Ref', 'Type', 'Description', 'Hours', 'Due']
+
+
+def make_block_events(count, start):
+    """ Work block events spread evenly over the fetched horizon."""
+    horizon = timedelta(days=WORK_BLOCK_HORIZON_DAYS - 1)
+    spacing = horizon // count
+    length = spacing * 3 // 4
+    events = []
+    for i in range(count):
+        block_start = start + spacing * i
+        events.append({
+            'summary': 'Work',
+            'start': {
+                'dateTime': block_start.isoformat() + 'Z', 'timeZone': 'UTC'
+            },
+            'end': {
+                'dateTime': (block_start + length).isoformat() + 'Z',
+                'timeZone': 'UTC'
+            }
+        })
+    return events, length
+
+
+def make_sheet(count, start, capacity_hours, seed=0, load=0.9):
+    """ Todo list rows with random estimates (in hours) and due dates."""
+    rng = random.Random(seed)
+    mean = max(1, int(capacity_hours * load / max(count, 1)))
+    span = timedelta(days=WORK_BLOCK_HORIZON_DAYS - 1).total_seconds()
+    rows = [HEADER]
+    for i in range(count):
+        due = start + timedelta(seconds=rng.uniform(0.1, 1.0) * span)
+        rows.append([
+            'T{0}'.format(i), 'Type', 'Task {0}'.format(i),
+            str(rng.randint(max(1, mean // 2), max(1, mean * 3 // 2))),
+            due.strftime('%Y-%m-%d %H:%M')
+        ])
+    return rows
+
+
+def make_backend(n_tasks, n_blocks):
+    start = datetime.utcnow().replace(
+        hour=0, minute=0, second=0, microsecond=0
+        ) + timedelta(days=1)
+    events, length = make_block_events(n_blocks, start)
+    capacity_hours = n_blocks * length.total_seconds() / 3600
+    backend = FakeGoogle()
+    backend.add_sheet('sheet', make_sheet(n_tasks, start, capacity_hours))
+    backend.add_events('in', events)
+    return backend
+
+
+def reset(backend):
+    """ Load the fake sheet and work blocks into the DB, unscheduled."""
+    with unit_of_work():
+        Task.delete_all()
+        TimePeriod.delete_all()
+        Task.save_all(tasks_from_values(backend.sheets['sheet']))
+        TimePeriod.save_all(timeperiods_from_events(backend.events('in')))
+    session.expunge_all()
+
+
+def timed(results, backend, name, func, *args, **kwargs):
+    before = len(backend.requests)
+    started = time.time()
+    result = func(*args, **kwargs)
+    elapsed = time.time() - started
+    results[name] = {
+        'seconds': elapsed, 'requests': len(backend.requests) - before
+    }
+    print("  {0:<20} {1:8.3f}s  requests={2}".format(
+        name, elapsed, results[name]['requests']))
+    return result
+
+
+def bench(n_tasks, n_blocks):
+    results = dict()
+    backend = make_backend(n_tasks, n_blocks)
+    client = backend.client()
+    ids = dict(sheet_id='sheet', input_cal_id='in', output_cal_id='out')
+
+    timed(results, backend, 'run', run, client=client, **ids)
+    timed(results, backend, 'run_sync', run, sync=True, client=client, **ids)
+
+    reset(backend)
+    timed(results, backend, 'schedule_all', schedule_all)
+
+    reset(backend)
+
+    def schedule_each():
+        for task in Task.get_all():
+            schedule_task(task)
+    timed(results, backend, 'schedule_task', schedule_each)
+
+    events = list(TimePeriod.iter_assigned_events())
+    calendar = client.calendar
+    timed(results, backend, 'clear_events', clear_events, 'out', calendar)
+    timed(
+        results, backend, 'post_assigned_time', post_assigned_time,
+        events, 'out', calendar
+        )
+    timed(
+        results, backend, 'sync_events', sync_events, events, 'out', calendar
+        )
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR
+            ).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    arg_parser.add_argument('--tasks', type=int, default=200)
+    arg_parser.add_argument('--blocks', type=int, default=1000)
+    arg_parser.add_argument('--repeat', type=int, default=1)
+    arg_parser.add_argument('--output', help='JSON file to write')
+    args = arg_parser.parse_args()
+
+    # The fake has no quotas so requests are not rate limited
+    retry.set_executor(retry.RequestExecutor(rate=1e9, burst=1e9))
+    timestamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    runs = list()
+    for i in range(args.repeat):
+        print("{0} tasks x {1} work blocks (run {2})".format(
+            args.tasks, args.blocks, i + 1))
+        runs.append(bench(args.tasks, args.blocks))
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, 'e2e-{0}.json'.format(timestamp)
+        )
+    if not os.path.isdir(os.path.dirname(os.path.abspath(output))):
+        os.makedirs(os.path.dirname(os.path.abspath(output)))
+    with open(output, 'w') as f:
+        json.dump({
+            'benchmark': 'e2e',
+            'timestamp': timestamp,
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'tasks': args.tasks,
+            'blocks': args.blocks,
+            'runs': runs,
+            # Best of the repeats for each stage
+            'best': dict(
+                (name, min(r[name]['seconds'] for r in runs))
+                for name in runs[0]
+                )
+        }, f, indent=2, sort_keys=True)
+    print("Results written to {0}".format(output))
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+""" Benchmark exact (max-flow) scheduling against greedy policies on an
+overcommitted workload.
+
+Usage: python benchmarks/bench_flow.py [tasks] [blocks] [load]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import tempfile
+import time
+
+os.chdir(tempfile.mkdtemp())
+
+from workloads import make_tasks, make_work_blocks  # noqa: E402
+
+from scheduler.core import schedule_all  # noqa: E402
+from scheduler.db_conf import session, unit_of_work  # noqa: E402
+from scheduler.models import Task, TimePeriod  # noqa: E402
+
+
+def measure(name, n_tasks, n_blocks, load, **kwargs):
+    blocks = make_work_blocks(n_blocks)
+    tasks = make_tasks(n_tasks, blocks, load=load)
+    session.expunge_all()
+    with unit_of_work():
+        Task.delete_all()
+        TimePeriod.delete_all()
+        Task.save_all(tasks)
+        TimePeriod.save_all(blocks)
+    started = time.time()
+    errors = schedule_all(blocks[0].startdatetime, **kwargs)
+    elapsed = time.time() - started
+    print("{0:<10} misses={1:<5} minutes short={2:<8.0f} time={3:.3f}s"
+          .format(name, len(errors), sum(e['timeleft'] for e in errors),
+                  elapsed))
+
+
+if __name__ == '__main__':
+    n_tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    n_blocks = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    load = float(sys.argv[3]) if len(sys.argv) > 3 else 1.1
+    print("{0} tasks, {1} work blocks, load {2}".format(
+        n_tasks, n_blocks, load))
+    measure("insertion", n_tasks, n_blocks, load)
+    measure("edf", n_tasks, n_blocks, load, policy='edf')
+    measure("exact", n_tasks, n_blocks, load, exact=True)
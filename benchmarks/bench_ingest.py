@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+""" Benchmark ingestion throughput (rows/sec) of sheet rows and work
+block events, with the cached strict date parsers and plain dateutil.
+
+Usage: python benchmarks/bench_ingest.py [rows]
+"""
+from __future__ import print_function
+
+import random
+import sys
+import time
+from datetime import timedelta
+
+import workloads  # noqa: F401 - adds the source checkout to sys.path
+
+import pytz  # noqa: E402
+from dateutil import parser  # noqa: E402
+
+from scheduler import google_api  # noqa: E402
+from scheduler.google_api import (  # noqa: E402
+    tasks_from_values, timeperiods_from_events
+)
+from scheduler.models import make_event  # noqa: E402
+
+HEADER = ['Ref', 'Type', 'Description', 'Hours', 'Due']
+
+
+def make_rows(count, seed=0):
+    """ Sheet rows due on one of about a year of days."""
+    rng = random.Random(seed)
+    rows = [HEADER]
+    for i in range(count):
+        due = workloads.START + timedelta(days=rng.randint(0, 365))
+        rows.append([
+            'T{0}'.format(i), 'Type', 'Task {0}'.format(i),
+            str(rng.randint(1, 8)), due.strftime('%d %B %Y')
+            ])
+    return rows
+
+
+def make_events(count):
+    """ Work block events, each with its own start and end."""
+    return [
+        make_event(
+            None, None, workloads.START + timedelta(minutes=30 * i),
+            workloads.START + timedelta(minutes=30 * i + 15)
+            )
+        for i in range(count)
+        ]
+
+
+class DateutilOnly(object):
+    """ Stand in for DateParser parsing every string with dateutil."""
+
+    def parse(self, value):
+        return parser.parse(value)
+
+
+def measure(name, function, items):
+    started = time.time()
+    function(items)
+    elapsed = time.time() - started
+    print("  {0:<24} {1:8.2f}s  {2:10.0f} rows/sec".format(
+        name, elapsed, len(items) / elapsed))
+
+
+if __name__ == '__main__':
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rows = make_rows(n_rows)
+    events = make_events(n_rows)
+    print("{0} rows".format(n_rows))
+    measure("sheet (cached strict)", tasks_from_values, rows)
+    google_api.DateParser = DateutilOnly
+    measure("sheet (dateutil)", tasks_from_values, rows)
+    measure("events (cached strict)", timeperiods_from_events, events)
+    google_api.parse_datetime = parser.parse
+    google_api.get_timezone = pytz.timezone
+    measure("events (dateutil)", timeperiods_from_events, events)
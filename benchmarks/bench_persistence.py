@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+""" Benchmark commits and wall time for saving and scheduling a run.
+
+Compares saving every task and work block with its own commit against
+saving them in bulk inside a unit_of_work (one commit per run).
+
+Usage: python benchmarks/bench_persistence.py [tasks] [blocks]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import tempfile
+import time
+
+# Use a throwaway file DB so that commit (fsync) cost is realistic
+os.chdir(tempfile.mkdtemp())
+
+from workloads import make_tasks, make_work_blocks  # noqa: E402
+
+from sqlalchemy import event  # noqa: E402
+
+from scheduler.core import schedule_all  # noqa: E402
+from scheduler.db_conf import session, unit_of_work  # noqa: E402
+from scheduler.models import Task, TimePeriod  # noqa: E402
+
+COMMITS = [0]
+
+
+def _count_commit(sess):
+    COMMITS[0] += 1
+
+event.listen(session, 'after_commit', _count_commit)
+
+
+def per_object(tasks, blocks):
+    Task.delete_all()
+    TimePeriod.delete_all()
+    for t in tasks:
+        t.save()
+    for w in blocks:
+        w.save()
+    schedule_all(blocks[0].startdatetime)
+
+
+def batched(tasks, blocks):
+    with unit_of_work():
+        Task.delete_all()
+        TimePeriod.delete_all()
+        Task.save_all(tasks)
+        TimePeriod.save_all(blocks)
+        schedule_all(blocks[0].startdatetime)
+
+
+def measure(name, func, n_tasks, n_blocks):
+    blocks = make_work_blocks(n_blocks)
+    tasks = make_tasks(n_tasks, blocks)
+    session.expunge_all()
+    COMMITS[0] = 0
+    started = time.time()
+    func(tasks, blocks)
+    elapsed = time.time() - started
+    print("{0:<12} commits={1:<6} time={2:.3f}s".format(
+        name, COMMITS[0], elapsed))
+
+
+if __name__ == '__main__':
+    n_tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    n_blocks = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    print("{0} tasks, {1} work blocks".format(n_tasks, n_blocks))
+    measure("per-object", per_object, n_tasks, n_blocks)
+    measure("batched", batched, n_tasks, n_blocks)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+""" Benchmark deadline misses and runtime of each scheduling policy.
+
+Tasks with random due dates are scheduled into generated work blocks at
+several load factors (total estimate / capacity).
+
+Usage: python benchmarks/bench_policies.py [tasks] [blocks]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import tempfile
+import time
+
+os.chdir(tempfile.mkdtemp())
+
+from workloads import make_tasks, make_work_blocks  # noqa: E402
+
+from scheduler.core import schedule_all  # noqa: E402
+from scheduler.db_conf import session, unit_of_work  # noqa: E402
+from scheduler.models import Task, TimePeriod  # noqa: E402
+from scheduler.policies import POLICIES  # noqa: E402
+
+
+def measure(policy, n_tasks, n_blocks, load):
+    blocks = make_work_blocks(n_blocks)
+    tasks = make_tasks(n_tasks, blocks, load=load)
+    session.expunge_all()
+    with unit_of_work():
+        Task.delete_all()
+        TimePeriod.delete_all()
+        Task.save_all(tasks)
+        TimePeriod.save_all(blocks)
+    started = time.time()
+    errors = schedule_all(blocks[0].startdatetime, policy=policy)
+    elapsed = time.time() - started
+    critical = sum(1 for e in errors if e['task'].critical)
+    print("load={0:<4} {1:<10} misses={2:<5} critical misses={3:<4} "
+          "time={4:.3f}s".format(load, policy, len(errors), critical,
+                                 elapsed))
+
+
+if __name__ == '__main__':
+    n_tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    n_blocks = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    print("{0} tasks, {1} work blocks".format(n_tasks, n_blocks))
+    for load in (0.8, 1.0, 1.2):
+        for policy in sorted(POLICIES):
+            measure(policy, n_tasks, n_blocks, load)
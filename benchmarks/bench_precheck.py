@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+""" Benchmark the deadline precheck with NumPy and in pure Python.
+
+Usage: python benchmarks/bench_precheck.py [slots] [tasks]
+"""
+from __future__ import print_function
+
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import workloads  # noqa: F401 - adds the source checkout to sys.path
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from scheduler.models import Task  # noqa: E402
+from scheduler.precheck import precheck  # noqa: E402
+from scheduler.slots import MINUTE, Slot, SlotArray, to_epoch  # noqa: E402
+
+START = datetime(2018, 1, 1)
+
+
+def make_workload(n_slots, n_tasks, seed=0):
+    rng = random.Random(seed)
+    first = to_epoch(START)
+    slots = SlotArray(
+        Slot(
+            first + i * 60 * MINUTE,
+            first + i * 60 * MINUTE + rng.randint(15, 60) * MINUTE
+            )
+        for i in range(n_slots)
+        )
+    tasks = list()
+    for i in range(n_tasks):
+        task = Task(
+            START + timedelta(hours=rng.uniform(0, n_slots)),
+            rng.randint(30, 600)
+            )
+        task.progress = 0
+        tasks.append(task)
+    return tasks, slots
+
+
+def timed(name, tasks, slots, use_numpy, repeat=5):
+    best = None
+    for _ in range(repeat):
+        started = time.time()
+        result = precheck(tasks, slots, START, use_numpy=use_numpy)
+        elapsed = time.time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print("  {0:<8} {1:8.2f}ms  feasible={2}".format(
+        name, best * 1000, result['feasible']))
+
+
+if __name__ == '__main__':
+    n_slots = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    n_tasks = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    tasks, slots = make_workload(n_slots, n_tasks)
+    print("{0} slots, {1} tasks".format(n_slots, n_tasks))
+    if numpy is not None:
+        timed("numpy", tasks, slots, True)
+    else:
+        print("  numpy    not installed")
+    timed("python", tasks, slots, False)
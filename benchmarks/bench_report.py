@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+""" Benchmark time period queries and task reports at scale, with and
+without the timeperiod indexes.
+
+Usage: python benchmarks/bench_report.py [time periods] [tasks]
+"""
+from __future__ import print_function
+
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+os.chdir(tempfile.mkdtemp())
+
+from workloads import make_tasks, make_work_blocks  # noqa: E402
+
+from scheduler.db_conf import engine, session, unit_of_work  # noqa: E402
+from scheduler.models import Task, TimePeriod  # noqa: E402
+
+
+def setup(n_periods, n_tasks):
+    blocks = make_work_blocks(n_periods)
+    tasks = make_tasks(n_tasks, blocks)
+    with unit_of_work():
+        Task.delete_all()
+        TimePeriod.delete_all()
+        Task.save_all(tasks)
+    ids = [t.id for t in Task.get_all()]
+    rng = random.Random(0)
+    # Assign roughly half the periods at random
+    for tp in blocks:
+        if rng.random() < 0.5:
+            tp.task_id = rng.choice(ids)
+    with unit_of_work():
+        TimePeriod.save_all(blocks)
+    session.expunge_all()
+    return blocks[0].startdatetime, blocks[-1].enddatetime
+
+
+def python_report():
+    return [(t.id, sum(tp.duration for tp in t.timeperiods))
+            for t in Task.get_all()]
+
+
+def range_queries(first, last, count=200):
+    span = (last - first).total_seconds()
+    rng = random.Random(1)
+    for _ in range(count):
+        start = first + timedelta(seconds=rng.uniform(0, span))
+        TimePeriod.unassigned_in_range(start, start + timedelta(days=30))
+        TimePeriod.get_unassigned(start, start + timedelta(days=7))
+
+
+def timed(name, func, *args):
+    session.expunge_all()
+    started = time.time()
+    func(*args)
+    print("  {0:<28} {1:.3f}s".format(name, time.time() - started))
+
+
+def run_all(first, last):
+    timed("python report (N+1)", python_report)
+    timed("Task.report() (1 query)", Task.report)
+    timed("200 x 2 range queries", range_queries, first, last)
+
+
+if __name__ == '__main__':
+    n_periods = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    n_tasks = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    first, last = setup(n_periods, n_tasks)
+    print("{0} time periods, {1} tasks".format(n_periods, n_tasks))
+    print("with indexes:")
+    run_all(first, last)
+    indexes = list(TimePeriod.__table__.indexes)
+    session.commit()
+    for index in indexes:
+        index.drop(engine)
+    print("without indexes:")
+    run_all(first, last)
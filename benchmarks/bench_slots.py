@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+""" Compare the memory and time taken to load unassigned time periods
+into the ORM based engine.SlotIndex and the compact slots.SlotArray.
+
+Usage: python benchmarks/bench_slots.py [time periods]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.chdir(tempfile.mkdtemp())
+
+from workloads import make_work_blocks  # noqa: E402
+
+from scheduler.db_conf import session, unit_of_work  # noqa: E402
+from scheduler.engine import SlotIndex  # noqa: E402
+from scheduler.models import TimePeriod  # noqa: E402
+from scheduler.slots import SlotArray  # noqa: E402
+
+
+def measure(name, load):
+    session.expunge_all()
+    tracemalloc.start()
+    started = time.time()
+    index = load()
+    elapsed = time.time() - started
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("  {0:<10} {1:.3f}s  held={2:.1f}MB  peak={3:.1f}MB  "
+          "{4:.0f} bytes/slot".format(
+              name, elapsed, size / 1e6, peak / 1e6, size / len(index)))
+    return index
+
+
+if __name__ == '__main__':
+    n_periods = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with unit_of_work():
+        TimePeriod.save_all(make_work_blocks(n_periods, minutes=1))
+    print("{0} time periods".format(n_periods))
+    measure("SlotIndex", SlotIndex.load)
+    measure("SlotArray", SlotArray.load)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+# Generated workloads shared by the benchmark scripts
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+# Allow the scripts to be run from a source checkout
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler.models import Task, TimePeriod  # noqa: E402
+
+START = datetime(2018, 1, 1, 9, 0)
+
+
+def make_work_blocks(count, start=START, minutes=180):
+    """ Generate work blocks - two per weekday (9-12 and 13-16)."""
+    blocks = []
+    day = start
+    while len(blocks) < count:
+        if day.weekday() < 5:
+            for offset in (0, 4):
+                if len(blocks) < count:
+                    block_start = day + timedelta(hours=offset)
+                    blocks.append(TimePeriod(
+                        block_start, block_start + timedelta(minutes=minutes)
+                        ))
+        day = day + timedelta(days=1)
+    return blocks
+
+
+def make_tasks(count, blocks, seed=0, load=0.9):
+    """ Generate tasks with random estimates and due dates.
+
+    The total estimate is roughly load x the capacity of the blocks, so
+    load > 1 gives an overcommitted schedule.
+    """
+    rng = random.Random(seed)
+    capacity = sum(b.duration for b in blocks)
+    mean = max(1, int(capacity * load / max(count, 1)))
+    first = blocks[0].startdatetime
+    span = (blocks[-1].enddatetime - first).total_seconds()
+    tasks = []
+    for i in range(count):
+        due = first + timedelta(seconds=rng.uniform(0.1, 1.0) * span)
+        task = Task(
+            due, rng.randint(max(1, mean // 2), mean * 3 // 2),
+            taskref="T{0}".format(i), description="Task {0}".format(i)
+            )
+        task.progress = 0
+        task.critical = rng.random() < 0.2
+        tasks.append(task)
+    return tasks
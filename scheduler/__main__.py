@@ -1,4 +1,117 @@
 # -*- coding: utf-8 -*-
 
-from scheduler.core import run # pragma: no cover
-run() # pragma: no cover
+import argparse
+
+from scheduler import metrics
+from scheduler.cache import SnapshotCache, SNAPSHOT_DIR, DEFAULT_TTL
+from scheduler.core import run
+from scheduler.slots import fragment_counts
+
+
+def main(argv=None):
+    """ Run program from the command line."""
+    parser = argparse.ArgumentParser(
+        prog='python -m scheduler',
+        description='Schedule tasks from a todo list into a calendar.'
+        )
+    parser.add_argument(
+        '--sync', action='store_true',
+        help='update the output calendar with only the events that changed '
+             'instead of clearing and reposting it'
+        )
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='print the time spent in each stage, counts of SQL '
+             'statements, commits, HTTP requests and slot splits, and how '
+             'fragmented the time periods are'
+        )
+    parser.add_argument(
+        '--metrics-file',
+        help='write metrics to this file in the Prometheus text format'
+        )
+    parser.add_argument(
+        '--work-blocks-file', metavar='ICS',
+        help='read work blocks from this iCalendar file instead of the '
+             'input calendar'
+        )
+    parser.add_argument(
+        '--output-file', metavar='ICS',
+        help='write scheduled time to this iCalendar file instead of the '
+             'output calendar'
+        )
+    parser.add_argument(
+        '--busy-calendar', action='append', metavar='ID',
+        help='take the busy times of this calendar out of the work blocks '
+             '(may be repeated)'
+        )
+    parser.add_argument(
+        '--busy-file', metavar='JSON',
+        help='take the busy times in this freebusy query response out of '
+             'the work blocks'
+        )
+    parser.add_argument(
+        '--min-slot', type=int, default=0, metavar='MINUTES',
+        help='do not split work blocks into parts shorter than this'
+        )
+    parser.add_argument(
+        '--cache-dir', metavar='DIR',
+        help='keep snapshots of the sheet and work blocks in this directory '
+             'so unchanged sources are not downloaded again (default {0} '
+             'if --cache-ttl or --offline is given)'.format(SNAPSHOT_DIR)
+        )
+    parser.add_argument(
+        '--cache-ttl', type=float, metavar='SECONDS',
+        help='use snapshots younger than this without checking the sources '
+             'for changes (default {0})'.format(DEFAULT_TTL)
+        )
+    parser.add_argument(
+        '--offline', action='store_true',
+        help='schedule from the snapshots only - nothing is fetched from or '
+             'posted to Google'
+        )
+    args = parser.parse_args(argv)
+
+    cache = None
+    if args.cache_dir or args.cache_ttl is not None or args.offline:
+        cache = SnapshotCache(
+            directory=args.cache_dir or SNAPSHOT_DIR,
+            ttl=DEFAULT_TTL if args.cache_ttl is None else args.cache_ttl,
+            offline=args.offline
+            )
+
+    sinks = list()
+    if args.profile:
+        sinks.append(metrics.add_sink(metrics.MemorySink()))
+    if args.metrics_file:
+        sinks.append(metrics.add_sink(
+            metrics.PrometheusSink(args.metrics_file)
+            ))
+    counts = None
+    try:
+        with metrics.span('run'):
+            result = run(
+                sync=args.sync,
+                cache=cache,
+                work_blocks_file=args.work_blocks_file,
+                output_file=args.output_file,
+                busy_cal_ids=args.busy_calendar,
+                busy_file=args.busy_file,
+                min_slot_minutes=args.min_slot
+                )
+        if args.profile:
+            counts = fragment_counts(args.min_slot)
+        return result
+    finally:
+        metrics.flush()
+        for sink in sinks:
+            metrics.remove_sink(sink)
+        if args.profile:
+            print(sinks[0].summary())
+        if counts is not None:
+            print('time periods: ' + ' '.join(
+                '{0}={1}'.format(k, v) for k, v in sorted(counts.items())
+                ))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
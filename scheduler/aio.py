@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+# asyncio version of core.run - independent Google API stages overlap
+import asyncio
+from functools import partial
+
+from scheduler import google_api
+from scheduler.core import replace_and_schedule
+from scheduler.models import TimePeriod
+
+
+async def _offload(func, *args, **kwargs):
+    """ Run a blocking call in the default thread pool.
+
+    Each pool thread uses its own google_api client; requests from all of
+    them share the rate limit of retry.get_executor().
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(func, *args, **kwargs))
+
+
+async def get_tasks_from_sheet(*args, **kwargs):
+    """ Async google_api.get_tasks_from_sheet."""
+    return await _offload(google_api.get_tasks_from_sheet, *args, **kwargs)
+
+
+async def get_work_blocks(*args, **kwargs):
+    """ Async google_api.get_work_blocks."""
+    return await _offload(google_api.get_work_blocks, *args, **kwargs)
+
+
+async def clear_events(*args, **kwargs):
+    """ Async google_api.clear_events."""
+    return await _offload(google_api.clear_events, *args, **kwargs)
+
+
+async def post_assigned_time(*args, **kwargs):
+    """ Async google_api.post_assigned_time."""
+    return await _offload(google_api.post_assigned_time, *args, **kwargs)
+
+
+async def sync_events(*args, **kwargs):
+    """ Async google_api.sync_events."""
+    return await _offload(google_api.sync_events, *args, **kwargs)
+
+
+async def run_async(sync=False, cache=None):
+    """ Run program (see core.run) with independent stages overlapped.
+
+    Clearing the output calendar, fetching the sheet and fetching the
+    work blocks run concurrently; scheduling starts once the fetches are
+    done and posting once the calendar is clear. Use
+    asyncio.run(run_async()).
+    """
+    offline = cache is not None and cache.offline
+    clear = None
+    if not (sync or offline):
+        clear = asyncio.ensure_future(clear_events())
+    # Rows that are not valid tasks are added to input_errors
+    input_errors = list()
+    try:
+        tasks, wb = await asyncio.gather(
+            get_tasks_from_sheet(cache=cache, errors=input_errors),
+            get_work_blocks(cache=cache)
+            )
+        # Scheduling uses the session so runs in the event loop's thread
+        errors = input_errors + replace_and_schedule(tasks, wb)
+        events = list(TimePeriod.iter_assigned_events())
+        if clear is not None:
+            await clear
+    finally:
+        if clear is not None and not clear.done():
+            clear.cancel()
+    # (events that fail to post are added to errors)
+    if offline:
+        posted_events = events
+    elif sync:
+        posted_events = await sync_events(events, errors=errors)
+    else:
+        posted_events = await post_assigned_time(events, errors=errors)
+    return (errors, posted_events)
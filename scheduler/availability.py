@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+# Free time - work blocks with the busy times of other calendars (e.g.
+# meetings) taken out before they are saved as time periods
+import json
+
+import pytz
+
+from scheduler.dates import parse_datetime
+from scheduler.models import TimePeriod
+
+
+def _utc(dt):
+    """ Timezone aware UTC datetime (naive datetimes are taken as UTC)."""
+    if dt.tzinfo:
+        return dt.astimezone(pytz.utc)
+    return dt.replace(tzinfo=pytz.utc)
+
+
+def merge_intervals(intervals):
+    """ Merge overlapping and touching (start, end) intervals.
+
+    Returns the merged intervals sorted by start.
+    """
+    merged = list()
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [tuple(interval) for interval in merged]
+
+
+def subtract_intervals(blocks, busy):
+    """ Subtract busy (start, end) intervals from blocks.
+
+    Both are sorted and swept once together, O((n + m) log(n + m)).
+    Returns the free parts of the blocks sorted by start; blocks that
+    overlap each other are not merged.
+    """
+    busy = merge_intervals(busy)
+    free = list()
+    i = 0
+    for start, end in sorted(blocks):
+        # Busy intervals ending before this block can not overlap it, or
+        # any later block (blocks are in start order)
+        while i < len(busy) and busy[i][1] <= start:
+            i += 1
+        j = i
+        while start < end and j < len(busy) and busy[j][0] < end:
+            if busy[j][0] > start:
+                free.append((start, busy[j][0]))
+            start = max(start, busy[j][1])
+            j += 1
+        if start < end:
+            free.append((start, end))
+    return free
+
+
+def free_timeperiods(work_blocks, busy):
+    """ New time periods for the free parts of work blocks (time periods)
+    after taking out busy (start, end) intervals.
+
+    Times are converted to UTC (naive times are taken as UTC).
+    """
+    blocks = [
+        (_utc(tp.startdatetime), _utc(tp.enddatetime)) for tp in work_blocks
+        ]
+    busy = [(_utc(start), _utc(end)) for start, end in busy]
+    free = subtract_intervals(blocks, busy)
+    return [TimePeriod(start, end) for start, end in free]
+
+
+def busy_from_response(response, errors=None):
+    """ Busy (start, end) intervals from a freebusy query response.
+
+    Calendars the response has errors for (e.g. not found) are appended
+    to errors (if a list is supplied) as {'item': calendar id, 'error'}.
+    """
+    busy = list()
+    calendars = response.get('calendars', {})
+    for calendar_id, calendar in sorted(calendars.items()):
+        if calendar.get('errors'):
+            if errors is not None:
+                errors.append({
+                    'item': calendar_id, 'error': calendar['errors']
+                })
+            continue
+        for interval in calendar.get('busy', []):
+            busy.append((
+                parse_datetime(interval['start']),
+                parse_datetime(interval['end'])
+                ))
+    return busy
+
+
+def load_busy_fixture(path, errors=None):
+    """ Busy intervals from a JSON file holding a freebusy query response,
+    for working offline and in tests."""
+    with open(path) as f:
+        return busy_from_response(json.load(f), errors)
+
+
+def get_busy(
+    calendar_ids=(), service=None, time_min=None, time_max=None,
+    fixture=None, errors=None
+):
+    """ Busy intervals of calendars between time_min and time_max.
+
+    They are fetched with google_api.get_freebusy, or read from the JSON
+    file fixture (see load_busy_fixture) if it is given.
+    """
+    if fixture is not None:
+        return load_busy_fixture(fixture, errors)
+    if not calendar_ids:
+        return []
+    # Google client libraries are only loaded when they are needed
+    from scheduler.google_api import get_freebusy
+    return busy_from_response(
+        get_freebusy(calendar_ids, service, time_min, time_max), errors
+        )
+
+
+def remove_busy(
+    work_blocks, calendar_ids=(), service=None, fixture=None, errors=None
+):
+    """ Take the busy times of calendars out of work blocks (time
+    periods), fetched for the range the blocks cover (see get_busy).
+
+    Returns new time periods for the free time.
+    """
+    work_blocks = list(work_blocks)
+    if not work_blocks or not (calendar_ids or fixture):
+        return work_blocks
+    time_min = min(_utc(tp.startdatetime) for tp in work_blocks)
+    time_max = max(_utc(tp.enddatetime) for tp in work_blocks)
+    busy = get_busy(
+        calendar_ids, service, time_min, time_max, fixture, errors
+        )
+    return free_timeperiods(work_blocks, busy)
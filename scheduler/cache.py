@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+# Local snapshots of data fetched from Google so unchanged sources
+# do not need to be downloaded again
+import hashlib
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+# Directory snapshots are stored in
+SNAPSHOT_DIR = os.path.join(os.getcwd(), '.snapshots')
+# Seconds a snapshot is used without checking the source for changes
+DEFAULT_TTL = 5 * 60
+# Maximum number of snapshots kept - least recently used are evicted
+DEFAULT_MAX_ENTRIES = 32
+# Flags of the temporary files written by atomic_write - created only if
+# the name is not taken, and always in binary mode (Python translates
+# newlines for text mode itself)
+_TMP_FLAGS = os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, 'O_BINARY', 0)
+
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    """ Open a uniquely named temporary file next to path for writing.
+
+    The file replaces path when the block exits, so readers never see a
+    partly written file and concurrent writers never share a temporary
+    file. It is removed instead if the block raises.
+    """
+    tmp_path = '{0}.{1}.tmp'.format(path, uuid.uuid4().hex)
+    # The umask applies to the mode, as it does for open()
+    fd = os.open(tmp_path, _TMP_FLAGS, 0o666)
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class SnapshotMissing(Exception):
+    """ Raised in offline mode when there is no snapshot to use."""
+    pass
+
+
+class SnapshotCache(object):
+    """ JSON snapshots of sheet values and calendar events on disk.
+
+    Each snapshot records when it was fetched and, for calendars, the
+    sync token to request changes since then. Snapshots younger than ttl
+    seconds are used as they are. In offline mode snapshots are always
+    used and the sources are never contacted.
+    """
+
+    def __init__(
+        self, directory=SNAPSHOT_DIR, ttl=DEFAULT_TTL,
+        max_entries=DEFAULT_MAX_ENTRIES, offline=False
+    ):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.offline = offline
+
+    def _path(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json'
+        return os.path.join(self.directory, name)
+
+    def load(self, key):
+        """ Get the snapshot stored for key (or None)."""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        # Touch the file so eviction removes least recently used first
+        os.utime(path, None)
+        return snapshot
+
+    def fresh(self, snapshot):
+        """ Can the snapshot be used without checking the source."""
+        if snapshot is None:
+            return False
+        return self.offline or time.time() - snapshot['fetched'] < self.ttl
+
+    def store(self, key, data, sync_token=None):
+        """ Save a snapshot of data for key and evict old snapshots."""
+        os.makedirs(self.directory, exist_ok=True)
+        snapshot = {
+            'key': key,
+            'fetched': time.time(),
+            'sync_token': sync_token,
+            'data': data
+        }
+        with atomic_write(self._path(key)) as f:
+            json.dump(snapshot, f)
+        self.evict()
+        return snapshot
+
+    def evict(self):
+        """ Remove the least recently used snapshots over max_entries."""
+        paths = [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory) if name.endswith('.json')
+            ]
+        if len(paths) <= self.max_entries:
+            return
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:len(paths) - self.max_entries]:
+            os.remove(path)
+
+    def clear(self):
+        """ Remove all snapshots."""
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                os.remove(os.path.join(self.directory, name))
@@ -1,91 +1,291 @@
 # -*- coding: utf-8 -*-
 
+from scheduler.availability import remove_busy
+from scheduler.db_conf import unit_of_work
+from scheduler.metrics import span
 from scheduler.models import Task, TimePeriod
-
-from scheduler.google_api import (
-    get_tasks_from_sheet, get_work_blocks, post_assigned_time,
-    clear_events
-)
+from scheduler.engine import SlotIndex
+from scheduler.slots import SlotArray, defragment
+from scheduler.flow import max_schedulable, remaining_minutes
+from scheduler.policies import get_policy, EarliestDeadlineFirst
+from scheduler.precheck import precheck
 
 # Import date & time functions
-from datetime import timedelta, datetime
+from datetime import datetime
+from heapq import heapify, heappop, heappush
+
+# Default start for scheduling - time periods before this are ignored
+DEFAULT_START = datetime.now()
+# Default minimum slot size in minutes (0 - split time periods anywhere)
+MIN_SLOT_MINUTES = 0
 
 
 def reset_assignments(task):
     pass
 
 
-def run():
-    """ Run program."""
-    # Clear initial data
-    Task.delete_all()
-    TimePeriod.delete_all()
+def run(
+    sync=False, cache=None, client=None, sheet_id=None, input_cal_id=None,
+    output_cal_id=None, work_blocks_file=None, output_file=None,
+    busy_cal_ids=None, busy_file=None, min_slot_minutes=MIN_SLOT_MINUTES
+):
+    """ Run program.
+
+    If sync is True the output calendar is updated with a minimal diff
+    instead of being cleared and reposted. If a SnapshotCache is supplied
+    the sheet and work blocks are read through it; in offline mode
+    nothing is fetched or posted and the unposted events are returned.
+    Pass a google_api.ApiClient as client to use other services than the
+    default ones (e.g. a fakes.FakeGoogle backend), and the ids to use
+    another sheet and calendars than those in private.py.
+
+    Work blocks are read from the iCalendar file work_blocks_file, and
+    the scheduled events written to output_file, instead of the Google
+    calendars if they are given (see ics).
+
+    Busy times of the calendars busy_cal_ids (e.g. meetings), fetched
+    with one freebusy query, or read from the JSON fixture busy_file, are
+    taken out of the work blocks (see availability).
+
+    Time periods are not split into parts of less than min_slot_minutes
+    (see schedule_all).
+
+    Returns the errors - sheet rows that are not valid tasks (see
+    google_api.iter_tasks), busy calendars that could not be read, tasks
+    that could not be fully scheduled and events that failed to post -
+    and the posted events.
+    """
+    # Google client libraries are only loaded when a run needs them
+    from scheduler.google_api import (
+        iter_tasks_from_sheet, get_work_blocks, post_assigned_time,
+        clear_events, sync_events, SHEET_ID, INPUT_CAL_ID, OUTPUT_CAL_ID
+    )
+    sheet_id = SHEET_ID if sheet_id is None else sheet_id
+    input_cal_id = INPUT_CAL_ID if input_cal_id is None else input_cal_id
+    output_cal_id = OUTPUT_CAL_ID if output_cal_id is None else output_cal_id
+    offline = cache is not None and cache.offline
+    calendar = sheets = None
+    if client is not None and not offline:
+        with span('run.connect'):
+            calendar, sheets = client.calendar, client.sheets
     # Clear output calendar
-    clear_events()
-    # Get tasks from Google spreadsheet
-    tasks = get_tasks_from_sheet()
+    if not (sync or offline or output_file):
+        with span('run.clear'):
+            clear_events(output_cal_id, service=calendar)
+    # Tasks are streamed from the Google spreadsheet a chunk of rows at a
+    # time while they are saved (rows that are not valid tasks are added
+    # to input_errors)
+    input_errors = list()
+    tasks = iter_tasks_from_sheet(
+        sheet_id, service=sheets, cache=cache, errors=input_errors
+        )
     # Get working blocks from Input Google calendar
-    wb = get_work_blocks()
-    # Save data
-    for t in tasks:
-        t.save()
-    for w in wb:
-        w.save()
-    # Schedule tasks
-    errors = schedule_all()
+    with span('run.fetch_work_blocks'):
+        if work_blocks_file:
+            from scheduler import ics
+            wb = ics.get_work_blocks(work_blocks_file)
+        else:
+            wb = get_work_blocks(input_cal_id, service=calendar, cache=cache)
+    # Take busy times out of the work blocks
+    if busy_file or (busy_cal_ids and not offline):
+        with span('run.remove_busy'):
+            wb = remove_busy(
+                wb, busy_cal_ids or (), service=calendar, fixture=busy_file,
+                errors=input_errors
+                )
+    # Replace stored data and schedule tasks with a single commit
+    with span('run.schedule'):
+        errors = input_errors + replace_and_schedule(
+            tasks, wb, min_slot_minutes=min_slot_minutes
+            )
     # Upload scheduled time periods to Output Google calendar
-    assigned_tps = TimePeriod.get_assigned()
-    events = [a_tp.as_event() for a_tp in assigned_tps]
-    posted_events = post_assigned_time(events)
+    events = TimePeriod.iter_assigned_events()
+    # (events that fail to post are added to errors)
+    with span('run.post'):
+        if offline:
+            posted_events = list(events)
+        elif output_file:
+            from scheduler import ics
+            posted_events = ics.post_assigned_time(
+                events, output_file, errors=errors
+                )
+        elif sync:
+            posted_events = sync_events(
+                events, output_cal_id, service=calendar, errors=errors
+                )
+        else:
+            posted_events = post_assigned_time(
+                events, output_cal_id, service=calendar, errors=errors
+                )
     # Return errors and posted events
     return (errors, posted_events)
 
 
-def schedule_all():
-    """ Schedule all tasks."""
+def replace_and_schedule(
+    tasks, work_blocks, policy=None, min_slot_minutes=MIN_SLOT_MINUTES
+):
+    """ Replace the stored tasks and time periods and schedule them,
+    with a single commit. Returns the scheduling errors."""
+    with unit_of_work():
+        Task.delete_all()
+        TimePeriod.delete_all()
+        Task.save_all(tasks)
+        TimePeriod.save_all(work_blocks)
+        return schedule_all(
+            policy=policy, min_slot_minutes=min_slot_minutes
+            )
+
+
+def schedule_all(
+    startdate=DEFAULT_START, policy=None, exact=False, prune=False,
+    min_slot_minutes=MIN_SLOT_MINUTES
+):
+    """ Schedule all tasks.
+
+    Unassigned time periods are loaded once into a compact SlotArray and
+    all tasks are scheduled against it before a single bulk write back to
+    the DB.
+    Tasks are scheduled in the order given by policy - a Policy or the
+    name of one in policies.POLICIES (default insertion order).
+
+    If exact is True the policy is ignored. The most minutes that can be
+    scheduled before each due date are found with a max-flow solver
+    (critical tasks first), then placed earliest deadline first.
+
+    If prune is True a precheck first finds the tasks with no free time
+    at all before their due date; they are reported as errors without
+    being scheduled.
+
+    Time periods are not split into parts of less than min_slot_minutes:
+    tasks are given multiples of it, and whole periods rather than
+    leaving a short free part (see engine.fit_minutes). If it is set,
+    adjacent time periods of the same task, and free ones, are then
+    coalesced and free periods shorter than it dropped (see
+    slots.defragment).
+    """
     # Get all unassigned tasks
     tasks = Task.get_all()
+    index = SlotArray.load(min_slot_minutes)
     errors = list()
+    if prune:
+        schedulable = list()
+        for result in precheck(tasks, index, startdate)['tasks']:
+            if result['capacity'] > 0:
+                schedulable.append(result['task'])
+            elif result['remaining'] > 0:
+                errors.append({
+                    'task': result['task'], 'timeleft': result['remaining']
+                })
+        tasks = schedulable
+    if exact:
+        amounts = dict(zip(
+            tasks, max_schedulable(tasks, index, startdate)
+            ))
+        for task in EarliestDeadlineFirst().order(tasks):
+            runningtime = remaining_minutes(task)
+            amount = min(amounts[task], runningtime)
+            timeleft = runningtime - amount + \
+                _assign(task, amount, startdate, index)
+            if timeleft > 0:
+                errors.append({'task': task, 'timeleft': timeleft})
+    else:
+        for task in get_policy(policy).order(tasks):
+            timeleft = schedule_task(task, startdate, index=index)
+            if timeleft > 0:
+                errors.append({'task': task, 'timeleft': timeleft})
+    index.save()
+    if min_slot_minutes:
+        defragment(min_slot_minutes)
+    return errors
+
+
+def reschedule(
+    task_ids, startdate=DEFAULT_START, policy=None,
+    min_slot_minutes=MIN_SLOT_MINUTES
+):
+    """ Reschedule only the tasks with the supplied ids, e.g. after their
+    estimate or progress has changed.
+
+    The tasks' time periods are released (and merged with adjacent free
+    periods) and the tasks are placed again in policy order. If a task
+    cannot be fully placed, tasks later in the policy order holding time
+    periods before its due date are displaced - lowest priority first,
+    until enough time is freed - and placed again after it. Other tasks
+    and time periods are not touched. Time periods are not split into
+    parts of less than min_slot_minutes (see engine.fit_minutes).
+
+    Returns a list of errors in the same format as schedule_all.
+    """
+    policy = get_policy(policy)
+    tasks = Task.get_by_ids(task_ids)
+    index = SlotIndex.load(startdate, startdate)
+    index.min_minutes = min_slot_minutes
+    queue = list()
     for task in tasks:
-        timeleft = schedule_task(task)
+        for tp in list(task.timeperiods):
+            index.release(tp)
+        queue.append((policy.rank(task), task))
+    heapify(queue)
+
+    errors = list()
+    while queue:
+        rank, task = heappop(queue)
+        timeleft = _assign(task, remaining_minutes(task), startdate, index)
+        if timeleft > 0 and task.due is not None:
+            # Displace lower priority tasks until there is enough time. The
+            # query autoflushes, so periods assigned (or split off) earlier
+            # in this call are counted too
+            holders = dict()
+            for tp in TimePeriod.assigned_in_range(startdate, task.due):
+                holders.setdefault(tp.task, 0)
+                holders[tp.task] += tp.duration
+            freed = 0
+            for victim in sorted(holders, key=policy.rank, reverse=True):
+                if freed >= timeleft or policy.rank(victim) <= rank:
+                    break
+                freed += holders[victim]
+                for tp in list(victim.timeperiods):
+                    index.release(tp)
+                heappush(queue, (policy.rank(victim), victim))
+            if freed:
+                timeleft = _assign(task, timeleft, startdate, index)
         if timeleft > 0:
             errors.append({'task': task, 'timeleft': timeleft})
+    index.save()
     return errors
 
 
-def schedule_task(task, startdate=datetime.now()):
-    """ Schedule a single task. """
+def schedule_task(task, startdate=DEFAULT_START, index=None):
+    """ Schedule a single task.
+
+    If an index of unassigned time periods is supplied the caller is
+    responsible for saving it, otherwise one is loaded and saved here.
+    """
+    save = index is None
+    if save:
+        index = SlotIndex.load()
     # Initialise variable to store amount of time to assign
-    runningtime = task.esttimemins*(1-(task.progress/100.0))
+    runningtime = remaining_minutes(task)
+    runningtime = _assign(task, runningtime, startdate, index)
+    if save:
+        index.save()
+    return runningtime
+
+
+def _assign(task, runningtime, startdate, index):
+    """ Assign runningtime minutes of a task to the earliest available
+    time periods in the index, splitting the last one if needed.
 
+    Returns the minutes that could not be assigned (never negative, though
+    rounding to the minimum slot size may assign more than runningtime).
+    """
     # Get all available timeperiods with a datetime > startdate
     # And an enddate < duedate
-    available_tp = TimePeriod.unassigned_in_range(startdate, task.due)
-    while available_tp and runningtime > 0:
-        if runningtime >= available_tp.duration:
-            # Assign task to time period
-            available_tp.task = task
-            available_tp.save()
-            # Reduce running time
-            runningtime = runningtime - available_tp.duration
-            available_tp = TimePeriod.unassigned_in_range(startdate, task.due)
-        else:
-            # time period duration is longer than task duration
-            # We need to adjust the statement below to work with timedeltas
-            new_enddatetime = (
-                available_tp.startdatetime +
-                timedelta(seconds=runningtime*60)
+    while runningtime > 0:
+        available_tp = index.pop_first(startdate, task.due)
+        if not available_tp:
+            break
+        runningtime = runningtime - index.assign(
+            available_tp, task, runningtime
             )
-            original_enddatetime = available_tp.enddatetime
-            # Split time period into two periods
-            available_tp.enddatetime = new_enddatetime
-            new_tp_2 = TimePeriod(new_enddatetime, original_enddatetime)
-            # Assign first time period to task
-            available_tp.task = task
-            available_tp.save()
-            new_tp_2.save()
-            # Set next available time period as time period 2
-            available_tp = TimePeriod.unassigned_in_range(startdate, task.due)
-            runningtime = 0
-
-    return runningtime
+    return max(runningtime, 0)
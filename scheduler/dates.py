@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+# Fast date parsing for ingesting sheets and calendar events. Strings are
+# parsed with strict formats first and dateutil only as a fallback, with
+# bounded caches of parsed strings and timezones.
+from datetime import datetime
+from functools import lru_cache
+
+import pytz
+from dateutil import parser
+
+# Sizes of the parsed string and timezone caches
+DATE_CACHE_SIZE = 4096
+TIMEZONE_CACHE_SIZE = 128
+
+# Strict formats tried before dateutil, most likely first. Only formats
+# that give the same result as dateutil.parser.parse for every string
+# they accept are listed (e.g. 01/02/2018 is month first in dateutil).
+ISO_FORMAT = 'iso'
+FORMATS = (
+    ISO_FORMAT,
+    '%d %B %Y',
+    '%d %b %Y',
+    '%B %d %Y',
+    '%b %d %Y',
+    '%d %B %Y %H:%M',
+    '%m/%d/%Y',
+    '%m/%d/%Y %H:%M',
+    '%Y/%m/%d',
+)
+
+
+def _strict_parse(value, fmt):
+    if fmt == ISO_FORMAT:
+        return datetime.fromisoformat(value)
+    return datetime.strptime(value, fmt)
+
+
+class DateParser(object):
+    """ Parse the date strings of one column (e.g. sheet due dates).
+
+    The format is detected from the first string that matches one of
+    formats and used first for the following strings; strings it does not
+    match are tried against the other formats and then dateutil. Up to
+    cache_size recently parsed strings are kept.
+
+    Raises ValueError for strings that cannot be parsed, like dateutil.
+    """
+
+    def __init__(self, formats=FORMATS, cache_size=DATE_CACHE_SIZE):
+        self.formats = formats
+        self.format = None
+        self.fallbacks = 0
+        self.parse = lru_cache(maxsize=cache_size)(self._parse)
+
+    def _parse(self, value):
+        if self.format is not None:
+            try:
+                return _strict_parse(value, self.format)
+            except ValueError:
+                pass
+        for fmt in self.formats:
+            if fmt == self.format:
+                continue
+            try:
+                dt = _strict_parse(value, fmt)
+            except ValueError:
+                continue
+            self.format = fmt
+            return dt
+        self.fallbacks += 1
+        return parser.parse(value)
+
+    def cache_info(self):
+        """ Hits, misses and size of the parsed string cache."""
+        return self.parse.cache_info()
+
+
+# Parser shared by callers without a column of their own
+_default = DateParser()
+
+
+def parse_date(value):
+    """ Parse a date string with the shared DateParser."""
+    return _default.parse(value)
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_datetime(value):
+    """ Parse an RFC 3339 date time as returned by the Calendar API."""
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return parser.parse(value)
+
+
+@lru_cache(maxsize=TIMEZONE_CACHE_SIZE)
+def get_timezone(name):
+    """ Cached pytz.timezone."""
+    return pytz.timezone(name)
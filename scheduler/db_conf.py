@@ -2,18 +2,96 @@
 
 # Create DB
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session as BaseSession
+from contextlib import contextmanager
 import os
 
 # Define name and path for SQLite3 DB
 db_name = "data.db"
 db_path = os.path.join(os.getcwd(), db_name)
-engine = create_engine('sqlite:///' + db_path, echo=False)
+DEFAULT_URL = 'sqlite:///' + db_path
+
+# Engine the session is bound to - created on first use
+_engine = None
+
+
+def get_engine():
+    """ Get the engine, creating the default DB and its schema on first
+    use rather than when the package is imported."""
+    global _engine
+    if _engine is None:
+        _engine = create_engine(DEFAULT_URL, echo=False)
+        from scheduler.models import create_schema
+        create_schema(_engine)
+    return _engine
+
+
+def __getattr__(name):
+    # Keep db_conf.engine working without creating the engine on import
+    if name == 'engine':
+        return get_engine()
+    raise AttributeError(name)
+
+
+class LazySession(BaseSession):
+    """ Session that binds to get_engine() when first used."""
+
+    def get_bind(self, *args, **kwargs):
+        if self.bind is None:
+            self.bind = get_engine()
+        return super(LazySession, self).get_bind(*args, **kwargs)
+
 
 # Setup SQLAlchemy session
-Session = sessionmaker(bind=engine)
+Session = sessionmaker(class_=LazySession)
 session = Session()
 
+
+
+def configure(url):
+    """ Bind the session to a different database, e.g. 'sqlite://' for
+    a private in-memory DB. Returns the new engine.
+
+    The schema is not created - use models.create_schema().
+    """
+    global _engine
+    session.close()
+    _engine = create_engine(url, echo=False)
+    session.bind = _engine
+    return _engine
+
+# Depth of nested unit_of_work blocks - commits are deferred while > 0
+_depth = 0
+
+
+def commit():
+    """ Commit the session unless inside a unit_of_work block."""
+    if not _depth:
+        session.commit()
+
+
+@contextmanager
+def unit_of_work():
+    """ Defer commits made through commit() until the block exits.
+
+    Blocks may be nested; only the outermost block commits. The session
+    is rolled back if the block raises.
+    """
+    global _depth
+    _depth += 1
+    try:
+        yield session
+    except BaseException:
+        # Also on KeyboardInterrupt, so the depth is never left raised
+        if _depth == 1:
+            session.rollback()
+        raise
+    else:
+        if _depth == 1:
+            session.commit()
+    finally:
+        _depth -= 1
+
 #class SessionManager(object):
     #def __init__(self):
         #self.session = Session()
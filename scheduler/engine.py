@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+# In-memory index of unassigned time periods used by the scheduler
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+
+from scheduler.db_conf import session, commit
+from scheduler.metrics import incr, SLOT_SPLITS
+from scheduler.models import TimePeriod
+
+
+def _naive(dt):
+    """ Strip timezone info in the same way SQLite stores a datetime.
+
+    Time periods are converted to UTC before they are saved, so comparing
+    naive values here matches the comparisons made by the SQL queries.
+    """
+    if dt is not None and dt.tzinfo:
+        return dt.replace(tzinfo=None)
+    return dt
+
+
+# Smallest datetime step - used to turn inclusive ranges into half-open ones
+_TICK = timedelta(microseconds=1)
+
+
+def fit_minutes(duration, minutes, min_minutes=0):
+    """ Minutes of a slot of duration to assign to minutes of work.
+
+    With a minimum slot size of min_minutes the minutes are rounded up to
+    a multiple of it, and the whole slot is used rather than leaving a
+    free part shorter than min_minutes.
+    """
+    if min_minutes:
+        minutes = -(-minutes // min_minutes) * min_minutes
+    if minutes >= duration or duration - minutes < min_minutes:
+        return duration
+    return minutes
+
+
+def split_offset(minutes):
+    """ Time from the start of a slot to where minutes of it end, to the
+    microsecond (the split point of SlotIndex and slots.SlotArray)."""
+    return timedelta(seconds=minutes * 60)
+
+
+def find_first(starts, ends, startdate, enddate):
+    """ Position of the first slot that starts on or after startdate and
+    ends on or before enddate, in slots held as parallel starts and ends
+    sequences sorted by start (or None).
+
+    Used by the lookups of SlotIndex and slots.SlotArray.
+    """
+    pos = bisect_left(starts, startdate)
+    while pos < len(starts):
+        if starts[pos] > enddate:
+            break
+        if ends[pos] <= enddate:
+            return pos
+        pos += 1
+    return None
+
+
+class SlotIndex(object):
+    """ Unassigned time periods held in lists sorted by start time.
+
+    The index is loaded once per scheduling run. Assignments and splits
+    are made on the ORM objects in memory and written back with a single
+    commit when save() is called. Split off periods are added to the
+    session as they are created, so queries made before then (which
+    autoflush) see them like any other change.
+    """
+
+    def __init__(self, timeperiods=(), loaded=None, min_minutes=0):
+        self._starts = []
+        self._ends = []
+        self._slots = []
+        self._members = set()
+        self.created = []
+        # Range of start times loaded from the DB - None means everything
+        self._loaded = loaded
+        # Free parts shorter than this are not split off (see fit_minutes)
+        self.min_minutes = min_minutes
+        for tp in timeperiods:
+            self.add(tp, created=False)
+
+    @classmethod
+    def load(cls, startdate=None, enddate=None):
+        """ Build an index from the unassigned time periods in the DB.
+
+        If startdate and enddate are given only time periods starting in
+        that range are loaded, and others are loaded when lookups or
+        releases outside the range need them.
+        """
+        if startdate is None or enddate is None:
+            return cls(TimePeriod.get_unassigned())
+        startdate = _naive(startdate)
+        enddate = _naive(enddate) + _TICK
+        return cls(
+            TimePeriod.get_unassigned(startdate, enddate),
+            loaded=(startdate, enddate)
+        )
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __iter__(self):
+        return iter(self._slots)
+
+    def ensure_loaded(self, startdate, enddate):
+        """ Load any unassigned time periods starting between startdate
+        and enddate that are not in the index yet."""
+        if self._loaded is None:
+            return
+        lo, hi = self._loaded
+        startdate = _naive(startdate)
+        enddate = _naive(enddate) + _TICK
+        ranges = list()
+        if startdate < lo:
+            ranges.append((startdate, lo))
+            lo = startdate
+        if enddate > hi:
+            ranges.append((hi, enddate))
+            hi = enddate
+        self._loaded = (lo, hi)
+        for after, before in ranges:
+            for tp in TimePeriod.get_unassigned(after, before):
+                if tp not in self._members:
+                    self.add(tp, created=False)
+
+    def add(self, timeperiod, created=True):
+        """ Add an unassigned time period to the index, after any others
+        with the same start."""
+        start = _naive(timeperiod.startdatetime)
+        pos = bisect_right(self._starts, start)
+        self._starts.insert(pos, start)
+        self._ends.insert(pos, _naive(timeperiod.enddatetime))
+        self._slots.insert(pos, timeperiod)
+        self._members.add(timeperiod)
+        if created:
+            session.add(timeperiod)
+            self.created.append(timeperiod)
+
+    def _remove(self, pos):
+        del self._starts[pos]
+        del self._ends[pos]
+        timeperiod = self._slots.pop(pos)
+        self._members.discard(timeperiod)
+        return timeperiod
+
+    def _discard(self, timeperiod):
+        """ Delete a time period that has been merged into another."""
+        if timeperiod in self.created:
+            self.created.remove(timeperiod)
+        if timeperiod in session.new:
+            session.expunge(timeperiod)
+        else:
+            session.delete(timeperiod)
+
+    def release(self, timeperiod):
+        """ Unassign a time period and return it to the index.
+
+        The period is merged with any free periods that end where it
+        starts or start where it ends; merged rows are deleted.
+        """
+        start = _naive(timeperiod.startdatetime)
+        end = _naive(timeperiod.enddatetime)
+        self.ensure_loaded(start, end)
+        timeperiod.task = None
+        # Free period ending where this one starts
+        pos = bisect_left(self._starts, start)
+        for prev in range(pos - 1, -1, -1):
+            if self._ends[prev] == start:
+                merged = self._remove(prev)
+                merged.enddatetime = timeperiod.enddatetime
+                self._discard(timeperiod)
+                timeperiod = merged
+                break
+            if self._ends[prev] < start:
+                break
+        # Free period starting where this one ends
+        pos = bisect_left(self._starts, end)
+        if pos < len(self._starts) and self._starts[pos] == end:
+            merged = self._remove(pos)
+            timeperiod.enddatetime = merged.enddatetime
+            self._discard(merged)
+        self.add(timeperiod, created=False)
+        return timeperiod
+
+    def pop_first(self, startdate, enddate):
+        """ Remove and return the first unassigned time period that starts
+        on or after startdate and ends on or before enddate.
+
+        Returns None if there is no such time period.
+        """
+        if startdate is None or enddate is None:
+            return None
+        self.ensure_loaded(startdate, enddate)
+        pos = find_first(
+            self._starts, self._ends, _naive(startdate), _naive(enddate)
+            )
+        if pos is None:
+            return None
+        return self._remove(pos)
+
+    def assign(self, timeperiod, task, minutes):
+        """ Assign up to minutes of a popped time period to a task,
+        splitting it and returning the rest to the index if it is longer.
+
+        Returns the minutes assigned.
+        """
+        minutes = fit_minutes(timeperiod.duration, minutes, self.min_minutes)
+        if minutes >= timeperiod.duration:
+            # Assign task to time period
+            timeperiod.task = task
+            return timeperiod.duration
+        # Time period is longer than needed - split it into two periods
+        original_enddatetime = timeperiod.enddatetime
+        timeperiod.enddatetime = \
+            timeperiod.startdatetime + split_offset(minutes)
+        remainder = TimePeriod(timeperiod.enddatetime, original_enddatetime)
+        # Assign first time period to task
+        timeperiod.task = task
+        # Second time period goes back into the index
+        self.add(remainder)
+        incr(SLOT_SPLITS)
+        return minutes
+
+    def save(self):
+        """ Write all assignments and splits back to the DB."""
+        self.created = []
+        commit()
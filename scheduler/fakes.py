@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+
+# In-memory stand-in for the Sheets and Calendar APIs, so google_api and
+# core.run can be tested and benchmarked without credentials or network
+import json
+import os
+import re
+import tempfile
+import threading
+from email.parser import Parser
+from itertools import count
+
+from urllib.parse import urlparse, parse_qs, unquote
+
+import httplib2
+from dateutil import parser
+from googleapiclient import discovery_cache
+
+from scheduler.google_api import ApiClient, _rfc3339
+
+# Discovery documents bundled with the API client
+DOCUMENTS_DIR = os.path.join(
+    os.path.dirname(discovery_cache.__file__), 'documents'
+    )
+BOUNDARY = 'fake_batch_boundary'
+BATCH_CONTENT_TYPE = 'multipart/mixed; boundary="{0}"'.format(BOUNDARY)
+
+SHEET_VALUES = re.compile(r'^/v4/spreadsheets/([^/]*)/values/([^/]+)$')
+SPREADSHEET = re.compile(r'^/v4/spreadsheets/([^/]+)$')
+# Rows in the grid of a new sheet
+GRID_ROWS = 1000
+CALENDAR_EVENTS = re.compile(r'^/calendar/v3/calendars/([^/]*)/events$')
+CALENDAR_EVENT = re.compile(r'^/calendar/v3/calendars/([^/]*)/events/([^/]+)$')
+CALENDAR_BATCH = '/batch/calendar/v3'
+CALENDAR_FREEBUSY = '/calendar/v3/freeBusy'
+A1_ROWS = re.compile(r'^[A-Z]*(\d*)(?::[A-Z]*(\d*))?$')
+
+REASONS = {
+    403: 'rateLimitExceeded',
+    404: 'notFound',
+    409: 'duplicate',
+    410: 'deleted',
+    429: 'rateLimitExceeded'
+}
+
+
+def _start(event):
+    return parser.parse(event['start']['dateTime'])
+
+
+def _end(event):
+    return parser.parse(event['end']['dateTime'])
+
+
+class FakeGoogle(object):
+    """ Sheets and calendars held in memory and served by FakeHttp.
+
+    Supports getting sheet values, listing (with paging, time ranges
+    and sync tokens), inserting, patching and deleting calendar events,
+    freebusy queries and batch requests. Requests made are recorded in
+    requests. Errors can be injected with fail().
+    """
+
+    def __init__(self, page_size=None):
+        self.sheets = dict()
+        self.grid_rows = dict()
+        self.calendars = dict()
+        self.requests = list()
+        # Largest page returned when listing events (None - maxResults)
+        self.page_size = page_size
+        self._faults = list()
+        self._ids = count(1)
+        self._seq = count(1)
+        self._version = 0
+        self._lock = threading.RLock()
+
+    def add_sheet(self, sheet_id, values, rows=None):
+        """ Set the rows of a sheet (the first row is the header) and the
+        number of rows in its grid (default at least GRID_ROWS)."""
+        self.sheets[sheet_id] = [list(row) for row in values]
+        if rows is None:
+            rows = max(len(values), GRID_ROWS)
+        self.grid_rows[sheet_id] = rows
+
+    def add_events(self, calendar_id, events):
+        """ Add events to a calendar, giving ids to those without one."""
+        with self._lock:
+            for event in events:
+                self._store(calendar_id, dict(event))
+
+    def events(self, calendar_id):
+        """ Events in a calendar (not including deleted ones)."""
+        return [
+            event for event, _ in self.calendars.get(calendar_id, {}).values()
+            if event.get('status') != 'cancelled'
+            ]
+
+    def fail(self, status, times=1, method=None, after=False):
+        """ Fail the next times requests (with method, default any) with
+        an HTTP error status. A batch request is handled before the
+        requests inside it.
+
+        If after is True the requests are carried out before failing
+        (e.g. an insert that times out after the event was made); batch
+        requests themselves are not failed.
+        """
+        self._faults.extend([(status, method, after)] * times)
+
+    def http(self):
+        """ An httplib2.Http stand-in connected to this backend."""
+        return FakeHttp(self)
+
+    def client(self):
+        """ An ApiClient connected to this backend."""
+        return ApiClient(http=self.http(), cache_dir=tempfile.mkdtemp())
+
+    def _store(self, calendar_id, event):
+        if 'id' not in event:
+            event['id'] = 'e{0}'.format(next(self._ids))
+        self._version = next(self._seq)
+        self.calendars.setdefault(calendar_id, dict())[event['id']] = (
+            event, self._version
+            )
+        return event
+
+    def _fault(self, method, path):
+        for i, (status, fault_method, after) in enumerate(self._faults):
+            if after and path == CALENDAR_BATCH:
+                continue
+            if fault_method is None or fault_method == method:
+                del self._faults[i]
+                return status, after
+        return None, False
+
+    def request(self, method, uri, body=None, headers=None):
+        """ Handle a request, returning the status, content type and
+        response body."""
+        with self._lock:
+            url = urlparse(uri)
+            if '$discovery' in url.path:
+                status, result = self._discovery(url)
+            else:
+                self.requests.append((method, url.path))
+                status, after = self._fault(method, url.path)
+                if isinstance(body, bytes):
+                    body = body.decode('utf-8')
+                if status is not None and not after:
+                    result = self._error(status)
+                elif url.path == CALENDAR_BATCH:
+                    return 200, BATCH_CONTENT_TYPE, self._batch(
+                        body, (headers or {}).get('content-type')
+                        )
+                else:
+                    params = dict(
+                        (k, v[0]) for k, v in parse_qs(url.query).items()
+                        )
+                    fault = status
+                    status, result = self._route(
+                        method, unquote(url.path), params, body
+                        )
+                    if fault is not None:
+                        status, result = fault, self._error(fault)
+        content = json.dumps(result) if result is not None else ''
+        return status, 'application/json', content
+
+    def _route(self, method, path, params, body):
+        match = SHEET_VALUES.match(path)
+        if match and method == 'GET':
+            return self._values(match.group(1), match.group(2))
+        match = SPREADSHEET.match(path)
+        if match and method == 'GET':
+            return self._spreadsheet(match.group(1))
+        match = CALENDAR_EVENTS.match(path)
+        if match and method == 'GET':
+            return self._list(match.group(1), params)
+        if match and method == 'POST':
+            event = json.loads(body)
+            if event.get('id') in self.calendars.get(match.group(1), {}):
+                return 409, self._error(409)
+            return 200, self._store(match.group(1), event)
+        match = CALENDAR_EVENT.match(path)
+        if match:
+            return self._event(method, match.group(1), match.group(2), body)
+        if path == CALENDAR_FREEBUSY and method == 'POST':
+            return self._freebusy(json.loads(body))
+        return 404, self._error(404)
+
+    def _error(self, status):
+        return {'error': {
+            'code': status,
+            'message': 'Fake error',
+            'errors': [{'reason': REASONS.get(status, 'backendError')}]
+        }}
+
+    def _discovery(self, url):
+        # e.g. https://sheets.googleapis.com/$discovery/rest?version=v4
+        name = url.netloc.split('.')[0]
+        version = parse_qs(url.query).get('version', ['v1'])[0]
+        path = os.path.join(
+            DOCUMENTS_DIR, '{0}.{1}.json'.format(name, version)
+            )
+        try:
+            with open(path) as f:
+                return 200, json.load(f)
+        except (IOError, OSError):
+            return 404, self._error(404)
+
+    def _spreadsheet(self, sheet_id):
+        if sheet_id not in self.sheets:
+            return 404, self._error(404)
+        rows = self.grid_rows[sheet_id]
+        return 200, {'sheets': [{'properties': {
+            'title': 'Todo',
+            'gridProperties': {'rowCount': rows, 'columnCount': 26}
+        }}]}
+
+    def _values(self, sheet_id, a1_range):
+        if sheet_id not in self.sheets:
+            return 404, self._error(404)
+        match = A1_ROWS.match(a1_range.split('!')[-1])
+        if match is None:
+            return 400, self._error(400)
+        first = int(match.group(1) or 1)
+        last = int(match.group(2)) if match.group(2) else None
+        rows = self.sheets[sheet_id][first - 1:last]
+        # Like the real API, blank rows at the end of the range are left out
+        while rows and not any(rows[-1]):
+            rows.pop()
+        result = {'range': a1_range, 'majorDimension': 'ROWS'}
+        # Like the real API, an empty range has no values
+        if rows:
+            result['values'] = rows
+        return 200, result
+
+    def _list(self, calendar_id, params):
+        stored = self.calendars.get(calendar_id, {}).values()
+        if 'syncToken' in params:
+            try:
+                since = int(params['syncToken'])
+            except ValueError:
+                return 410, self._error(410)
+            events = [e for e, version in stored if version > since]
+        else:
+            events = [e for e, _ in stored]
+            if params.get('showDeleted') != 'true':
+                events = [e for e in events if e.get('status') != 'cancelled']
+            if 'timeMin' in params:
+                time_min = parser.parse(params['timeMin'])
+                events = [e for e in events if _end(e) > time_min]
+            if 'timeMax' in params:
+                time_max = parser.parse(params['timeMax'])
+                events = [e for e in events if _start(e) < time_max]
+            if params.get('orderBy') == 'startTime':
+                events.sort(key=_start)
+        offset = int(params.get('pageToken', 0))
+        size = int(params.get('maxResults', 250))
+        if self.page_size:
+            size = min(size, self.page_size)
+        result = {'items': events[offset:offset + size]}
+        if offset + size < len(events):
+            result['nextPageToken'] = str(offset + size)
+        else:
+            result['nextSyncToken'] = str(self._version)
+        return 200, result
+
+    def _freebusy(self, body):
+        time_min = parser.parse(body['timeMin'])
+        time_max = parser.parse(body['timeMax'])
+        calendars = dict()
+        for item in body.get('items', []):
+            if item['id'] not in self.calendars:
+                calendars[item['id']] = {'busy': [], 'errors': [
+                    {'domain': 'global', 'reason': 'notFound'}
+                    ]}
+                continue
+            # Busy times are clipped to the range and merged, like the API
+            busy = list()
+            for event in sorted(self.events(item['id']), key=_start):
+                if event.get('transparency') == 'transparent':
+                    continue
+                start = max(_start(event), time_min)
+                end = min(_end(event), time_max)
+                if start >= end:
+                    continue
+                if busy and start <= busy[-1][1]:
+                    busy[-1][1] = max(busy[-1][1], end)
+                else:
+                    busy.append([start, end])
+            calendars[item['id']] = {'busy': [
+                {'start': _rfc3339(start), 'end': _rfc3339(end)}
+                for start, end in busy
+                ]}
+        return 200, {
+            'kind': 'calendar#freeBusy', 'timeMin': body['timeMin'],
+            'timeMax': body['timeMax'], 'calendars': calendars
+        }
+
+    def _event(self, method, calendar_id, event_id, body):
+        event, _ = self.calendars.get(calendar_id, {}).get(
+            event_id, (None, None)
+            )
+        if event is None:
+            return 404, self._error(404)
+        if event.get('status') == 'cancelled':
+            return 410, self._error(410)
+        if method == 'GET':
+            return 200, event
+        if method == 'PATCH':
+            event = dict(event, **json.loads(body))
+            return 200, self._store(calendar_id, event)
+        if method == 'DELETE':
+            self._store(calendar_id, {'id': event_id, 'status': 'cancelled'})
+            return 204, None
+        return 405, self._error(405)
+
+    def _batch(self, body, content_type):
+        """ Handle each request in a multipart batch request body."""
+        message = Parser().parsestr(
+            'content-type: {0}\r\n\r\n{1}'.format(content_type, body)
+            )
+        parts = list()
+        for part in message.get_payload():
+            request_line, _, rest = part.get_payload().partition('\n')
+            method, uri = request_line.split(' ')[:2]
+            inner = Parser().parsestr(rest)
+            status, _, content = self.request(
+                method, uri, inner.get_payload() or None
+                )
+            parts.append(
+                '--{0}\r\n'
+                'Content-Type: application/http\r\n'
+                'Content-Transfer-Encoding: binary\r\n'
+                'Content-ID: <response-{1}>\r\n\r\n'
+                'HTTP/1.1 {2} Fake\r\n'
+                'Content-Type: application/json\r\n\r\n'
+                '{3}\r\n'.format(
+                    BOUNDARY, part['Content-ID'].strip('<>'), status, content
+                    )
+            )
+        return ''.join(parts) + '--{0}--'.format(BOUNDARY)
+
+
+class FakeHttp(object):
+    """ httplib2.Http stand-in sending requests to a FakeGoogle."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=1, connection_type=None):
+        status, content_type, content = self.backend.request(
+            method, uri, body, headers
+            )
+        response = httplib2.Response({
+            'status': str(status), 'content-type': content_type
+        })
+        return response, content.encode('utf-8')
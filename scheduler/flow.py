@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+# Exact (max-flow) allocation of task minutes to time periods
+from bisect import bisect_left
+from collections import deque
+from math import ceil
+
+from scheduler.engine import _naive
+
+SOURCE = 0
+SINK = 1
+
+
+class FlowNetwork(object):
+    """ Directed network with integer capacities solved with Dinic's
+    algorithm.
+
+    Edges are stored in flat lists; edge e and its residual edge e ^ 1
+    are added in pairs.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.graph = [[] for _ in range(size)]
+        self.to = []
+        self.cap = []
+
+    def add_node(self):
+        """ Add a node and return its number."""
+        self.graph.append([])
+        self.size += 1
+        return self.size - 1
+
+    def add_edge(self, u, v, capacity):
+        """ Add an edge from u to v and return its number."""
+        edge = len(self.to)
+        self.graph[u].append(edge)
+        self.to.append(v)
+        self.cap.append(capacity)
+        self.graph[v].append(edge + 1)
+        self.to.append(u)
+        self.cap.append(0)
+        return edge
+
+    def flow(self, edge):
+        """ Flow along an edge."""
+        return self.cap[edge ^ 1]
+
+    def _levels(self, source, sink):
+        level = [-1] * self.size
+        level[source] = 0
+        queue = deque([source])
+        while queue:
+            u = queue.popleft()
+            for e in self.graph[u]:
+                v = self.to[e]
+                if self.cap[e] > 0 and level[v] < 0:
+                    level[v] = level[u] + 1
+                    queue.append(v)
+        return level
+
+    def _augment(self, source, sink, level, current):
+        """ Push flow along one path of the level graph (0 if none)."""
+        path = []
+        u = source
+        while u != sink:
+            edges = self.graph[u]
+            while current[u] < len(edges):
+                e = edges[current[u]]
+                if self.cap[e] > 0 and level[self.to[e]] == level[u] + 1:
+                    break
+                current[u] += 1
+            else:
+                # Dead end - retreat along the path
+                if not path:
+                    return 0
+                e = path.pop()
+                u = self.to[e ^ 1]
+                current[u] += 1
+                continue
+            path.append(e)
+            u = self.to[e]
+        pushed = min(self.cap[e] for e in path)
+        for e in path:
+            self.cap[e] -= pushed
+            self.cap[e ^ 1] += pushed
+        return pushed
+
+    def max_flow(self, source, sink):
+        """ Increase the flow from source to sink to a maximum.
+
+        Returns the flow added by this call, so the network can be
+        extended and solved again.
+        """
+        total = 0
+        while True:
+            level = self._levels(source, sink)
+            if level[sink] < 0:
+                return total
+            current = [0] * self.size
+            pushed = self._augment(source, sink, level, current)
+            while pushed:
+                total += pushed
+                pushed = self._augment(source, sink, level, current)
+
+
+def remaining_minutes(task):
+    """ Minutes of a task left to schedule."""
+    return task.esttimemins*(1-(task.progress/100.0))
+
+
+def max_schedulable(tasks, timeperiods, startdate):
+    """ Find the most minutes of each task that can be scheduled before
+    its due date, maximising the total over all tasks.
+
+    Time periods are grouped by the earliest due date they end before,
+    so the network has one node per distinct due date, chained so a task
+    may use any earlier group, and one node per task:
+
+        source -> task (remaining minutes) -> due date group
+        group -> earlier group (unlimited) and group -> sink (capacity)
+
+    Critical tasks are given flow first; later augmenting paths never
+    reduce the flow out of the source so they keep their allocation.
+
+    Returns a list of minutes per task, in the order of tasks.
+    """
+    tasks = list(tasks)
+    startdate = _naive(startdate)
+    dues = sorted(set(
+        _naive(t.due) for t in tasks if t.due is not None
+        ))
+    capacity = [0] * len(dues)
+    for tp in timeperiods:
+        if _naive(tp.startdatetime) < startdate:
+            continue
+        group = bisect_left(dues, _naive(tp.enddatetime))
+        if group < len(dues):
+            capacity[group] += tp.duration
+
+    network = FlowNetwork(2 + len(dues))
+    unlimited = sum(capacity) + 1
+    for group, cap in enumerate(capacity):
+        network.add_edge(2 + group, SINK, cap)
+        if group:
+            network.add_edge(2 + group, 1 + group, unlimited)
+
+    source_edges = [None] * len(tasks)
+    for critical in (True, False):
+        for i, task in enumerate(tasks):
+            if bool(task.critical) != critical or task.due is None:
+                continue
+            node = network.add_node()
+            source_edges[i] = network.add_edge(
+                SOURCE, node, int(ceil(remaining_minutes(task)))
+                )
+            group = bisect_left(dues, _naive(task.due))
+            network.add_edge(node, 2 + group, unlimited)
+        network.max_flow(SOURCE, SINK)
+
+    return [
+        0 if edge is None else network.flow(edge) for edge in source_edges
+        ]
@@ -1,17 +1,24 @@
 # -*- coding: utf-8 -*-
 
-import httplib2
+import hashlib
+import os
+import threading
+import uuid
 
-from apiclient import discovery
-from oauth2client import client
-from oauth2client import tools
-from oauth2client.file import Storage
+# The API client, OAuth and HTTP libraries are slow to import, so they
+# are imported when credentials or services are first needed
+from googleapiclient.errors import HttpError
 
-from scheduler.models import Task, TimePeriod
+from scheduler.cache import SnapshotMissing, atomic_write
+from scheduler.dates import DateParser, get_timezone, parse_datetime
+from scheduler.metrics import span, timed
+from scheduler.retry import get_executor, error_status
+from scheduler.models import Task, TimePeriod, EVENT_KEY
 
 import pytz
-from datetime import datetime
-from dateutil import parser
+from datetime import datetime, timedelta
+from dateutil import tz
+from dateutil.rrule import rrulestr
 
 # The paths for the .json credential files are stored in a private.py file
 try:
@@ -29,8 +36,37 @@ APP_NAME = 'scheduler'
 CLIENT_SECRET_FILE = 'client_secret.json'
 CAL_CREDS_FILENAME = 'calendar_creds.json'
 SHEET_CREDS_FILENAME = 'sheets_creds.json'
+SHEETS_DISCOVERY_URL = (
+    'https://sheets.googleapis.com/$discovery/rest?'
+    'version=v4'
+)
+# Directory discovery documents are cached in between runs
+DISCOVERY_CACHE_DIR = os.path.join(os.getcwd(), '.discovery_cache')
+# Range of the todo list in the spreadsheet (first row is a header)
+SHEET_RANGE = 'Todo!A1:F'
+# Sheet and columns of the todo list, read a chunk of rows at a time
+SHEET_NAME = 'Todo'
+SHEET_COLUMNS = ('A', 'F')
+SHEET_CHUNK_ROWS = 1000
+# Columns a todo list row needs (ref, type, description, hours, due)
+TASK_COLUMNS = 5
+# Maximum number of requests sent in a single batch HTTP request
+BATCH_SIZE = 50
+# Number of days ahead work blocks are fetched for by default
+WORK_BLOCK_HORIZON_DAYS = 28
+# Number of events requested per page when listing events
+PAGE_SIZE = 250
+# Most calendars the freebusy endpoint accepts in one query
+FREEBUSY_MAX_CALENDARS = 50
+# Statuses of deleting an event that is already gone, e.g. deleted by an
+# earlier attempt of a retried batch
+DELETED_STATUSES = (404, 410)
+# Status of inserting an event with an id that is already used, e.g. by an
+# earlier attempt of a retried batch that failed after the event was made
+CONFLICT_STATUSES = (409,)
 
 
+@timed('google.get_credentials')
 def get_credentials(filename, scopes):
     """Gets valid user credentials from storage.
 
@@ -40,6 +76,9 @@ def get_credentials(filename, scopes):
     Returns:
         Credentials, the obtained credential.
     """
+    from oauth2client import client, tools
+    from oauth2client.file import Storage
+
     store = Storage(filename)
     credentials = store.get()
     if not credentials or credentials.invalid:
@@ -50,40 +89,386 @@ def get_credentials(filename, scopes):
     return credentials
 
 
-def get_tasks_from_sheet(sheet_id=SHEET_ID):
-    """ Get a list of tasks from Google Sheet. """
-    credentials = get_credentials(SHEET_CREDS_FILENAME, SHEET_SCOPES)
-    http = credentials.authorize(httplib2.Http())
-    discovery_url = (
-        'https://sheets.googleapis.com/$discovery/rest?'
-        'version=v4'
-    )
-    service = discovery.build('sheets', 'v4', http=http,
-                              discoveryServiceUrl=discovery_url)
+class FileCache(object):
+    """ On-disk cache of discovery documents.
 
-    range_name = 'Todo!A1:F'
-    result = service.spreadsheets().values().get(
-        spreadsheetId=sheet_id, range=range_name).execute()
-    values = result.get('values', [])
-    tasks = []
-    for value in values[1:]:
+    Implements the get / set interface of the API client's discovery
+    cache, so a document is only downloaded once per cache directory.
+    """
+
+    def __init__(self, directory=DISCOVERY_CACHE_DIR):
+        self.directory = directory
+
+    def _path(self, url):
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json'
+        return os.path.join(self.directory, name)
+
+    def get(self, url):
         try:
-            tasks.append(
-                Task(
-                    value[4],
-                    value[3],
-                    taskref=value[0],
-                    tasktype=value[1],
-                    description=value[2],
-                    timetype="hours"
+            with open(self._path(url)) as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def set(self, url, content):
+        os.makedirs(self.directory, exist_ok=True)
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
+        with atomic_write(self._path(url)) as f:
+            f.write(content)
+
+
+class ApiClient(object):
+    """ Google API services built once and reused between calls.
+
+    Credentials are read and each service is built on first use. The
+    authorized httplib2.Http objects are kept so connections are reused.
+    Pass http to use a single (e.g. fake) transport for all services.
+    """
+
+    def __init__(
+        self, cal_creds=CAL_CREDS_FILENAME, sheet_creds=SHEET_CREDS_FILENAME,
+        http=None, cache_dir=DISCOVERY_CACHE_DIR
+    ):
+        self.cal_creds = cal_creds
+        self.sheet_creds = sheet_creds
+        self.http = http
+        self.cache = FileCache(cache_dir)
+        self._services = dict()
+
+    def _authorize(self, filename, scopes):
+        if self.http is not None:
+            return self.http
+        import httplib2
+        credentials = get_credentials(filename, scopes)
+        return credentials.authorize(httplib2.Http())
+
+    @property
+    def calendar(self):
+        """ Calendar v3 service."""
+        if 'calendar' not in self._services:
+            from googleapiclient import discovery
+            http = self._authorize(self.cal_creds, CAL_SCOPES)
+            with span('google.discovery'):
+                self._services['calendar'] = discovery.build(
+                    'calendar', 'v3', http=http, cache=self.cache
+                    )
+        return self._services['calendar']
+
+    @property
+    def sheets(self):
+        """ Sheets v4 service."""
+        if 'sheets' not in self._services:
+            from googleapiclient import discovery
+            http = self._authorize(self.sheet_creds, SHEET_SCOPES)
+            with span('google.discovery'):
+                self._services['sheets'] = discovery.build(
+                    'sheets', 'v4', http=http, cache=self.cache,
+                    discoveryServiceUrl=SHEETS_DISCOVERY_URL
                     )
+        return self._services['sheets']
+
+
+# httplib2.Http is not thread-safe so each thread gets its own client
+_local = threading.local()
+
+
+def get_client():
+    """ Get the default ApiClient for the current thread."""
+    api_client = getattr(_local, 'client', None)
+    if api_client is None:
+        api_client = _local.client = ApiClient()
+    return api_client
+
+
+def get_calendar_service():
+    """ Get the Calendar API service of the default client."""
+    return get_client().calendar
+
+
+class BatchWriter(object):
+    """ Send API requests in batch HTTP requests of up to batch_size.
+
+    Successful responses are kept in the order the requests were added.
+    Failed requests do not stop the batch - each one is collected in
+    errors as a dict with the item it was added with and the exception.
+
+    Batches are sent through a RequestExecutor (default the shared one).
+    Requests in a batch that fail with a retryable error are sent again
+    in a smaller batch, so requests that succeeded are never repeated.
+    A failed request may still have been done, so only requests that are
+    safe to repeat should be added - see add_insert.
+    """
+
+    def __init__(self, service, batch_size=BATCH_SIZE, executor=None):
+        self.service = service
+        self.batch_size = batch_size
+        self.executor = executor or get_executor()
+        self.results = list()
+        self.errors = list()
+        self._pending = list()
+
+    def add(self, request, item=None, ok_statuses=(), ok_result=None):
+        """ Queue a request, sending a batch once batch_size is reached.
+
+        Errors with a status in ok_statuses count as success (with
+        ok_result as the response), e.g. 404 or 410 for a delete that was
+        already done by an earlier attempt.
+        """
+        self._pending.append((request, item, ok_statuses, ok_result))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def _send(self, pending, todo):
+        """ Send the requests at positions todo as one batch."""
+        responses = dict()
+
+        def callback(request_id, response, exception):
+            responses[request_id] = (response, exception)
+
+        batch = self.service.new_batch_http_request()
+        for i in todo:
+            batch.add(pending[i][0], callback=callback, request_id=str(i))
+        self.executor.throttle(len(todo))
+        with span('google.batch'):
+            batch.execute()
+        return responses
+
+    def flush(self):
+        """ Send all queued requests as a single batch."""
+        if not self._pending:
+            return
+        pending = self._pending
+        self._pending = list()
+        outcomes = [None] * len(pending)
+        todo = list(range(len(pending)))
+        attempt = 0
+        while todo:
+            try:
+                responses = self._send(pending, todo)
+            except HttpError as e:
+                # The whole batch failed - none of it was done
+                if not self.executor.should_retry(e, attempt):
+                    raise
+                self.executor.backoff(attempt)
+                attempt += 1
+                continue
+            retry = list()
+            for i in todo:
+                response, exception = responses[str(i)]
+                if error_status(exception) in pending[i][2]:
+                    response, exception = pending[i][3], None
+                elif exception is not None and \
+                        self.executor.should_retry(exception, attempt):
+                    retry.append(i)
+                    continue
+                outcomes[i] = (response, exception)
+            if retry:
+                self.executor.backoff(attempt)
+                attempt += 1
+            todo = retry
+
+        for (_, item, _, _), (response, exception) in zip(pending, outcomes):
+            if exception is not None:
+                self.errors.append({'item': item, 'error': exception})
+            else:
+                self.results.append(response)
+
+    def execute(self):
+        """ Send any remaining requests and return the responses."""
+        self.flush()
+        return self.results
+
+
+@timed('google.get_sheet_values')
+def get_sheet_values(sheet_id=SHEET_ID, service=None, cache=None):
+    """ Get the rows of the todo list from Google Sheet.
+
+    If a SnapshotCache is supplied a fresh snapshot is used instead of
+    fetching the sheet, and fetched values are stored in the cache.
+    """
+    key = 'sheet:{0}:{1}'.format(sheet_id, SHEET_RANGE)
+    if cache is not None:
+        snapshot = cache.load(key)
+        if cache.fresh(snapshot):
+            return snapshot['data']
+        if cache.offline:
+            raise SnapshotMissing(key)
+
+    if service is None:
+        service = get_client().sheets
+    result = get_executor().execute(service.spreadsheets().values().get(
+        spreadsheetId=sheet_id, range=SHEET_RANGE))
+    values = result.get('values', [])
+    if cache is not None:
+        cache.store(key, values)
+    return values
+
+
+@timed('google.get_sheet_row_count')
+def get_sheet_row_count(sheet_id=SHEET_ID, service=None):
+    """ Get the number of rows in the grid of the todo list sheet."""
+    if service is None:
+        service = get_client().sheets
+    result = get_executor().execute(service.spreadsheets().get(
+        spreadsheetId=sheet_id, ranges=SHEET_NAME,
+        fields='sheets.properties.gridProperties.rowCount'))
+    return result['sheets'][0]['properties']['gridProperties']['rowCount']
+
+
+def iter_sheet_rows(
+    sheet_id=SHEET_ID, service=None, chunk_rows=SHEET_CHUNK_ROWS
+):
+    """ Iterate over the rows of the todo list after the header, as
+    (row number, values) pairs.
+
+    Rows are fetched chunk_rows at a time (Todo!A2:F1001,
+    Todo!A1002:F2001, ...) up to the last row of the sheet, so only one
+    chunk is held in memory. The API leaves out blank rows at the end of
+    each range, so blank rows are not always yielded.
+    """
+    if service is None:
+        service = get_client().sheets
+    row_count = get_sheet_row_count(sheet_id, service)
+    first = 2
+    while first <= row_count:
+        last = first + chunk_rows - 1
+        a1_range = '{0}!{1}{2}:{3}{4}'.format(
+            SHEET_NAME, SHEET_COLUMNS[0], first, SHEET_COLUMNS[1], last
+            )
+        with span('google.get_sheet_chunk'):
+            result = get_executor().execute(
+                service.spreadsheets().values().get(
+                    spreadsheetId=sheet_id, range=a1_range)
                 )
-        except:
+        for row, value in enumerate(result.get('values', []), first):
+            yield row, value
+        first = last + 1
+
+
+def task_from_row(value, due_dates=None):
+    """ Build a task from a todo list row.
+
+    Raises ValueError if the row is incomplete or has a bad estimate or
+    due date.
+    """
+    if len(value) < TASK_COLUMNS:
+        raise ValueError('expected {0} columns, got {1}'.format(
+            TASK_COLUMNS, len(value)))
+    due = value[4].strip()
+    if not due:
+        raise ValueError('no due date')
+    try:
+        due = (due_dates or DateParser()).parse(due)
+    except (ValueError, OverflowError):
+        raise ValueError('bad due date {0!r}'.format(value[4]))
+    try:
+        hours = int(value[3])
+    except ValueError:
+        raise ValueError('bad estimate {0!r}'.format(value[3]))
+    return Task(
+        due,
+        hours,
+        taskref=value[0],
+        tasktype=value[1],
+        description=value[2],
+        timetype="hours"
+        )
+
+
+def iter_tasks(rows, errors=None):
+    """ Build tasks from (row number, values) pairs.
+
+    Blank rows are skipped. Rows that are not valid tasks are skipped
+    and reported in errors (if a list is supplied) as a dict with the
+    'row' number, task 'ref' and 'error' message.
+    """
+    due_dates = DateParser()
+    for row, value in rows:
+        if not any(value):
             continue
-    return tasks
+        try:
+            task = task_from_row(value, due_dates)
+        except ValueError as e:
+            if errors is not None:
+                errors.append({
+                    'row': row, 'ref': value[0] or None, 'error': str(e)
+                })
+            continue
+        yield task
+
+
+def tasks_from_values(values, errors=None):
+    """ Build tasks from todo list rows, skipping the header row.
+
+    See iter_tasks for errors.
+    """
+    return list(iter_tasks(enumerate(values[1:], 2), errors))
+
+
+def iter_tasks_from_sheet(
+    sheet_id=SHEET_ID, service=None, cache=None, errors=None,
+    chunk_rows=SHEET_CHUNK_ROWS
+):
+    """ Iterate over the tasks in Google Sheet, reading chunk_rows rows
+    at a time (see iter_sheet_rows and iter_tasks).
+
+    If a SnapshotCache is supplied the whole sheet is read through it
+    with get_sheet_values instead.
+    """
+    if cache is not None:
+        values = get_sheet_values(sheet_id, service, cache)
+        rows = enumerate(values[1:], 2)
+    else:
+        rows = iter_sheet_rows(sheet_id, service, chunk_rows)
+    return iter_tasks(rows, errors)
+
+
+def get_tasks_from_sheet(
+    sheet_id=SHEET_ID, service=None, cache=None, errors=None
+):
+    """ Get a list of tasks from Google Sheet. """
+    return list(iter_tasks_from_sheet(sheet_id, service, cache, errors))
+
+
+def event_id(event, salt=''):
+    """ Get a deterministic id for an event from its scheduler key and
+    salt (None for untagged events).
+
+    Ids are hex digests, which are valid base32hex Calendar event ids.
+    """
+    key = event_key(event)
+    if key is None:
+        return None
+    return hashlib.sha1(
+        u'{0}|{1}'.format(salt, key).encode('utf-8')
+        ).hexdigest()
+
+
+def add_insert(writer, service, calendar_id, event, salt):
+    """ Queue inserting an event so that retrying it is safe.
+
+    The event is given a client side id (see event_id), so an insert that
+    failed after the event was made gets a 409 when it is retried, which
+    counts as done. The salt should be new for each write of a calendar -
+    ids of deleted events can not be used again.
+    """
+    body = event
+    new_id = event_id(event, salt)
+    if new_id is not None:
+        body = dict(event, id=new_id)
+    writer.add(
+        service.events().insert(calendarId=calendar_id, body=body),
+        event, ok_statuses=CONFLICT_STATUSES if new_id else (),
+        ok_result=body
+    )
 
 
-def post_assigned_time(events, calendar_id=OUTPUT_CAL_ID):
+@timed('google.post_assigned_time')
+def post_assigned_time(
+    events, calendar_id=OUTPUT_CAL_ID, service=None, batch_size=BATCH_SIZE,
+    errors=None
+):
     """ Add events to output calendar.
 
     Each event is a dict in the following format:
@@ -99,78 +484,394 @@ def post_assigned_time(events, calendar_id=OUTPUT_CAL_ID):
         'dateTime': '2015-05-28T17:00:00-07:00',
         'timeZone': 'America/Los_Angeles',
       }
-    }"""
-    credentials = get_credentials(CAL_CREDS_FILENAME, CAL_SCOPES)
-    http = credentials.authorize(httplib2.Http())
-    service = discovery.build('calendar', 'v3', http=http)
+    }
+
+    Events are inserted using batch requests of up to batch_size, with
+    ids that make retried inserts safe (see add_insert). Events that fail
+    to insert are appended to errors (if a list is supplied).
+    """
+    if service is None:
+        service = get_calendar_service()
 
-    output_events = list()
+    writer = BatchWriter(service, batch_size)
+    salt = uuid.uuid4().hex
     for event in events:
-        output_events.append(
-            service.events().insert(
-                calendarId=OUTPUT_CAL_ID, body=event
-            ).execute()
-        )
+        add_insert(writer, service, calendar_id, event, salt)
+    output_events = writer.execute()
+    if errors is not None:
+        errors.extend(writer.errors)
     return output_events
 
 
-def get_work_blocks(calendar_id=INPUT_CAL_ID):
-    """ Gets free work blocks as defined in a Google calendar."""
-    credentials = get_credentials(CAL_CREDS_FILENAME, CAL_SCOPES)
-    http = credentials.authorize(httplib2.Http())
-    service = discovery.build('calendar', 'v3', http=http)
+def _event_to_timeperiod(event):
+    """ Create a new time period object from a work block event."""
+    # First deal with timezones (both times use the start's)
+    timezone = get_timezone(event['start']['timeZone'])
+    # Convert UTC times into timezone aware times
+    startdt = parse_datetime(event['start']['dateTime']) \
+        .replace(tzinfo=pytz.utc).astimezone(timezone)
+    enddt = parse_datetime(event['end']['dateTime']) \
+        .replace(tzinfo=pytz.utc).astimezone(timezone)
+    return TimePeriod(startdt, enddt)
+
+
+def _rfc3339(dt):
+    """ Format a datetime for the timeMin / timeMax parameters."""
+    if dt.tzinfo:
+        return dt.astimezone(pytz.utc).replace(tzinfo=None) \
+            .isoformat() + 'Z'
+    return dt.isoformat() + 'Z'  # 'Z' indicates UTC time
+
+
+def get_work_blocks(
+    calendar_id=INPUT_CAL_ID, service=None, time_min=None, time_max=None,
+    expand_recurring=False, cache=None
+):
+    """ Gets free work blocks as defined in a Google calendar.
+
+    See get_work_block_events for the arguments.
+    """
+    return timeperiods_from_events(get_work_block_events(
+        calendar_id, service, time_min, time_max, expand_recurring, cache
+        ))
+
+
+def timeperiods_from_events(events):
+    """ Build time periods from work block events."""
+    return [_event_to_timeperiod(event) for event in events]
+
+
+@timed('google.get_work_block_events')
+def get_work_block_events(
+    calendar_id=INPUT_CAL_ID, service=None, time_min=None, time_max=None,
+    expand_recurring=False, cache=None
+):
+    """ Gets the events defining free work blocks in a Google calendar.
+
+    Blocks between time_min (default now) and time_max (default
+    WORK_BLOCK_HORIZON_DAYS later) are fetched, following all result
+    pages. If expand_recurring is True recurring masters and their
+    exceptions are fetched and expanded locally, rather than having the
+    server return every instance.
+
+    If a SnapshotCache is supplied the calendar is read through it with
+    get_synced_events (recurring events are always expanded locally).
+    """
+    if time_min is None:
+        time_min = datetime.utcnow()
+    if time_max is None:
+        time_max = time_min + timedelta(days=WORK_BLOCK_HORIZON_DAYS)
+
+    if cache is not None:
+        events = get_synced_events(calendar_id, service, cache)
+        events = expand_recurring_events(events, time_min, time_max)
+    elif expand_recurring:
+        events = get_all_events(
+            calendar_id, service, timeMin=_rfc3339(time_min),
+            timeMax=_rfc3339(time_max), singleEvents=False, showDeleted=True,
+            maxResults=PAGE_SIZE
+            )
+        events = expand_recurring_events(events, time_min, time_max)
+    else:
+        events = get_all_events(
+            calendar_id, service, timeMin=_rfc3339(time_min),
+            timeMax=_rfc3339(time_max), singleEvents=True,
+            orderBy='startTime', maxResults=PAGE_SIZE
+            )
+    return events
 
-    now = datetime.utcnow().isoformat() + 'Z'  # 'Z' indicates UTC time
-    events_result = service.events().list(
-        calendarId=calendar_id, timeMin=now, maxResults=30, singleEvents=True,
-        orderBy='startTime').execute()
-    events = events_result.get('items', [])
 
-    time_periods = []
+@timed('google.freebusy')
+def get_freebusy(calendar_ids, service=None, time_min=None, time_max=None):
+    """ Get the busy times of calendars with the freebusy endpoint.
+
+    All the calendars are queried in one request (one per
+    FREEBUSY_MAX_CALENDARS). The time range defaults as for
+    get_work_block_events. Returns the response, with the busy intervals
+    (or errors) of each calendar in response['calendars'][calendar_id].
+    """
+    if service is None:
+        service = get_calendar_service()
+    if time_min is None:
+        time_min = datetime.utcnow()
+    if time_max is None:
+        time_max = time_min + timedelta(days=WORK_BLOCK_HORIZON_DAYS)
+    calendar_ids = list(calendar_ids)
+    response = {'calendars': {}}
+    for i in range(0, len(calendar_ids), FREEBUSY_MAX_CALENDARS):
+        body = {
+            'timeMin': _rfc3339(time_min),
+            'timeMax': _rfc3339(time_max),
+            'items': [
+                {'id': calendar_id} for calendar_id in
+                calendar_ids[i:i + FREEBUSY_MAX_CALENDARS]
+                ]
+        }
+        result = get_executor().execute(service.freebusy().query(body=body))
+        response['calendars'].update(result.get('calendars', {}))
+    return response
+
+
+@timed('google.get_synced_events')
+def get_synced_events(calendar_id, service=None, cache=None):
+    """ Get all events (recurring masters unexpanded) from a calendar,
+    using a SnapshotCache and sync tokens.
+
+    A fresh snapshot is used as it is. Otherwise only the events changed
+    since the snapshot's sync token are requested and merged in; if the
+    token has expired (HTTP 410) the calendar is fetched in full.
+    Deleted events are kept as cancelled so that cancelled instances of
+    recurring events are still known.
+    """
+    key = 'calendar:{0}'.format(calendar_id)
+    snapshot = cache.load(key)
+    if cache.fresh(snapshot):
+        return snapshot['data']
+    if cache.offline:
+        raise SnapshotMissing(key)
+
+    if service is None:
+        service = get_calendar_service()
+    events = None
+    if snapshot is not None and snapshot.get('sync_token'):
+        try:
+            changed, sync_token = _list_events(
+                service, calendar_id, syncToken=snapshot['sync_token'],
+                maxResults=PAGE_SIZE
+                )
+        except HttpError as e:
+            if e.resp.status != 410:
+                raise
+        else:
+            events = snapshot['data']
+            if changed:
+                by_id = dict((e['id'], e) for e in events)
+                for event in changed:
+                    by_id[event['id']] = event
+                events = list(by_id.values())
+    if events is None:
+        events, sync_token = _list_events(
+            service, calendar_id, showDeleted=True, maxResults=PAGE_SIZE
+            )
+    cache.store(key, events, sync_token)
+    return events
+
+
+def _event_time(field):
+    """ Convert an event start or end into a timezone aware datetime
+    in the event's timezone."""
+    dt = parse_datetime(field['dateTime'])
+    zone = tz.gettz(field.get('timeZone', 'UTC'))
+    if dt.tzinfo:
+        return dt.astimezone(zone)
+    return dt.replace(tzinfo=zone)
+
+
+def _has_times(event):
+    """ Does an event have a start and end time (all day events only have
+    dates)."""
+    return 'dateTime' in event.get('start', {}) and \
+        'dateTime' in event.get('end', {})
+
+
+def expand_recurring_events(events, time_min, time_max):
+    """ Expand recurring master events into single instances.
+
+    Takes events listed with singleEvents=False (and showDeleted=True)
+    and returns single events between time_min and time_max, ordered by
+    start, in the same format as the API returns with singleEvents=True.
+    Exceptions to a recurring event replace the original instance, or
+    remove it if cancelled. All day events, which are not work blocks,
+    are skipped.
+    """
+    if not time_min.tzinfo:
+        time_min = time_min.replace(tzinfo=tz.UTC)
+    if not time_max.tzinfo:
+        time_max = time_max.replace(tzinfo=tz.UTC)
+
+    masters = list()
+    exceptions = set()
+    instances = list()
     for event in events:
-        # Create a new time period object
-        # First deal with timezones
-        start_timezone = pytz.timezone(event['start']['timeZone'])
-        end_timezone = pytz.timezone(event['start']['timeZone'])
-        # Convert UTC times into timezone aware times
-        startdt = parser.parse(event['start']['dateTime']) \
-            .replace(tzinfo=pytz.utc).astimezone(start_timezone)
-        enddt = parser.parse(event['end']['dateTime']) \
-            .replace(tzinfo=pytz.utc).astimezone(end_timezone)
-        time_periods.append(TimePeriod(startdt, enddt))
-    return time_periods
-
-
-def get_all_events(calendar_id):
-    """ Get all events from a calendar."""
-    credentials = get_credentials(CAL_CREDS_FILENAME, CAL_SCOPES)
-    http = credentials.authorize(httplib2.Http())
-    service = discovery.build('calendar', 'v3', http=http)
+        if event.get('recurringEventId'):
+            if 'dateTime' not in event.get('originalStartTime', {}):
+                # Instance of an all day event
+                continue
+            exceptions.add((
+                event['recurringEventId'],
+                _event_time(event['originalStartTime'])
+            ))
+            if event.get('status') != 'cancelled' and _has_times(event):
+                instances.append(event)
+        elif event.get('status') == 'cancelled' or not _has_times(event):
+            continue
+        elif event.get('recurrence'):
+            masters.append(event)
+        else:
+            instances.append(event)
+
+    for master in masters:
+        start = _event_time(master['start'])
+        duration = _event_time(master['end']) - start
+        zone_name = master['start'].get('timeZone', 'UTC')
+        rule = rrulestr(
+            '\n'.join(master['recurrence']), dtstart=start, forceset=True
+            )
+        for occurrence in rule.between(time_min - duration, time_max):
+            if (master['id'], occurrence) in exceptions:
+                continue
+            instance = dict(master)
+            del instance['recurrence']
+            instance['id'] = '{0}_{1}'.format(
+                master['id'],
+                occurrence.astimezone(tz.UTC).strftime('%Y%m%dT%H%M%SZ')
+                )
+            instance['recurringEventId'] = master['id']
+            instance['start'] = {
+                'dateTime': occurrence.isoformat(), 'timeZone': zone_name
+            }
+            instance['end'] = {
+                'dateTime': (occurrence + duration).isoformat(),
+                'timeZone': master['end'].get('timeZone', zone_name)
+            }
+            instances.append(instance)
+
+    instances = [
+        i for i in instances
+        if _event_time(i['end']) > time_min and
+        _event_time(i['start']) < time_max
+        ]
+    instances.sort(key=lambda i: _event_time(i['start']))
+    return instances
+
 
+@timed('google.list_events')
+def _list_events(service, calendar_id, **params):
+    """ List events following all result pages.
+
+    Returns the events and the sync token from the last page.
+    """
     all_events = list()
     page_token = None
     while True:
-        event_results = service.events().list(
-            calendarId=calendar_id, pageToken=page_token
-            ).execute()
+        event_results = get_executor().execute(service.events().list(
+            calendarId=calendar_id, pageToken=page_token, **params
+            ))
         events = event_results.get('items', [])
-        all_events = all_events + events
+        all_events.extend(events)
         page_token = event_results.get('nextPageToken')
         if not page_token:
             break
-    return all_events
+    return all_events, event_results.get('nextSyncToken')
 
 
-def clear_events(calendar_id=OUTPUT_CAL_ID):
-    """ Wipe all events from a particular calendar."""
+def get_all_events(calendar_id, service=None, **params):
+    """ Get all events from a calendar.
+
+    Any extra keyword arguments are passed as list parameters, e.g.
+    timeMin / timeMax. All result pages are fetched.
+    """
+    if service is None:
+        service = get_calendar_service()
+    return _list_events(service, calendar_id, **params)[0]
+
+
+@timed('google.clear_events')
+def clear_events(
+    calendar_id=OUTPUT_CAL_ID, service=None, batch_size=BATCH_SIZE,
+    errors=None
+):
+    """ Wipe all events from a particular calendar.
+
+    Events are deleted using batch requests of up to batch_size. Events
+    that fail to delete are appended to errors (if a list is supplied).
+    """
+    if service is None:
+        service = get_calendar_service()
     # Get all events
-    events = get_all_events(calendar_id)
-    # Iterate through and delete all events
-    credentials = get_credentials(CAL_CREDS_FILENAME, CAL_SCOPES)
-    http = credentials.authorize(httplib2.Http())
-    service = discovery.build('calendar', 'v3', http=http)
+    events = get_all_events(calendar_id, service)
+    # Delete all events in batches
+    writer = BatchWriter(service, batch_size)
+    for event in events:
+        writer.add(
+            service.events().delete(
+                calendarId=calendar_id, eventId=event['id']
+                ),
+            event, ok_statuses=DELETED_STATUSES
+        )
+    writer.execute()
+    if errors is not None:
+        errors.extend(writer.errors)
+
+
+def event_key(event):
+    """ Get the scheduler key an event was tagged with (or None)."""
+    return event.get('extendedProperties', {}) \
+        .get('private', {}).get(EVENT_KEY)
+
 
+def _event_changed(new, old):
+    """ Does an existing event need patching to match a new event."""
+    for field in ('summary', 'description'):
+        if new.get(field) != old.get(field):
+            return True
+    for field in ('start', 'end'):
+        if _event_time(new[field]) != _event_time(old[field]):
+            return True
+    return False
+
+
+@timed('google.sync_events')
+def sync_events(
+    events, calendar_id=OUTPUT_CAL_ID, service=None, batch_size=BATCH_SIZE,
+    errors=None
+):
+    """ Sync a calendar with a list of events using a minimal diff.
+
+    The calendar is fetched once and existing events are matched to new
+    events by their scheduler key. New keys are inserted, changed events
+    are patched and any other events (including untagged ones) are
+    deleted. Unchanged events are left alone.
+
+    Returns the events now in the calendar.
+    """
+    if service is None:
+        service = get_calendar_service()
+
+    existing = dict()
+    stale = list()
+    for event in get_all_events(calendar_id, service):
+        key = event_key(event)
+        if key is None or key in existing:
+            stale.append(event)
+        else:
+            existing[key] = event
+
+    synced_events = list()
+    writer = BatchWriter(service, batch_size)
+    salt = uuid.uuid4().hex
     for event in events:
-        service.events().delete(
-            calendarId=calendar_id, eventId=event['id']
-            ).execute()
+        old = existing.pop(event_key(event), None)
+        if old is None:
+            add_insert(writer, service, calendar_id, event, salt)
+        elif _event_changed(event, old):
+            writer.add(
+                service.events().patch(
+                    calendarId=calendar_id, eventId=old['id'], body=event
+                    ),
+                event
+            )
+        else:
+            synced_events.append(old)
+    for event in stale + list(existing.values()):
+        writer.add(
+            service.events().delete(
+                calendarId=calendar_id, eventId=event['id']
+                ),
+            event, ok_statuses=DELETED_STATUSES
+        )
+    # Delete responses are empty so only keep inserted / patched events
+    synced_events.extend(r for r in writer.execute() if r)
+    if errors is not None:
+        errors.extend(writer.errors)
+    return synced_events
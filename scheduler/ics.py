@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+# iCalendar (.ics) file backend - work blocks are read from and scheduled
+# events written to local files instead of Google calendars. Files are
+# read and written one event at a time, never as a whole calendar.
+import hashlib
+import os
+import re
+from datetime import datetime, timedelta
+
+from dateutil import tz
+from icalendar import Event
+
+from scheduler.cache import atomic_write
+from scheduler.google_api import (
+    WORK_BLOCK_HORIZON_DAYS, event_key, expand_recurring_events, _event_time
+)
+from scheduler.models import TimePeriod, EVENT_KEY
+
+PRODID = '-//scheduler//scheduler//EN'
+# Property holding the scheduler key of written events
+KEY_PROPERTY = 'X-SCHEDULER-KEY'
+# Folded content line breaks (long lines continue on the next line after
+# a space or tab)
+FOLD = re.compile(r'\r?\n[ \t]')
+
+
+def read_vevents(path):
+    """ Iterate over the VEVENT components of an .ics file, parsing one
+    event at a time.
+
+    Timezones are resolved by TZID name; VTIMEZONE definitions in the
+    file are not read.
+    """
+    # Content is UTF-8 (RFC 5545), whatever the locale
+    with open(path, newline='', encoding='utf-8') as f:
+        lines = None
+        depth = 0
+        for line in f:
+            line = line.rstrip('\r\n')
+            if line == 'BEGIN:VEVENT':
+                lines = list()
+            if lines is None:
+                continue
+            lines.append(line)
+            if line.startswith('BEGIN:'):
+                depth += 1
+            elif line.startswith('END:'):
+                depth -= 1
+                if depth == 0:
+                    yield Event.from_ical('\r\n'.join(lines))
+                    lines = None
+
+
+def _field(value):
+    """ Event start / end in the format of the Calendar API."""
+    if not isinstance(value, datetime):
+        # All day event
+        return None
+    zone = 'UTC'
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=tz.UTC)
+    elif getattr(value.tzinfo, 'key', None):
+        zone = value.tzinfo.key
+    elif getattr(value.tzinfo, 'zone', None):
+        zone = value.tzinfo.zone
+    return {'dateTime': value.isoformat(), 'timeZone': zone}
+
+
+def vevent_to_event(vevent):
+    """ Convert a VEVENT to a Calendar API event dict (None for all day
+    events, which are not work blocks)."""
+    start = _field(vevent.decoded('DTSTART'))
+    if 'DTEND' in vevent:
+        end = _field(vevent.decoded('DTEND'))
+    elif 'DURATION' in vevent and start is not None:
+        end = _field(vevent.decoded('DTSTART') + vevent.decoded('DURATION'))
+    else:
+        end = start
+    if start is None or end is None:
+        return None
+    event = {
+        'id': str(vevent.get('UID', '')),
+        'summary': str(vevent.get('SUMMARY', '')),
+        'start': start,
+        'end': end
+    }
+    if str(vevent.get('STATUS', '')).upper() == 'CANCELLED':
+        event['status'] = 'cancelled'
+    # Lines are unfolded first so long rules and date lists are kept whole
+    ical = FOLD.sub('', vevent.to_ical().decode('utf-8'))
+    recurrence = [
+        line for line in ical.splitlines()
+        if line.startswith(('RRULE', 'RDATE', 'EXRULE', 'EXDATE'))
+        ]
+    if recurrence:
+        event['recurrence'] = recurrence
+    if 'RECURRENCE-ID' in vevent:
+        # Instance ids in the format the Calendar API uses
+        original = vevent.decoded('RECURRENCE-ID')
+        event['recurringEventId'] = event['id']
+        event['id'] = '{0}_{1}'.format(
+            event['id'], original.astimezone(tz.UTC).strftime('%Y%m%dT%H%M%SZ')
+            )
+        event['originalStartTime'] = _field(original)
+    if 'DESCRIPTION' in vevent:
+        event['description'] = str(vevent['DESCRIPTION'])
+    if KEY_PROPERTY in vevent:
+        event['extendedProperties'] = {
+            'private': {EVENT_KEY: str(vevent[KEY_PROPERTY])}
+        }
+    return event
+
+
+def _event_to_timeperiod(event):
+    return TimePeriod(_event_time(event['start']), _event_time(event['end']))
+
+
+def get_work_block_events(path, time_min=None, time_max=None):
+    """ Get the events defining free work blocks in an .ics file.
+
+    Blocks between time_min (default now) and time_max (default
+    WORK_BLOCK_HORIZON_DAYS later) are returned, in the same format as
+    google_api.get_work_block_events. Single events are yielded as they
+    are read; recurring events and their exceptions are kept until the
+    end of the file and then expanded.
+    """
+    if time_min is None:
+        time_min = datetime.utcnow()
+    if time_max is None:
+        time_max = time_min + timedelta(days=WORK_BLOCK_HORIZON_DAYS)
+    lo = time_min if time_min.tzinfo else time_min.replace(tzinfo=tz.UTC)
+    hi = time_max if time_max.tzinfo else time_max.replace(tzinfo=tz.UTC)
+    recurring = list()
+    for vevent in read_vevents(path):
+        event = vevent_to_event(vevent)
+        if event is None:
+            continue
+        if event.get('recurrence') or event.get('recurringEventId'):
+            recurring.append(event)
+        elif event.get('status') != 'cancelled' and \
+                _event_time(event['end']) > lo and \
+                _event_time(event['start']) < hi:
+            yield event
+    if recurring:
+        for event in expand_recurring_events(recurring, time_min, time_max):
+            yield event
+
+
+def get_work_blocks(path, time_min=None, time_max=None):
+    """ Get free work blocks (as time periods) from an .ics file.
+
+    See get_work_block_events for the arguments.
+    """
+    return [
+        _event_to_timeperiod(event)
+        for event in get_work_block_events(path, time_min, time_max)
+        ]
+
+
+def event_to_vevent(event):
+    """ Convert a Calendar API event dict to a VEVENT."""
+    vevent = Event()
+    key = event_key(event)
+    if key is not None:
+        uid = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        vevent.add(KEY_PROPERTY, key)
+    else:
+        uid = event.get('id') or hashlib.sha1(
+            repr(sorted(event.items())).encode('utf-8')).hexdigest()
+    vevent.add('UID', '{0}@scheduler'.format(uid))
+    vevent.add('DTSTAMP', datetime.now(tz.UTC))
+    vevent.add('DTSTART', _event_time(event['start']).astimezone(tz.UTC))
+    vevent.add('DTEND', _event_time(event['end']).astimezone(tz.UTC))
+    vevent.add('SUMMARY', event.get('summary') or '')
+    if event.get('description'):
+        vevent.add('DESCRIPTION', event['description'])
+    return vevent
+
+
+def post_assigned_time(events, path, errors=None):
+    """ Write events to an .ics file, replacing any existing file.
+
+    Events are serialized one at a time as they are read from events
+    (e.g. models.TimePeriod.iter_assigned_events()). Events that cannot
+    be converted are appended to errors (if a list is supplied) in the
+    same format as google_api.post_assigned_time.
+
+    Returns the events written.
+    """
+    written = list()
+    # Readers never see a partly written file
+    with atomic_write(path, 'wb') as f:
+        f.write(
+            'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:{0}\r\n'
+            .format(PRODID).encode('utf-8')
+            )
+        for event in events:
+            try:
+                vevent = event_to_vevent(event)
+            except (KeyError, TypeError, ValueError) as e:
+                if errors is not None:
+                    errors.append({'item': event, 'error': e})
+                continue
+            f.write(vevent.to_ical())
+            written.append(event)
+        f.write(b'END:VCALENDAR\r\n')
+    return written
+
+
+def clear_events(path):
+    """ Remove an output .ics file."""
+    if os.path.exists(path):
+        os.remove(path)
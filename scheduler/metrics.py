@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+# Timing spans and counters for the stages of a run. Nothing is recorded
+# (and the hot paths only pay for a list check) until a sink is added.
+import json
+import logging
+import threading
+import time
+from functools import wraps
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from scheduler.cache import atomic_write
+
+# Counters recorded by the scheduler
+SQL_STATEMENTS = 'sql_statements'
+SQL_SECONDS = 'sql_seconds'
+COMMITS = 'commits'
+HTTP_REQUESTS = 'http_requests'
+HTTP_RETRIES = 'http_retries'
+SLOT_SPLITS = 'slot_splits'
+SLOT_MERGES = 'slot_merges'
+
+_sinks = list()
+_installed = False
+
+
+class MemorySink(object):
+    """ Collect spans (count, total and longest time) and counters."""
+
+    def __init__(self):
+        self.spans = dict()
+        self.counters = dict()
+        self._lock = threading.Lock()
+
+    def span(self, name, seconds):
+        with self._lock:
+            stats = self.spans.setdefault(
+                name, {'count': 0, 'seconds': 0.0, 'max': 0.0}
+                )
+            stats['count'] += 1
+            stats['seconds'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+
+    def count(self, name, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def flush(self):
+        pass
+
+    def summary(self):
+        """ Spans and counters as a printable table."""
+        lines = ['{0:<32} {1:>6} {2:>10} {3:>10}'.format(
+            'span', 'count', 'total s', 'max s')]
+        for name in sorted(self.spans):
+            stats = self.spans[name]
+            lines.append('{0:<32} {1:>6} {2:>10.3f} {3:>10.3f}'.format(
+                name, stats['count'], stats['seconds'], stats['max']))
+        lines.append('')
+        for name in sorted(self.counters):
+            value = self.counters[name]
+            if isinstance(value, float):
+                value = '{0:.3f}'.format(value)
+            lines.append('{0:<32} {1:>6}'.format(name, value))
+        return '\n'.join(lines)
+
+
+class LogSink(object):
+    """ Log each span as a JSON record, and the counters when flushed."""
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger('scheduler.metrics')
+        self.level = level
+        self.counters = dict()
+        self._lock = threading.Lock()
+
+    def span(self, name, seconds):
+        self.logger.log(self.level, json.dumps(
+            {'span': name, 'seconds': round(seconds, 6)}
+            ))
+
+    def count(self, name, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def flush(self):
+        with self._lock:
+            counters, self.counters = self.counters, dict()
+        if counters:
+            self.logger.log(self.level, json.dumps(
+                {'counters': counters}, sort_keys=True
+                ))
+
+
+class PrometheusSink(MemorySink):
+    """ Write the collected metrics to a file in the Prometheus text
+    format when flushed, e.g. for the node exporter textfile collector."""
+
+    def __init__(self, path, prefix='scheduler'):
+        super(PrometheusSink, self).__init__()
+        self.path = path
+        self.prefix = prefix
+
+    def render(self):
+        lines = list()
+        span_metrics = (
+            ('span_seconds_total', 'seconds', 'counter'),
+            ('span_seconds_max', 'max', 'gauge'),
+            ('span_count', 'count', 'counter')
+        )
+        with self._lock:
+            for suffix, field, kind in span_metrics:
+                metric = '{0}_{1}'.format(self.prefix, suffix)
+                lines.append('# TYPE {0} {1}'.format(metric, kind))
+                for name in sorted(self.spans):
+                    lines.append('{0}{{span="{1}"}} {2}'.format(
+                        metric, name, self.spans[name][field]))
+            for name in sorted(self.counters):
+                metric = '{0}_{1}_total'.format(self.prefix, name)
+                lines.append('# TYPE {0} counter'.format(metric))
+                lines.append('{0} {1}'.format(metric, self.counters[name]))
+        return '\n'.join(lines) + '\n'
+
+    def flush(self):
+        with atomic_write(self.path) as f:
+            f.write(self.render())
+
+
+def add_sink(sink):
+    """ Start sending metrics to a sink. Returns the sink."""
+    _install()
+    _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    """ Stop sending metrics to a sink."""
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+def flush():
+    """ Flush all sinks, e.g. at the end of a run."""
+    for sink in list(_sinks):
+        sink.flush()
+
+
+def incr(name, value=1):
+    """ Add value to a counter."""
+    if _sinks:
+        for sink in list(_sinks):
+            sink.count(name, value)
+
+
+class span(object):
+    """ Context manager timing a block as the span name."""
+
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+        self.started = None
+
+    def __enter__(self):
+        if _sinks:
+            self.started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.started is not None:
+            elapsed = time.time() - self.started
+            for sink in list(_sinks):
+                sink.span(self.name, elapsed)
+        return False
+
+
+def timed(name):
+    """ Decorator timing each call of a function as the span name."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if _sinks:
+        conn.info.setdefault('metrics_started', []).append(time.time())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    started = conn.info.get('metrics_started')
+    if started:
+        incr(SQL_SECONDS, time.time() - started.pop())
+        incr(SQL_STATEMENTS)
+
+
+def _after_commit(session):
+    incr(COMMITS)
+
+
+def _install():
+    """ Count SQL statements and commits of every engine and session."""
+    global _installed
+    if _installed:
+        return
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(Session, 'after_commit', _after_commit)
+    _installed = True
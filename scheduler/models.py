@@ -2,9 +2,9 @@
 
 # Skeleton for setting up a basic SQLAlchemy mapping to a SQLite 3 DB
 from datetime import datetime
-from dateutil import parser
 import pytz
 
+from itertools import islice
 from math import ceil, floor
 
 import json
@@ -12,16 +12,24 @@ import json
 # Setup imports
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.declarative import declared_attr
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
 
 # Define Class for Excluded Matter Case Details
 from sqlalchemy import Column, Integer, String, Boolean, Text, \
-                        ForeignKey, DateTime
+                        ForeignKey, DateTime, Index, cast, func, text
 
-from scheduler.db_conf import session, engine
+from scheduler import db_conf
+from scheduler.dates import parse_date
+from scheduler.db_conf import session, commit as db_commit
 
 Base = declarative_base()
 
+# Private extended property used to tag events posted by the scheduler
+EVENT_KEY = 'schedulerKey'
+# Number of objects inserted per executemany by save_all
+SAVE_BATCH_SIZE = 1000
+
 
 class ExtMixin(object):
     """ Extensions to Base class. """
@@ -44,25 +52,29 @@ class ExtMixin(object):
             temp_dict[c.name] = cur_attr
         return temp_dict
 
-    def save(self):
+    def save(self, commit=True):
         """
         Save a model instance.
 
+        :param commit: commit the session (deferred in a unit_of_work)
         :return: Model instance
         """
         session.add(self)
-        session.commit()
+        if commit:
+            db_commit()
 
         return self
 
-    def delete(self):
+    def delete(self, commit=True):
         """
         Delete a model instance.
 
+        :param commit: commit the session (deferred in a unit_of_work)
         :return: session.commit()'s result
         """
         session.delete(self)
-        return session.commit()
+        if commit:
+            return db_commit()
 
     def __repr__(self):
         return json.dumps(self.as_dict())
@@ -73,10 +85,34 @@ class ExtMixin(object):
         return session.query(cls).all()
 
     @classmethod
-    def delete_all(cls):
+    def get_by_ids(cls, ids):
+        """ Get all objects with the supplied ids."""
+        return session.query(cls).filter(cls.id.in_(list(ids))).all()
+
+    @classmethod
+    def save_all(cls, objects, commit=True, batch_size=SAVE_BATCH_SIZE):
+        """ Insert many new model instances using executemany.
+
+        Objects may be any iterable (e.g. a generator); they are inserted
+        batch_size at a time so only one batch is held in memory.
+        Relationships are not cascaded and the instances are not attached
+        to the session afterwards - query them back if needed.
+        """
+        objects = iter(objects)
+        while True:
+            batch = list(islice(objects, batch_size))
+            if not batch:
+                break
+            session.bulk_save_objects(batch)
+        if commit:
+            return db_commit()
+
+    @classmethod
+    def delete_all(cls, commit=True):
         """ Delete all objects."""
         session.query(cls).delete()
-        return session.commit()
+        if commit:
+            return db_commit()
 
 
 # Task Models
@@ -103,7 +139,7 @@ class Task(ExtMixin, Base):
         """ Initialise object - needs at least a duedate and time est. """
 
         if not isinstance(duedate, datetime):
-            duedate = parser.parse(duedate)
+            duedate = parse_date(duedate)
         self.due = duedate
 
         if timetype == "hours":
@@ -121,8 +157,34 @@ class Task(ExtMixin, Base):
         time_left = floor(
             self.esttimemins*(1-(self.progress/100.0))
         )
-        tp_times = sum([tp.duration for tp in self.timeperiods])
-        return tp_times >= time_left
+        return self.assigned_minutes >= time_left
+
+    @property
+    def assigned_minutes(self):
+        """ Total duration of the time periods assigned to the task."""
+        if self.id is None:
+            return sum([tp.duration for tp in self.timeperiods])
+        return session.query(
+            func.coalesce(func.sum(TimePeriod.duration), 0)
+            ).filter(TimePeriod.task_id == self.id).scalar()
+
+    @classmethod
+    def report(cls):
+        """ Get assigned and remaining minutes for all tasks in a single
+        query. Returns rows of (id, taskref, due, assigned, remaining).
+
+        """
+        assigned = func.coalesce(func.sum(TimePeriod.duration), 0)
+        time_left = cast(
+            cls.esttimemins*(1-(func.coalesce(cls.progress, 0)/100.0)),
+            Integer
+        )
+        return session.query(
+            cls.id, cls.taskref, cls.due,
+            assigned.label('assigned'),
+            func.max(time_left - assigned, 0).label('remaining')
+            ).outerjoin(TimePeriod, TimePeriod.task_id == cls.id) \
+            .group_by(cls.id).order_by(cls.id).all()
 
     def reset_assignments(self):
         """ Clear all existing assignments. """
@@ -139,6 +201,16 @@ class TimePeriod(ExtMixin, Base):
     task_id = Column(Integer, ForeignKey('task.id'))
     task = relationship("Task", back_populates="timeperiods")
 
+    __table_args__ = (
+        # Assigned periods of a task, ordered by start
+        Index('ix_timeperiod_task_start', 'task_id', 'startdatetime'),
+        # Partial index for finding unassigned periods in a date range
+        Index(
+            'ix_timeperiod_unassigned', 'startdatetime', 'enddatetime',
+            sqlite_where=text('task_id IS NULL')
+        ),
+    )
+
     def __init__(self, start, end):
         if start.tzinfo:
             self.startdatetime = start.astimezone(pytz.utc)
@@ -154,7 +226,7 @@ class TimePeriod(ExtMixin, Base):
         """ Is time period available for assignment."""
         return not self.task
 
-    @property
+    @hybrid_property
     def duration(self):
         """ Duration of time period in minutes. """
         try:
@@ -172,6 +244,16 @@ class TimePeriod(ExtMixin, Base):
             duration = ceil(duration / 60.0)
         return duration
 
+    @duration.expression
+    def duration(cls):
+        """ Duration in minutes as a SQL (SQLite) expression."""
+        # Difference in whole milliseconds, rounded up to whole minutes
+        millis = cast(func.round(
+            (func.julianday(cls.enddatetime) -
+             func.julianday(cls.startdatetime)) * 86400000
+            ), Integer)
+        return cast((millis + 59999) / 60000, Integer)
+
     @classmethod
     def unassigned_in_range(cls, startdate, enddate):
         """ Get first unassigned time period in the supplied
@@ -183,6 +265,30 @@ class TimePeriod(ExtMixin, Base):
             .filter(cls.enddatetime <= enddate) \
             .order_by(cls.startdatetime).first()
 
+    @classmethod
+    def get_unassigned(cls, after=None, before=None):
+        """ Get unassigned time periods, optionally only those starting
+        on or after after and before before. Ordered by startdatetime.
+
+        """
+        query = session.query(cls).filter(cls.task_id == None)
+        if after is not None:
+            query = query.filter(cls.startdatetime >= after)
+        if before is not None:
+            query = query.filter(cls.startdatetime < before)
+        return query.order_by(cls.startdatetime, cls.id).all()
+
+    @classmethod
+    def assigned_in_range(cls, startdate, enddate):
+        """ Get assigned time periods in the supplied date range.
+        Ordered by startdatetime.
+
+        """
+        return session.query(cls).filter(cls.task_id != None) \
+            .filter(cls.startdatetime >= startdate) \
+            .filter(cls.enddatetime <= enddate) \
+            .order_by(cls.startdatetime).all()
+
     @classmethod
     def get_assigned(cls):
         """ Get all assigned time periods."""
@@ -190,7 +296,11 @@ class TimePeriod(ExtMixin, Base):
 
     def as_event(self):
         """ Output the time period in a dict format that can be
-        easily added as an event to Google calendar."""
+        easily added as an event to Google calendar.
+
+        The event is tagged with a stable key (task ref + start time) so
+        that later runs can sync changes rather than repost everything.
+        """
         if self.task:
             summary = self.task.taskref
             desc = self.task.description
@@ -198,17 +308,52 @@ class TimePeriod(ExtMixin, Base):
             summary = None
             desc = self.description
 
-        return {
-            'summary': summary,
-            'description': desc,
-            'start': {
-                'dateTime': self.startdatetime.isoformat(),
-                'timeZone': pytz.utc.zone
-            },
-            'end': {
-                'dateTime': self.enddatetime.isoformat(),
-                'timeZone': pytz.utc.zone
-            }
-        }
+        return make_event(
+            summary, desc, self.startdatetime, self.enddatetime
+        )
 
-Base.metadata.create_all(engine)
+    @classmethod
+    def iter_assigned_events(cls, batch_size=500):
+        """ Yield all assigned time periods as events (see as_event).
+
+        Time periods and their tasks are read with a single query, a
+        batch of rows at a time, without loading ORM objects.
+        """
+        query = session.query(
+            cls.startdatetime, cls.enddatetime,
+            Task.taskref, Task.description
+            ).join(Task, cls.task_id == Task.id) \
+            .order_by(cls.startdatetime).yield_per(batch_size)
+        for start, end, taskref, description in query:
+            yield make_event(taskref, description, start, end)
+
+
+def make_event(summary, description, start, end):
+    """ Build a Google calendar event for a block of time."""
+    start = start.isoformat()
+    return {
+        'summary': summary,
+        'description': description,
+        'start': {
+            'dateTime': start,
+            'timeZone': pytz.utc.zone
+        },
+        'end': {
+            'dateTime': end.isoformat(),
+            'timeZone': pytz.utc.zone
+        },
+        'extendedProperties': {
+            'private': {EVENT_KEY: u'{0}|{1}'.format(summary, start)}
+        }
+    }
+
+
+def create_schema(bind=None):
+    """ Create the tables and indexes (default on the current engine)."""
+    if bind is None:
+        bind = db_conf.engine
+    Base.metadata.create_all(bind)
+    # create_all only creates indexes with new tables - add any missing ones
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind, checkfirst=True)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+# Scheduling policies - decide the order tasks are scheduled in
+from heapq import heapify, heappop
+
+from scheduler.engine import _naive
+
+
+class Policy(object):
+    """ Schedule tasks in the order they are supplied (insertion order).
+
+    Subclasses override order() to change the order tasks are given
+    slots in.
+    """
+
+    name = 'insertion'
+
+    def key(self, task):
+        """ Priority key of a task - lower keys are scheduled first."""
+        return ()
+
+    def rank(self, task):
+        """ Position of a saved task in the order, comparable between
+        tasks. Ties on key are broken by id (insertion order)."""
+        return (self.key(task), task.id)
+
+    def order(self, tasks):
+        """ Yield tasks in the order they should be scheduled."""
+        return iter(tasks)
+
+
+class HeapPolicy(Policy):
+    """ Schedule tasks by a priority key using a binary heap.
+
+    Ties are broken by insertion order.
+    """
+
+    def order(self, tasks):
+        heap = [(self.key(task), i, task) for i, task in enumerate(tasks)]
+        heapify(heap)
+        while heap:
+            yield heappop(heap)[2]
+
+
+class EarliestDeadlineFirst(HeapPolicy):
+    """ Schedule the task with the earliest due date first."""
+
+    name = 'edf'
+
+    def key(self, task):
+        # Tasks without a due date go last
+        return (task.due is None, _naive(task.due))
+
+
+class CriticalFirst(EarliestDeadlineFirst):
+    """ Schedule critical tasks first, each group by earliest due date."""
+
+    name = 'critical'
+
+    def key(self, task):
+        return (not task.critical,) + \
+            super(CriticalFirst, self).key(task)
+
+
+POLICIES = dict(
+    (policy.name, policy)
+    for policy in (Policy(), EarliestDeadlineFirst(), CriticalFirst())
+)
+
+
+def get_policy(policy):
+    """ Get a policy instance from a policy or its name."""
+    if policy is None:
+        return POLICIES['insertion']
+    if isinstance(policy, Policy):
+        return policy
+    try:
+        return POLICIES[policy]
+    except KeyError:
+        raise ValueError('Unknown scheduling policy: {0}'.format(policy))
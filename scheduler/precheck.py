@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+# Fast check of which tasks can fit before their due dates, run before
+# (or instead of) scheduling. Uses NumPy when it is installed, imported
+# on first use so importing the scheduler does not load it.
+from bisect import bisect_right
+from itertools import accumulate
+
+from scheduler.flow import remaining_minutes
+from scheduler.slots import MINUTE, SlotArray, to_epoch
+
+# Earlier than any time - the due date of tasks without one (nothing ends
+# before it) and the start when no startdate is given
+_MIN_TIME = -2 ** 62
+
+
+def _slot_columns(slots):
+    """ Start and end times of slots (a SlotArray or time periods) as
+    microseconds since the epoch."""
+    if isinstance(slots, SlotArray):
+        return slots.columns()
+    starts = list()
+    ends = list()
+    for slot in slots:
+        starts.append(to_epoch(slot.startdatetime))
+        ends.append(to_epoch(slot.enddatetime))
+    return starts, ends
+
+
+def _has_numpy():
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _precheck_numpy(starts, ends, dues, remaining, start):
+    import numpy
+    starts = numpy.asarray(starts, dtype=numpy.int64)
+    ends = numpy.asarray(ends, dtype=numpy.int64)
+    dues = numpy.asarray(dues, dtype=numpy.int64)
+    remaining = numpy.asarray(remaining, dtype=numpy.float64)
+    keep = starts >= start
+    ends = ends[keep]
+    # Minutes per slot, rounded up like TimePeriod.duration
+    durations = -((starts[keep] - ends) // MINUTE)
+    order = numpy.argsort(ends, kind='stable')
+    ends = ends[order]
+    cumulative = numpy.concatenate(([0], numpy.cumsum(durations[order])))
+    capacity = cumulative[numpy.searchsorted(ends, dues, side='right')]
+
+    # Demand of all tasks due on or before each task's due date
+    has_due = dues != _MIN_TIME
+    order = numpy.argsort(dues[has_due], kind='stable')
+    sorted_dues = dues[has_due][order]
+    demand = numpy.concatenate(
+        ([0.0], numpy.cumsum(remaining[has_due][order]))
+        )
+    demand = demand[numpy.searchsorted(sorted_dues, dues, side='right')]
+    demand[~has_due] = remaining[~has_due]
+    return capacity.tolist(), (capacity - demand).tolist()
+
+
+def _precheck_python(starts, ends, dues, remaining, start):
+    slots = sorted(
+        (end, -((s - end) // MINUTE)) for s, end in zip(starts, ends)
+        if s >= start
+        )
+    ends = [end for end, _ in slots]
+    cumulative = [0] + list(accumulate(d for _, d in slots))
+    capacity = [cumulative[bisect_right(ends, due)] for due in dues]
+
+    due_tasks = sorted(
+        (due, r) for due, r in zip(dues, remaining) if due != _MIN_TIME
+        )
+    sorted_dues = [due for due, _ in due_tasks]
+    demand = [0.0] + list(accumulate(r for _, r in due_tasks))
+    slack = list()
+    for due, r, cap in zip(dues, remaining, capacity):
+        if due == _MIN_TIME:
+            slack.append(cap - r)
+        else:
+            slack.append(cap - demand[bisect_right(sorted_dues, due)])
+    return capacity, slack
+
+
+def precheck(tasks, slots, startdate=None, use_numpy=None):
+    """ Check how much free time each task has before its due date.
+
+    Slots are free time periods (a SlotArray, or Slot / TimePeriod
+    records); only those starting on or after startdate count. The
+    capacity of a task is the minutes of slots ending by its due date,
+    and its slack is the capacity left after every task due by then
+    (including itself) gets its remaining minutes. Tasks without a due
+    date cannot be scheduled and have no capacity.
+
+    NumPy is used if it is installed, unless use_numpy is False.
+
+    Returns a dict with 'feasible' - can every task be fully scheduled
+    earliest deadline first - and 'tasks', a dict per task in the order
+    given with the task, its 'remaining' minutes, 'capacity' and 'slack'.
+    A task with capacity < remaining can not be fully scheduled. Slack
+    < 0 means not all of the tasks due by then can be.
+    """
+    tasks = list(tasks)
+    if use_numpy is None:
+        use_numpy = _has_numpy()
+    starts, ends = _slot_columns(slots)
+    start = _MIN_TIME if startdate is None else to_epoch(startdate)
+    dues = [
+        _MIN_TIME if t.due is None else to_epoch(t.due) for t in tasks
+        ]
+    remaining = [remaining_minutes(t) for t in tasks]
+    check = _precheck_numpy if use_numpy else _precheck_python
+    capacity, slack = check(starts, ends, dues, remaining, start)
+    return {
+        'feasible': all(
+            s >= 0 for s, r in zip(slack, remaining) if r > 0
+            ),
+        'tasks': [
+            {'task': t, 'remaining': r, 'capacity': c, 'slack': s}
+            for t, r, c, s in zip(tasks, remaining, capacity, slack)
+            ]
+    }
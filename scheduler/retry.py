@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+# Rate limiting and retries for Google API requests
+import json
+import random
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+from scheduler.metrics import incr, HTTP_REQUESTS, HTTP_RETRIES
+
+# Sustained requests per second allowed by the default executor
+DEFAULT_RATE = 10.0
+# Requests that may be sent in a burst above the sustained rate
+DEFAULT_BURST = 20
+# Retries of a failed request before giving up
+MAX_RETRIES = 5
+# Backoff delays in seconds - doubled on each retry up to MAX_DELAY
+BASE_DELAY = 1.0
+MAX_DELAY = 32.0
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+
+def error_status(error):
+    """ HTTP status of an HttpError (or None for other exceptions)."""
+    if isinstance(error, HttpError):
+        return int(error.resp.status)
+    return None
+
+
+def is_retryable(error):
+    """ Is an API error worth retrying - rate limits and server errors."""
+    status = error_status(error)
+    if status in RETRY_STATUSES:
+        return True
+    if status == 403:
+        try:
+            content = error.content
+            if isinstance(content, bytes):
+                content = content.decode('utf-8')
+            reasons = [
+                e.get('reason')
+                for e in json.loads(content)['error'].get('errors', [])
+                ]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return False
+        return any(r in RATE_LIMIT_REASONS for r in reasons)
+    return False
+
+
+class TokenBucket(object):
+    """ Token bucket rate limiter - rate tokens per second are added up
+    to capacity, and acquire() waits until enough are available."""
+
+    def __init__(self, rate, capacity, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """ Take tokens, waiting if needed. Returns seconds waited."""
+        # Requests larger than the bucket leave it in debt, so they (and
+        # later requests) wait until the rate allows them
+        tokens = float(tokens)
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+            self.updated = now
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            self.sleep(wait)
+        return wait
+
+
+class RequestExecutor(object):
+    """ Execute API requests with a shared rate limit and retries.
+
+    Requests are throttled by a token bucket (one token per request,
+    including each request in a batch). Retryable failures (see
+    is_retryable) are retried up to max_retries times with exponential
+    backoff and full jitter. Counts are kept in stats.
+    """
+
+    def __init__(
+        self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, max_retries=MAX_RETRIES,
+        base_delay=BASE_DELAY, max_delay=MAX_DELAY, clock=time.time,
+        sleep=time.sleep, jitter=random.random
+    ):
+        self.bucket = TokenBucket(rate, burst, clock, sleep)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.jitter = jitter
+        self.stats = {
+            'requests': 0,
+            'retries': 0,
+            'failures': 0,
+            'throttle_waits': 0,
+            'throttle_seconds': 0.0,
+            'backoff_seconds': 0.0
+        }
+        self._lock = threading.Lock()
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.stats[name] += value
+
+    def throttle(self, tokens=1):
+        """ Wait for the rate limit before sending tokens requests."""
+        waited = self.bucket.acquire(tokens)
+        self._count('requests', tokens)
+        incr(HTTP_REQUESTS, tokens)
+        if waited:
+            self._count('throttle_waits')
+            self._count('throttle_seconds', waited)
+
+    def backoff(self, attempt):
+        """ Wait before retry number attempt (counting from 0)."""
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        delay = delay * self.jitter()
+        self._count('retries')
+        self._count('backoff_seconds', delay)
+        incr(HTTP_RETRIES)
+        self.sleep(delay)
+
+    def should_retry(self, error, attempt):
+        """ Retry a failure on attempt (counting from 0)."""
+        if attempt < self.max_retries and is_retryable(error):
+            return True
+        self._count('failures')
+        return False
+
+    def execute(self, request):
+        """ Execute a single request, retrying if it fails."""
+        attempt = 0
+        while True:
+            self.throttle()
+            try:
+                return request.execute()
+            except HttpError as e:
+                if not self.should_retry(e, attempt):
+                    raise
+            self.backoff(attempt)
+            attempt += 1
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """ Get the executor shared by all threads of the process, so they
+    share one rate limit."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = RequestExecutor()
+        return _executor
+
+
+def set_executor(executor):
+    """ Replace the shared executor, e.g. with one without a rate limit
+    for a local fake backend."""
+    global _executor
+    with _executor_lock:
+        _executor = executor
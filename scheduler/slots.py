@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+
+# Compact slot records used by the scheduler instead of ORM objects
+from array import array
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+from scheduler.db_conf import session, commit
+from scheduler.engine import _naive, find_first, fit_minutes, split_offset
+from scheduler.metrics import incr, SLOT_MERGES, SLOT_SPLITS
+from scheduler.models import TimePeriod
+
+# Times are whole microseconds since EPOCH, in UTC like the stored
+# datetimes, so they round trip datetimes exactly
+EPOCH = datetime(1970, 1, 1)
+_TICK = timedelta(microseconds=1)
+# Units of epoch times in a second and a minute
+SECOND = 1000000
+MINUTE = 60 * SECOND
+# Id stored in SlotArray for slots that are not in the DB yet
+_NEW = -1
+# Rows fetched at a time when loading, to bound peak memory
+LOAD_BATCH_SIZE = 1000
+
+
+def to_epoch(dt):
+    """ Microseconds since the epoch of a datetime, compared the way SQLite
+    compares stored datetimes (see engine._naive)."""
+    return (_naive(dt) - EPOCH) // _TICK
+
+
+def from_epoch(microseconds):
+    """ Naive UTC datetime of microseconds since the epoch."""
+    return EPOCH + microseconds * _TICK
+
+
+class Slot(object):
+    """ A time period as plain integers.
+
+    start and end are microseconds since the epoch (UTC), id is the id of
+    the timeperiod row (None if not saved yet) and task_id the id of the
+    task it is assigned to (None if free).
+    """
+
+    __slots__ = ('start', 'end', 'task_id', 'id')
+
+    def __init__(self, start, end, task_id=None, id=None):
+        self.start = start
+        self.end = end
+        self.task_id = task_id
+        self.id = id
+
+    def __repr__(self):
+        return '<Slot {0}-{1} task={2}>'.format(
+            self.startdatetime, self.enddatetime, self.task_id)
+
+    @property
+    def duration(self):
+        """ Duration in minutes, rounded up like TimePeriod.duration."""
+        return -((self.start - self.end) // MINUTE)
+
+    @property
+    def startdatetime(self):
+        return from_epoch(self.start)
+
+    @property
+    def enddatetime(self):
+        return from_epoch(self.end)
+
+    @classmethod
+    def from_timeperiod(cls, timeperiod):
+        """ Slot record of a TimePeriod."""
+        return cls(
+            to_epoch(timeperiod.startdatetime),
+            to_epoch(timeperiod.enddatetime),
+            timeperiod.task_id, timeperiod.id
+        )
+
+    def to_timeperiod(self):
+        """ TimePeriod of a slot record (with the same id, if any)."""
+        timeperiod = TimePeriod(self.startdatetime, self.enddatetime)
+        timeperiod.task_id = self.task_id
+        timeperiod.id = self.id
+        return timeperiod
+
+
+def slots_from_timeperiods(timeperiods):
+    """ Slot records of TimePeriods."""
+    return [Slot.from_timeperiod(tp) for tp in timeperiods]
+
+
+def timeperiods_from_slots(slots):
+    """ TimePeriods of slot records."""
+    return [slot.to_timeperiod() for slot in slots]
+
+
+class SlotArray(object):
+    """ Unassigned slots held in parallel arrays of 64-bit integers
+    sorted by start - 24 bytes per slot.
+
+    Has the lookup interface of engine.SlotIndex used by core._assign,
+    but no ORM objects are loaded: rows are read with a column query and
+    assignments and splits are written back with bulk statements when
+    save() is called, which ends its use - load a new array to schedule
+    more. Slots assigned since loading are kept in assigned.
+    """
+
+    def __init__(self, slots=(), min_minutes=0):
+        self._starts = array('q')
+        self._ends = array('q')
+        self._ids = array('q')
+        # Free parts shorter than this are not split off (see fit_minutes)
+        self.min_minutes = min_minutes
+        self.assigned = []
+        self._updates = []
+        self._inserts = []
+        for slot in slots:
+            self.add(slot)
+
+    @classmethod
+    def load(cls, min_minutes=0):
+        """ Build an array from the unassigned time periods in the DB."""
+        rows = session.query(
+            TimePeriod.id, TimePeriod.startdatetime, TimePeriod.enddatetime
+            ).filter(TimePeriod.task_id.is_(None)) \
+            .order_by(TimePeriod.startdatetime, TimePeriod.id) \
+            .yield_per(LOAD_BATCH_SIZE)
+        return cls((
+            Slot(to_epoch(start), to_epoch(end), id=id_)
+            for id_, start, end in rows
+            ), min_minutes)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __iter__(self):
+        for start, end, id_ in zip(self._starts, self._ends, self._ids):
+            yield Slot(start, end, id=None if id_ == _NEW else id_)
+
+    def columns(self):
+        """ The start and end times of the free slots, as arrays."""
+        return self._starts, self._ends
+
+    def add(self, slot):
+        """ Add a free slot, after any others with the same start."""
+        pos = bisect_right(self._starts, slot.start)
+        self._starts.insert(pos, slot.start)
+        self._ends.insert(pos, slot.end)
+        self._ids.insert(pos, _NEW if slot.id is None else slot.id)
+
+    def pop_first(self, startdate, enddate):
+        """ Remove and return the first free slot that starts on or after
+        startdate and ends on or before enddate (or None)."""
+        if startdate is None or enddate is None:
+            return None
+        pos = find_first(
+            self._starts, self._ends, to_epoch(startdate), to_epoch(enddate)
+            )
+        if pos is None:
+            return None
+        id_ = self._ids.pop(pos)
+        return Slot(
+            self._starts.pop(pos), self._ends.pop(pos),
+            id=None if id_ == _NEW else id_
+            )
+
+    def assign(self, slot, task, minutes):
+        """ Assign up to minutes of a popped slot to a task, splitting
+        it and returning the rest to the array if it is longer.
+
+        Returns the minutes assigned.
+        """
+        slot.task_id = task.id
+        minutes = fit_minutes(slot.duration, minutes, self.min_minutes)
+        if minutes >= slot.duration:
+            minutes = slot.duration
+            mapping = {'task_id': task.id}
+        else:
+            split = slot.start + split_offset(minutes) // _TICK
+            self.add(Slot(split, slot.end))
+            slot.end = split
+            mapping = {'task_id': task.id, 'enddatetime': from_epoch(split)}
+            incr(SLOT_SPLITS)
+        self.assigned.append(slot)
+        if slot.id is None:
+            mapping['startdatetime'] = from_epoch(slot.start)
+            mapping['enddatetime'] = from_epoch(slot.end)
+            self._inserts.append(mapping)
+        else:
+            mapping['id'] = slot.id
+            self._updates.append(mapping)
+        return minutes
+
+    def save(self):
+        """ Write all assignments and splits back to the DB."""
+        # Send pending ORM changes first - loaded objects are expired after
+        # the bulk statements so they do not hold stale values
+        session.flush()
+        inserts = self._inserts + [
+            {'startdatetime': from_epoch(start),
+             'enddatetime': from_epoch(end)}
+            for start, end, id_ in zip(self._starts, self._ends, self._ids)
+            if id_ == _NEW
+            ]
+        if self._updates:
+            session.bulk_update_mappings(TimePeriod, self._updates)
+        if inserts:
+            session.bulk_insert_mappings(TimePeriod, inserts)
+        session.expire_all()
+        self._updates = []
+        self._inserts = []
+        commit()
+
+
+def _rows():
+    """ (id, start, end, task id) of all time periods ordered by start,
+    with times as microseconds since the epoch."""
+    rows = session.query(
+        TimePeriod.id, TimePeriod.startdatetime, TimePeriod.enddatetime,
+        TimePeriod.task_id
+        ).order_by(TimePeriod.startdatetime, TimePeriod.id) \
+        .yield_per(LOAD_BATCH_SIZE)
+    for id_, start, end, task_id in rows:
+        yield id_, to_epoch(start), to_epoch(end), task_id
+
+
+def fragment_counts(min_minutes=0):
+    """ Count the time periods in the DB and how fragmented they are.
+
+    Returns a dict with the number of time periods ('total'), 'free' and
+    'assigned' ones, 'adjacent' ones that start where a period of the
+    same task (or a free one, for free periods) ends and could be merged,
+    and 'short' ones of less than min_minutes.
+    """
+    counts = {'total': 0, 'free': 0, 'assigned': 0, 'adjacent': 0,
+              'short': 0}
+    # End of the last period of each task (None - free periods)
+    ends = dict()
+    for _, start, end, task_id in _rows():
+        counts['total'] += 1
+        counts['free' if task_id is None else 'assigned'] += 1
+        if ends.get(task_id) == start:
+            counts['adjacent'] += 1
+        if end - start < min_minutes * MINUTE:
+            counts['short'] += 1
+        ends[task_id] = end
+    return counts
+
+
+def defragment(min_minutes=0):
+    """ Coalesce time periods in the DB and drop unusable free ones.
+
+    Periods of the same task, and free periods, that start where the
+    previous one ends are merged into it. Free periods of less than
+    min_minutes left afterwards are deleted. Changes are written with
+    bulk statements and a single commit.
+
+    Returns the number of time periods removed.
+    """
+    session.flush()
+    updates = list()
+    deletes = list()
+    merges = 0
+
+    def close(task_id, run):
+        id_, start, end, merged = run
+        if task_id is None and end - start < min_minutes * MINUTE:
+            deletes.append(id_)
+        elif merged:
+            updates.append({'id': id_, 'enddatetime': from_epoch(end)})
+
+    # Last run of touching periods of each task (None - free periods) as
+    # [id, start, end, merged]
+    runs = dict()
+    for id_, start, end, task_id in _rows():
+        run = runs.get(task_id)
+        if run is not None and run[2] == start:
+            run[2] = end
+            run[3] = True
+            deletes.append(id_)
+            merges += 1
+            continue
+        if run is not None:
+            close(task_id, run)
+        runs[task_id] = [id_, start, end, False]
+    for task_id, run in runs.items():
+        close(task_id, run)
+
+    if updates:
+        session.bulk_update_mappings(TimePeriod, updates)
+    for i in range(0, len(deletes), LOAD_BATCH_SIZE):
+        session.query(TimePeriod) \
+            .filter(TimePeriod.id.in_(deletes[i:i + LOAD_BATCH_SIZE])) \
+            .delete(synchronize_session=False)
+    session.expire_all()
+    commit()
+    if merges:
+        incr(SLOT_MERGES, merges)
+    return len(deletes)
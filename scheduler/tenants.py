@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+# Run the fetch -> schedule -> post pipeline for many sheet / calendar
+# pairs at once. Network stages run in a thread pool and scheduling runs
+# in a process pool, each tenant with its own database.
+import time
+from concurrent.futures import (
+    ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+)
+
+from scheduler import db_conf
+from scheduler.core import replace_and_schedule
+from scheduler.google_api import (
+    ApiClient, CAL_CREDS_FILENAME, SHEET_CREDS_FILENAME, get_sheet_values,
+    get_work_block_events, clear_events, post_assigned_time, sync_events,
+    tasks_from_values, timeperiods_from_events
+)
+from scheduler.models import TimePeriod, create_schema
+
+
+class Tenant(object):
+    """ Configuration of one sheet / calendar pair to schedule.
+
+    Each tenant is scheduled in its own database (db_url, default a
+    private in-memory DB) and uses its own ApiClient, built from its
+    credential files unless one is supplied.
+    """
+
+    def __init__(
+        self, name, sheet_id, input_cal_id, output_cal_id,
+        cal_creds=CAL_CREDS_FILENAME, sheet_creds=SHEET_CREDS_FILENAME,
+        db_url='sqlite://', client=None
+    ):
+        self.name = name
+        self.sheet_id = sheet_id
+        self.input_cal_id = input_cal_id
+        self.output_cal_id = output_cal_id
+        self.db_url = db_url
+        if client is None:
+            client = ApiClient(cal_creds, sheet_creds)
+        self.client = client
+
+
+def _fetch(tenant):
+    """ Get the todo list rows and work block events of a tenant."""
+    started = time.time()
+    values = get_sheet_values(tenant.sheet_id, tenant.client.sheets)
+    events = get_work_block_events(
+        tenant.input_cal_id, tenant.client.calendar
+        )
+    return values, events, time.time() - started
+
+
+def schedule_tenant(db_url, values, events, policy=None):
+    """ Schedule one tenant's tasks in the database at db_url.
+
+    Runs in a worker process, so only plain data is passed in and out.
+    Returns the errors - sheet rows that are not valid tasks (see
+    google_api.iter_tasks) and scheduling errors (with task refs rather
+    than tasks) - the events to post and the time taken.
+    """
+    started = time.time()
+    db_conf.configure(db_url)
+    create_schema()
+    input_errors = list()
+    errors = replace_and_schedule(
+        tasks_from_values(values, input_errors),
+        timeperiods_from_events(events), policy
+        )
+    errors = input_errors + [
+        {'task': e['task'].taskref, 'timeleft': e['timeleft']}
+        for e in errors
+        ]
+    events = list(TimePeriod.iter_assigned_events())
+    return errors, events, time.time() - started
+
+
+def _post(tenant, events, sync):
+    """ Publish a tenant's scheduled events."""
+    started = time.time()
+    errors = list()
+    service = tenant.client.calendar
+    if sync:
+        posted = sync_events(
+            events, tenant.output_cal_id, service, errors=errors
+            )
+    else:
+        clear_events(tenant.output_cal_id, service, errors=errors)
+        posted = post_assigned_time(
+            events, tenant.output_cal_id, service, errors=errors
+            )
+    return posted, errors, time.time() - started
+
+
+def run_tenants(tenants, threads=8, processes=None, sync=False, policy=None):
+    """ Run the scheduler for many tenants concurrently.
+
+    Fetching and posting use a pool of threads, scheduling a pool of
+    processes (default one per CPU). Stages of different tenants overlap
+    and a failure only stops the tenant it happens in.
+
+    Returns a dict per tenant (in the order given) with the tenant name,
+    the scheduling and posting errors, the posted events, the exception
+    that stopped it (or None) and the time taken by each stage.
+    """
+    results = [
+        {'tenant': t.name, 'errors': [], 'posted': [], 'error': None,
+         'timings': {}}
+        for t in tenants
+        ]
+    started = time.time()
+
+    def finish(i, error=None):
+        results[i]['error'] = error
+        results[i]['timings']['total'] = time.time() - started
+
+    with ThreadPoolExecutor(threads) as io_pool, \
+            ProcessPoolExecutor(processes) as cpu_pool:
+        fetches = dict(
+            (io_pool.submit(_fetch, tenant), i)
+            for i, tenant in enumerate(tenants)
+            )
+        schedules = dict()
+        for future in as_completed(fetches):
+            i = fetches[future]
+            try:
+                values, events, elapsed = future.result()
+            except Exception as e:
+                finish(i, e)
+                continue
+            results[i]['timings']['fetch'] = elapsed
+            schedules[cpu_pool.submit(
+                schedule_tenant, tenants[i].db_url, values, events, policy
+                )] = i
+        posts = dict()
+        for future in as_completed(schedules):
+            i = schedules[future]
+            try:
+                errors, events, elapsed = future.result()
+            except Exception as e:
+                finish(i, e)
+                continue
+            results[i]['errors'].extend(errors)
+            results[i]['timings']['schedule'] = elapsed
+            posts[io_pool.submit(_post, tenants[i], events, sync)] = i
+        for future in as_completed(posts):
+            i = posts[future]
+            try:
+                posted, errors, elapsed = future.result()
+            except Exception as e:
+                finish(i, e)
+                continue
+            results[i]['posted'] = posted
+            results[i]['errors'].extend(errors)
+            results[i]['timings']['post'] = elapsed
+            finish(i)
+    return results
@@ -20,5 +20,8 @@ setup(
     url='https://github.com/benhoyle/scheduler',
     license=license,
     #packages=find_packages(exclude=('tests', 'docs'))
-    packages=['scheduler']
+    packages=['scheduler'],
+    # asyncio (aio), datetime.fromisoformat (dates) and module
+    # __getattr__ (db_conf) need 3.7
+    python_requires='>=3.7'
 )
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from scheduler import aio, google_api
+from scheduler.aio import run_async
+from scheduler.models import Task, TimePeriod
+
+DELAY = 0.2
+
+
+class TestAio:
+
+    def test_run_async(self, session, monkeypatch):
+        """ Test independent stages overlap, scheduling does not wait for
+        clear and posting does."""
+        calls = []
+
+        def stage(name, result=None, delay=DELAY):
+            def call(*args, **kwargs):
+                if kwargs.get('errors') is not None and name == 'sheet':
+                    kwargs['errors'].append({'row': 3, 'ref': 'T2'})
+                calls.append((name, 'start'))
+                time.sleep(delay)
+                calls.append((name, 'end'))
+                if name == 'post':
+                    return list(args[0])
+                return result
+            return call
+
+        start = datetime.now() + timedelta(days=1)
+        monkeypatch.setattr(google_api, 'get_tasks_from_sheet', stage(
+            'sheet', [Task(start + timedelta(days=7), 30, taskref='T1')]
+            ))
+        monkeypatch.setattr(google_api, 'get_work_blocks', stage(
+            'blocks', [TimePeriod(start, start + timedelta(hours=1))]
+            ))
+        monkeypatch.setattr(
+            google_api, 'clear_events', stage('clear', delay=2 * DELAY)
+            )
+        schedule = aio.replace_and_schedule
+
+        def replace_and_schedule(*args):
+            calls.append(('schedule', 'start'))
+            return schedule(*args)
+
+        monkeypatch.setattr(aio, 'replace_and_schedule', replace_and_schedule)
+        monkeypatch.setattr(google_api, 'post_assigned_time', stage('post'))
+
+        started = time.time()
+        errors, posted = asyncio.run(run_async())
+        elapsed = time.time() - started
+
+        # Invalid sheet rows are reported
+        assert errors == [{'row': 3, 'ref': 'T2'}]
+        assert [e['summary'] for e in posted] == ['T1']
+        # Three overlapped stages then posting
+        assert elapsed < 4 * DELAY
+        assert calls.index(('schedule', 'start')) < \
+            calls.index(('clear', 'end'))
+        assert calls.index(('post', 'start')) > calls.index(('clear', 'end'))
+        assert [c[1] for c in calls[:3]] == ['start'] * 3
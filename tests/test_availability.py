@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import json
+import random
+from datetime import datetime, timedelta
+
+import pytz
+
+from scheduler.availability import (
+    free_timeperiods, get_busy, merge_intervals, remove_busy,
+    subtract_intervals
+)
+from scheduler.fakes import FakeGoogle
+from scheduler.models import TimePeriod
+
+from tests.test_fakes import block, fake, run_fake  # noqa: F401
+
+START = datetime(2030, 1, 1, 9)
+
+
+def utc(dt):
+    return pytz.utc.localize(dt)
+
+
+def free_minutes(blocks, busy):
+    """ Free minutes of blocks, one minute at a time."""
+    taken = set()
+    for start, end in busy:
+        taken.update(range(start, end))
+    free = set()
+    for start, end in blocks:
+        free.update(m for m in range(start, end) if m not in taken)
+    return free
+
+
+class TestAvailability:
+
+    def test_subtract(self):
+        """ Check busy intervals are cut out of blocks."""
+        blocks = [(0, 60), (120, 180), (200, 210)]
+        busy = [(150, 160), (10, 20), (15, 30), (170, 250), (-5, 1)]
+        assert merge_intervals(busy) == [(-5, 1), (10, 30), (150, 160),
+                                         (170, 250)]
+        assert subtract_intervals(blocks, busy) == [
+            (1, 10), (30, 60), (120, 150), (160, 170)
+            ]
+
+    def test_subtract_random(self):
+        """ Check the sweep against subtracting minute by minute."""
+        rng = random.Random(0)
+
+        def intervals(count):
+            starts = [rng.randint(0, 1000) for _ in range(count)]
+            return [(s, s + rng.randint(0, 60)) for s in starts]
+
+        for _ in range(50):
+            blocks = merge_intervals(intervals(20))
+            busy = intervals(30)
+            free = subtract_intervals(blocks, busy)
+            minutes = set()
+            for start, end in free:
+                assert start < end
+                minutes.update(range(start, end))
+            assert minutes == free_minutes(blocks, busy)
+
+    def test_free_timeperiods(self):
+        """ Check time periods are made for free time in UTC."""
+        london = pytz.timezone('Europe/London')
+        blocks = [TimePeriod(START, START + timedelta(hours=3))]
+        busy = [(london.localize(datetime(2030, 1, 1, 10)),
+                 london.localize(datetime(2030, 1, 1, 11)))]
+        free = free_timeperiods(blocks, busy)
+        assert [(tp.startdatetime, tp.enddatetime) for tp in free] == [
+            (utc(START), utc(datetime(2030, 1, 1, 10))),
+            (utc(datetime(2030, 1, 1, 11)), utc(datetime(2030, 1, 1, 12)))
+            ]
+
+    def test_fixture(self, tmpdir):
+        """ Check busy times are read from a freebusy response file."""
+        path = tmpdir.join('busy.json')
+        path.write(json.dumps({'calendars': {
+            'meetings': {'busy': [{
+                'start': '2030-01-01T10:00:00Z', 'end': '2030-01-01T10:30:00Z'
+                }]},
+            'missing': {'errors': [{'reason': 'notFound'}]}
+            }}))
+        errors = list()
+        blocks = [TimePeriod(START, START + timedelta(hours=2))]
+        free = remove_busy(blocks, fixture=str(path), errors=errors)
+        assert [tp.duration for tp in free] == [60, 30]
+        assert [e['item'] for e in errors] == ['missing']
+
+    def test_freebusy(self):
+        """ Check many calendars are queried in one request."""
+        backend = FakeGoogle()
+        backend.add_events('a', [block(START), block(START)])
+        backend.add_events('b', [
+            block(START + timedelta(minutes=30)),
+            dict(block(START + timedelta(hours=5)), transparency='transparent')
+            ])
+        errors = list()
+        busy = get_busy(
+            ['a', 'b', 'c'], backend.client().calendar, START,
+            START + timedelta(days=1), errors=errors
+            )
+        assert len(backend.requests) == 1
+        assert merge_intervals(busy) == [
+            (utc(START), utc(START + timedelta(minutes=90)))
+            ]
+        assert [e['item'] for e in errors] == ['c']
+
+    def test_run(self, session, fake):  # noqa: F811
+        """ Check work is not scheduled in busy times."""
+        first = min(e['start']['dateTime'] for e in fake.events('in'))
+        fake.add_events('meetings', [
+            block(datetime.strptime(first, '%Y-%m-%dT%H:%M:%SZ'))
+            ])
+        errors, posted = run_fake(fake, busy_cal_ids=['meetings'])
+        # One of the two tasks no longer fits
+        assert [e['task'].taskref for e in errors] == ['T2']
+        assert len(posted) == 1
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+
+import pytest
+from apiclient import discovery
+from apiclient.http import HttpMockSequence
+
+from scheduler.cache import SnapshotCache, SnapshotMissing, atomic_write
+from scheduler.google_api import get_synced_events, get_sheet_values
+
+
+def event(event_id, status='confirmed'):
+    return {'id': event_id, 'status': status}
+
+
+class TestCache:
+
+    def test_ttl_and_eviction(self, tmpdir):
+        """ Test snapshot freshness and least recently used eviction."""
+        cache = SnapshotCache(str(tmpdir), ttl=60, max_entries=2)
+        assert cache.load('a') is None
+        assert cache.fresh(cache.store('a', [1]))
+        cache.store('b', [2])
+        cache.load('a')
+        cache.store('c', [3])
+        assert cache.load('a')['data'] == [1]
+        assert cache.load('b') is None
+        assert not SnapshotCache(str(tmpdir), ttl=0).fresh(cache.load('c'))
+
+    def test_atomic_write(self, tmpdir):
+        """ Test concurrent writers each use their own temporary file and
+        a failed write leaves the old file in place."""
+        path = str(tmpdir.join('out.json'))
+
+        def write(i):
+            with atomic_write(path) as f:
+                f.write(str(i) * 100000)
+
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        content = tmpdir.join('out.json').read()
+        assert content in [str(i) * 100000 for i in range(8)]
+        with pytest.raises(ValueError):
+            with atomic_write(path) as f:
+                f.write('partial')
+                raise ValueError
+        assert tmpdir.join('out.json').read() == content
+        assert tmpdir.listdir() == [tmpdir.join('out.json')]
+        # Permissions follow the umask like files made with open()
+        tmpdir.join('plain').write('')
+        assert tmpdir.join('out.json').stat().mode == \
+            tmpdir.join('plain').stat().mode
+
+    def test_concurrent_store(self, tmpdir):
+        """ Test threads storing snapshots can all create the directory."""
+        cache = SnapshotCache(str(tmpdir.join('snapshots')))
+        errors = list()
+
+        def store(i):
+            try:
+                cache.store(str(i), [i])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=store, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        assert [cache.load(str(i))['data'] for i in range(8)] == \
+            [[i] for i in range(8)]
+
+    def test_synced_events(self, tmpdir):
+        """ Test calendar events are updated using the sync token."""
+        http = HttpMockSequence([
+            ({'status': '200'}, json.dumps({
+                'items': [event('a'), event('b')], 'nextSyncToken': 's1'
+                })),
+            ({'status': '200'}, json.dumps({
+                'items': [event('b', 'cancelled'), event('c')],
+                'nextSyncToken': 's2'
+                })),
+            ({'status': '410'}, json.dumps({'error': {'code': 410}})),
+            ({'status': '200'}, json.dumps({
+                'items': [event('d')], 'nextSyncToken': 's3'
+                }))
+            ])
+        service = discovery.build('calendar', 'v3', http=http)
+        cache = SnapshotCache(str(tmpdir), ttl=0)
+        events = get_synced_events('cal', service, cache)
+        assert [e['id'] for e in events] == ['a', 'b']
+        events = get_synced_events('cal', service, cache)
+        assert 'syncToken=s1' in http.request_sequence[1][0]
+        assert sorted((e['id'], e['status']) for e in events) == [
+            ('a', 'confirmed'), ('b', 'cancelled'), ('c', 'confirmed')
+            ]
+        # Expired sync token - full sync
+        events = get_synced_events('cal', service, cache)
+        assert [e['id'] for e in events] == ['d']
+        assert len(http.request_sequence) == 4
+        # Offline mode uses the snapshot without any requests
+        cache.offline = True
+        events = get_synced_events('cal', service, cache)
+        assert [e['id'] for e in events] == ['d']
+        assert len(http.request_sequence) == 4
+
+    def test_offline_without_snapshot(self, tmpdir):
+        """ Test offline mode fails if there is nothing cached."""
+        cache = SnapshotCache(str(tmpdir), offline=True)
+        with pytest.raises(SnapshotMissing):
+            get_sheet_values('sheet', cache=cache)
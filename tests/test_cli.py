@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+from scheduler import __main__ as cli
+from scheduler.cache import DEFAULT_TTL
+
+
+def main(monkeypatch, argv):
+    """ Run the command line with run() replaced, returning its keyword
+    arguments."""
+    calls = list()
+
+    def run(**kwargs):
+        calls.append(kwargs)
+        return [], []
+
+    monkeypatch.setattr(cli, 'run', run)
+    assert cli.main(argv) == ([], [])
+    return calls[0]
+
+
+class TestCli:
+
+    def test_no_cache(self, monkeypatch):
+        """ Check no snapshot cache is used by default."""
+        assert main(monkeypatch, [])['cache'] is None
+
+    def test_sync_flag(self, monkeypatch):
+        """ Check --sync makes run() update the output calendar."""
+        assert main(monkeypatch, [])['sync'] is False
+        assert main(monkeypatch, ['--sync'])['sync'] is True
+
+    def test_cache_flags(self, monkeypatch, tmpdir):
+        """ Check the cache flags build a SnapshotCache for run()."""
+        cache = main(monkeypatch, [
+            '--cache-dir', str(tmpdir), '--cache-ttl', '60'
+            ])['cache']
+        assert cache.directory == str(tmpdir)
+        assert cache.ttl == 60
+        assert not cache.offline
+        cache = main(monkeypatch, ['--offline'])['cache']
+        assert cache.offline
+        assert cache.ttl == DEFAULT_TTL
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 
+import warnings
 from datetime import datetime
 
-from scheduler.core import schedule_task
+from sqlalchemy.exc import SAWarning
+
+from scheduler.core import schedule_task, schedule_all, reschedule
+from scheduler.engine import SlotIndex
 from scheduler.models import Task, TimePeriod
 
 class TestCore:
@@ -15,3 +19,125 @@ class TestCore:
         rt = schedule_task(tasks[0], datetime(2010, 10, 9, 12, 00))
         assert rt == 0
         assert tps[0] in tasks[0].timeperiods
+
+    def test_schedule_task_split(self, tasks, timeperiods):
+        """ Test a partial fit splits the time period."""
+        task = Task.get_all()[0]
+        task.esttimemins = 20
+        rt = schedule_task(task, datetime(2010, 10, 9, 12, 00))
+        assert rt == 0
+        assert len(TimePeriod.get_all()) == 3
+        assigned = TimePeriod.get_assigned()
+        assert len(assigned) == 1
+        assert assigned[0].duration == 20
+        remainder = TimePeriod.unassigned_in_range(
+            datetime(2010, 10, 10, 12, 00), datetime(2010, 10, 10, 13, 00)
+            )
+        assert remainder.startdatetime == datetime(2010, 10, 10, 12, 20)
+        assert remainder.duration == 10
+
+    def test_schedule_all(self, tasks, timeperiods):
+        """ Test scheduling all tasks against the in-memory index."""
+        errors = schedule_all(datetime(2010, 10, 9, 12, 00))
+        tasks = Task.get_all()
+        assert len(tasks[0].timeperiods) == 1
+        assert len(tasks[1].timeperiods) == 1
+        assert len(errors) == 1
+        assert errors[0]['task'] is tasks[1]
+        assert errors[0]['timeleft'] == 30
+
+    def test_schedule_all_edf(self, tasks, timeperiods):
+        """ Test earliest deadline first ordering."""
+        errors = schedule_all(datetime(2010, 10, 9, 12, 00), policy='edf')
+        tasks = Task.get_all()
+        assert len(tasks[0].timeperiods) == 0
+        assert len(tasks[1].timeperiods) == 2
+        assert len(errors) == 1
+        assert errors[0]['task'] is tasks[0]
+        assert errors[0]['timeleft'] == 30
+
+    def test_schedule_all_exact(self, tasks, timeperiods):
+        """ Test exact mode meets deadlines greedy scheduling misses."""
+        tasks = Task.get_all()
+        tasks[0].esttimemins = 60
+        tasks[1].esttimemins = 30
+        tasks[1].due = datetime(2010, 10, 11, 0, 0)
+        start = datetime(2010, 10, 9, 12, 00)
+        # Insertion order would give the first slot to the first task
+        errors = schedule_all(start, exact=True)
+        assert len(tasks[1].timeperiods) == 1
+        assert len(tasks[0].timeperiods) == 1
+        assert tasks[1].timeperiods[0].startdatetime == \
+            datetime(2010, 10, 10, 12, 00)
+        assert errors[0]['task'] is tasks[0]
+        assert errors[0]['timeleft'] == 30
+
+    def test_min_slot(self, tasks, timeperiods):
+        """ Test periods are only coalesced when a minimum slot size is
+        set, and time left is not negative when rounding to it."""
+        start = datetime(2010, 10, 9, 12, 00)
+        TimePeriod(
+            datetime(2010, 11, 1, 9, 00), datetime(2010, 11, 1, 9, 10)
+            ).save()
+        TimePeriod(
+            datetime(2010, 11, 1, 9, 10), datetime(2010, 11, 1, 9, 20)
+            ).save()
+        schedule_all(start)
+        assert len(TimePeriod.get_all()) == 4
+        schedule_all(start, min_slot_minutes=15)
+        assert len(TimePeriod.get_all()) == 3
+        TimePeriod(
+            datetime(2010, 10, 12, 9, 00), datetime(2010, 10, 12, 10, 00)
+            ).save()
+        task = Task(datetime(2010, 10, 20), 20)
+        task.save()
+        index = SlotIndex.load()
+        index.min_minutes = 15
+        assert schedule_task(task, start, index) == 0
+        assert [tp.duration for tp in task.timeperiods] == [30]
+        index.save()
+
+    def test_reschedule(self, tasks, timeperiods):
+        """ Test rescheduling a task after its estimate changes."""
+        start = datetime(2010, 10, 9, 12, 00)
+        schedule_all(start)
+        tasks = Task.get_all()
+        # Shorter estimate - first slot is split
+        tasks[0].esttimemins = 10
+        assert reschedule([tasks[0].id], start) == []
+        assert [tp.duration for tp in tasks[0].timeperiods] == [10]
+        assert len(TimePeriod.get_all()) == 3
+        # Longer estimate - freed periods are merged back together and
+        # the later task is displaced
+        tasks[0].esttimemins = 60
+        errors = reschedule([tasks[0].id], start)
+        assert len(TimePeriod.get_all()) == 2
+        assert sorted(tp.duration for tp in tasks[0].timeperiods) == [30, 30]
+        assert tasks[1].timeperiods == []
+        assert len(errors) == 1
+        assert errors[0]['task'] is tasks[1]
+        assert errors[0]['timeleft'] == 60
+
+    def test_reschedule_split_remainders(self, tasks, timeperiods):
+        """ Test periods split off during a reschedule are in the session
+        when the displacement query autoflushes."""
+        TimePeriod.delete_all()
+        Task.delete_all()
+        TimePeriod(
+            datetime(2010, 10, 10, 9, 00), datetime(2010, 10, 10, 11, 00)
+            ).save()
+        for description, minutes in (('a', 30), ('b', 30), ('c', 500)):
+            Task(datetime(2010, 10, 20), minutes,
+                 description=description).save()
+        tasks = Task.get_all()
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', SAWarning)
+            errors = reschedule(
+                [t.id for t in tasks], datetime(2010, 10, 9, 12, 00)
+                )
+        assert [(e['task'], e['timeleft']) for e in errors] == \
+            [(tasks[2], 440)]
+        assert [
+            (tp.task.description, tp.duration)
+            for tp in TimePeriod.get_assigned()
+            ] == [('a', 30), ('b', 30), ('c', 60)]
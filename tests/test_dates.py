@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from dateutil import parser
+
+from scheduler.dates import DateParser, get_timezone, parse_datetime
+
+STRINGS = [
+    '17 October 2018', '5 Oct 2018', 'October 17 2018',
+    '17 October 2018 14:30', '2018-10-17', '2018-10-17T09:30:00',
+    '01/02/2018', '13/02/2018', '2018/10/17', 'Wed 17th Oct 2018'
+    ]
+
+
+class TestDates:
+
+    def test_matches_dateutil(self):
+        """ Check strings parse the same as with dateutil."""
+        for value in STRINGS:
+            assert DateParser().parse(value) == parser.parse(value)
+
+    def test_detects_format(self):
+        """ Check the column format is detected once and dateutil is only
+        used for strings no format matches."""
+        dates = DateParser()
+        dates.parse('17 October 2018')
+        assert dates.format == '%d %B %Y'
+        dates.parse('18 October 2018')
+        dates.parse('Wed 17th Oct 2018')
+        assert dates.format == '%d %B %Y'
+        assert dates.fallbacks == 1
+
+    def test_cache(self):
+        """ Check repeated strings are cached and bad ones raise."""
+        dates = DateParser(cache_size=2)
+        for value in ['1 May 2018', '1 May 2018', '2 May 2018', '3 May 2018']:
+            dates.parse(value)
+        info = dates.cache_info()
+        assert (info.hits, info.misses, info.currsize) == (1, 3, 2)
+        with pytest.raises(ValueError):
+            dates.parse('not a date')
+
+    def test_event_times(self):
+        """ Check calendar date times and timezones."""
+        for value in ['2018-10-17T09:30:00Z', '2018-10-17T09:30:00+01:00']:
+            assert parse_datetime(value) == parser.parse(value)
+        assert get_timezone('Europe/London') is get_timezone('Europe/London')
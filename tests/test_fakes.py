@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from scheduler import retry
+from scheduler.cache import SnapshotCache
+from scheduler.core import run
+from scheduler.fakes import FakeGoogle
+from scheduler.google_api import (
+    get_all_events, get_sheet_values, iter_tasks_from_sheet
+)
+
+HEADER = ['Ref', 'Type', 'Description', 'Hours', 'Due']
+
+
+def block(start, hours=1):
+    end = start + timedelta(hours=hours)
+    return {
+        'summary': 'Work',
+        'start': {'dateTime': start.isoformat() + 'Z', 'timeZone': 'UTC'},
+        'end': {'dateTime': end.isoformat() + 'Z', 'timeZone': 'UTC'}
+    }
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    """ Fake backend with a sheet of two tasks and two work blocks."""
+    monkeypatch.setattr(
+        retry, '_executor', retry.RequestExecutor(sleep=lambda s: None)
+        )
+    start = datetime.utcnow().replace(microsecond=0) + timedelta(days=1)
+    due = (start + timedelta(days=7)).strftime('%d %B %Y')
+    backend = FakeGoogle()
+    backend.add_sheet('sheet', [
+        HEADER, ['T1', 'Type', 'First', '1', due],
+        ['T2', 'Type', 'Second', '1', due]
+        ])
+    backend.add_events('in', [block(start), block(start + timedelta(days=1))])
+    backend.add_events('out', [dict(block(start), summary='Old')])
+    return backend
+
+
+def run_fake(backend, **kwargs):
+    return run(
+        client=backend.client(), sheet_id='sheet', input_cal_id='in',
+        output_cal_id='out', **kwargs
+        )
+
+
+class TestFakes:
+
+    def test_sheet_ranges(self):
+        """ Check sheet values are returned for A1 row ranges."""
+        backend = FakeGoogle()
+        backend.add_sheet('sheet', [HEADER] + [[str(i)] for i in range(5)])
+        sheets = backend.client().sheets
+        assert len(get_sheet_values('sheet', sheets)) == 6
+        result = sheets.spreadsheets().values().get(
+            spreadsheetId='sheet', range='Todo!A3:F4').execute()
+        assert result['values'] == [['1'], ['2']]
+
+    def test_sheet_chunks(self):
+        """ Check tasks are streamed a chunk of rows at a time, past blank
+        rows at the end of a chunk, and bad rows are reported."""
+        backend = FakeGoogle()
+        backend.add_sheet('sheet', [
+            HEADER, ['T1', 'Type', 'One', '1', '1 May 2030'],
+            ['T2', 'Type', 'Two', 'x', '1 May 2030'], [],
+            ['T3', 'Type', 'Three'], ['T4', 'Type', 'Four', '1', 'Never'],
+            [], [], [], ['T5', 'Type', 'Five', '2', '2 May 2030']
+            ], rows=12)
+        errors = list()
+        tasks = iter_tasks_from_sheet(
+            'sheet', backend.client().sheets, errors=errors, chunk_rows=3
+            )
+        assert next(tasks).taskref == 'T1'
+        assert len(backend.requests) == 2
+        assert [t.taskref for t in tasks] == ['T5']
+        assert [path.split('/')[-1] for _, path in backend.requests] == [
+            'sheet', 'Todo%21A2%3AF4', 'Todo%21A5%3AF7', 'Todo%21A8%3AF10',
+            'Todo%21A11%3AF13'
+            ]
+        assert errors == [
+            {'row': 3, 'ref': 'T2', 'error': "bad estimate 'x'"},
+            {'row': 5, 'ref': 'T3', 'error': 'expected 5 columns, got 3'},
+            {'row': 6, 'ref': 'T4', 'error': "bad due date 'Never'"}
+            ]
+
+    def test_list_pages(self):
+        """ Check events are listed in pages."""
+        backend = FakeGoogle(page_size=2)
+        start = datetime(2030, 1, 1, 9)
+        backend.add_events(
+            'cal', [block(start + timedelta(days=d)) for d in range(5)]
+            )
+        events = get_all_events('cal', backend.client().calendar)
+        assert len(events) == 5
+        assert len(backend.requests) == 3
+
+    def test_run(self, session, fake):
+        """ Check a full run clears and fills the output calendar."""
+        errors, posted = run_fake(fake)
+        assert errors == []
+        assert sorted(e['summary'] for e in fake.events('out')) == \
+            ['T1', 'T2']
+        assert len(posted) == 2
+
+    def test_run_retries(self, session, fake):
+        """ Check a run completes when requests fail and are retried."""
+        fake.fail(503, method='DELETE')
+        fake.fail(429, method='POST')
+        errors, posted = run_fake(fake)
+        assert errors == []
+        assert sorted(e['summary'] for e in fake.events('out')) == \
+            ['T1', 'T2']
+        assert retry.get_executor().stats['retries'] == 2
+
+    def test_run_insert_retried(self, session, fake):
+        """ Check an insert that failed after the event was made is not
+        made twice when it is retried."""
+        fake.fail(503, method='POST', after=True)
+        errors, posted = run_fake(fake)
+        assert errors == []
+        assert sorted(e['summary'] for e in fake.events('out')) == \
+            ['T1', 'T2']
+        assert sorted(e['summary'] for e in posted) == ['T1', 'T2']
+        assert retry.get_executor().stats['retries'] == 1
+
+    def test_run_cached_all_day(self, session, fake, tmpdir):
+        """ Check a run through the snapshot cache, which lists the whole
+        calendar, skips all day events."""
+        fake.add_events('in', [{
+            'summary': 'Holiday',
+            'start': {'date': '2020-01-01'}, 'end': {'date': '2020-01-02'}
+        }])
+        errors, posted = run_fake(fake, cache=SnapshotCache(str(tmpdir)))
+        assert errors == []
+        assert sorted(e['summary'] for e in posted) == ['T1', 'T2']
+
+    def test_run_sync(self, session, fake):
+        """ Check a second synced run sends no changes."""
+        run_fake(fake, sync=True)
+        count = len(fake.requests)
+        errors, posted = run_fake(fake, sync=True)
+        assert errors == []
+        assert len(posted) == 2
+        # Only the sheet (its size and rows) and the two calendars are read
+        assert len(fake.requests) == count + 4
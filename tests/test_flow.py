@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+
+from scheduler.flow import FlowNetwork, max_schedulable, SOURCE, SINK
+from scheduler.models import Task, TimePeriod
+
+
+def make_task(due, minutes, critical=False):
+    task = Task(due, minutes)
+    task.progress = 0
+    task.critical = critical
+    return task
+
+
+class TestFlow:
+
+    def test_max_flow(self):
+        """ Test max flow on a small network."""
+        network = FlowNetwork(4)
+        a = network.add_edge(SOURCE, 2, 3)
+        network.add_edge(SOURCE, 3, 2)
+        network.add_edge(2, 3, 5)
+        network.add_edge(2, SINK, 2)
+        network.add_edge(3, SINK, 3)
+        assert network.max_flow(SOURCE, SINK) == 5
+        assert network.flow(a) == 3
+        assert network.max_flow(SOURCE, SINK) == 0
+
+    def test_max_schedulable(self):
+        """ Test minutes are allocated to meet the most deadlines."""
+        slots = [
+            TimePeriod(datetime(2010, 10, 10, 9), datetime(2010, 10, 10, 10)),
+            TimePeriod(datetime(2010, 10, 12, 9), datetime(2010, 10, 12, 10))
+            ]
+        tasks = [
+            make_task(datetime(2010, 10, 20), 60),
+            make_task(datetime(2010, 10, 11), 60),
+            make_task(datetime(2010, 10, 11), 30, critical=True)
+            ]
+        amounts = max_schedulable(tasks, slots, datetime(2010, 10, 1))
+        assert amounts[0] == 60
+        assert amounts[2] == 30
+        assert amounts[1] == 30
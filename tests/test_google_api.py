@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+from datetime import datetime
+
+from googleapiclient import discovery_cache
+
+from apiclient import discovery
+from apiclient.http import HttpMockSequence
+
+from scheduler.google_api import (
+    post_assigned_time, clear_events, sync_events, event_key, BatchWriter,
+    ApiClient, get_tasks_from_sheet, get_work_blocks, expand_recurring_events
+)
+from scheduler.models import EVENT_KEY
+
+
+def batch_response(statuses, bodies=None, ids=None):
+    """ Build a multipart/mixed batch response for a fake transport."""
+    bodies = bodies or [{} for _ in statuses]
+    ids = ids or range(len(statuses))
+    parts = []
+    for i, status, body in zip(ids, statuses, bodies):
+        parts.append(
+            '--batch_foobar\r\n'
+            'Content-Type: application/http\r\n'
+            'Content-Transfer-Encoding: binary\r\n'
+            'Content-ID: <response-base + {0}>\r\n\r\n'
+            'HTTP/1.1 {1} OK\r\n'
+            'Content-Type: application/json\r\n\r\n'
+            '{2}\r\n'.format(i, status, json.dumps(body))
+        )
+    content = ''.join(parts) + '--batch_foobar--'
+    headers = {
+        'status': '200',
+        'content-type': 'multipart/mixed; boundary="batch_foobar"'
+    }
+    return (headers, content)
+
+
+def sheets_discovery_doc():
+    """ The Sheets discovery document bundled with the API client."""
+    path = os.path.join(
+        os.path.dirname(discovery_cache.__file__), 'documents',
+        'sheets.v4.json'
+        )
+    with open(path) as f:
+        return f.read()
+
+
+def tagged_event(ref, start, end, description=None, **extra):
+    event = {
+        'summary': ref,
+        'description': description,
+        'start': {'dateTime': start, 'timeZone': 'UTC'},
+        'end': {'dateTime': end, 'timeZone': 'UTC'},
+        'extendedProperties': {
+            'private': {EVENT_KEY: u'{0}|{1}'.format(ref, start)}
+        }
+    }
+    event.update(extra)
+    return event
+
+
+def calendar_service(responses):
+    http = HttpMockSequence(responses)
+    return http, discovery.build('calendar', 'v3', http=http)
+
+
+class TestGoogleApi:
+
+    def test_post_assigned_time_batches(self):
+        """ Check events are posted in chunks of batch_size."""
+        events = [{'summary': str(i)} for i in range(5)]
+        http, service = calendar_service([
+            batch_response([200, 200], [{'id': '0'}, {'id': '1'}]),
+            batch_response([200, 200], [{'id': '2'}, {'id': '3'}]),
+            batch_response([200], [{'id': '4'}])
+            ])
+        errors = []
+        posted = post_assigned_time(
+            events, 'cal', service=service, batch_size=2, errors=errors
+            )
+        assert len(http.request_sequence) == 3
+        assert [p['id'] for p in posted] == ['0', '1', '2', '3', '4']
+        assert errors == []
+
+    def test_batch_errors_collected(self):
+        """ Check failed items are collected and the rest still run."""
+        http, service = calendar_service([
+            batch_response([200, 404, 200])
+            ])
+        writer = BatchWriter(service, batch_size=10)
+        for i in range(3):
+            writer.add(
+                service.events().delete(calendarId='cal', eventId=str(i)), i
+                )
+        results = writer.execute()
+        assert len(results) == 2
+        assert len(writer.errors) == 1
+        assert writer.errors[0]['item'] == 1
+
+    def test_clear_events(self):
+        """ Check events are listed once then deleted in batches."""
+        items = [{'id': str(i)} for i in range(3)]
+        http, service = calendar_service([
+            ({'status': '200'}, json.dumps({'items': items})),
+            batch_response([204, 204, 204])
+            ])
+        errors = []
+        clear_events('cal', service=service, errors=errors)
+        assert len(http.request_sequence) == 2
+        assert 'batch' in http.request_sequence[1][0]
+        assert errors == []
+
+    def test_sync_events(self):
+        """ Check only the changed events are sent to the calendar."""
+        existing = [
+            # Unchanged - times returned by the API in a different format
+            tagged_event(
+                'A', '2010-10-10T12:00:00', '2010-10-10T12:30:00', id='a',
+                ),
+            # End time changed
+            tagged_event(
+                'B', '2010-10-10T13:00:00', '2010-10-10T13:30:00', id='b'
+                ),
+            # No longer scheduled
+            tagged_event(
+                'C', '2010-10-10T14:00:00', '2010-10-10T14:30:00', id='c'
+                ),
+            # Not posted by the scheduler
+            {'id': 'd', 'summary': 'Manual'}
+            ]
+        existing[0]['start'] = {'dateTime': '2010-10-10T12:00:00Z'}
+        existing[0]['end'] = {'dateTime': '2010-10-10T13:30:00+01:00'}
+        events = [
+            tagged_event('A', '2010-10-10T12:00:00', '2010-10-10T12:30:00'),
+            tagged_event('B', '2010-10-10T13:00:00', '2010-10-10T13:45:00'),
+            tagged_event('E', '2010-10-10T15:00:00', '2010-10-10T15:30:00')
+            ]
+        http, service = calendar_service([
+            ({'status': '200'}, json.dumps({'items': existing})),
+            batch_response(
+                [200, 200, 204, 204], [{'id': 'b'}, {'id': 'e'}, {}, {}]
+                )
+            ])
+        errors = []
+        synced = sync_events(events, 'cal', service=service, errors=errors)
+        assert len(http.request_sequence) == 2
+        body = http.request_sequence[1][2]
+        assert body.count('PATCH ') == 1
+        assert body.count('POST ') == 1
+        assert body.count('DELETE ') == 2
+        assert sorted(e['id'] for e in synced) == ['a', 'b', 'e']
+        assert event_key(events[0]) == 'A|2010-10-10T12:00:00'
+        assert errors == []
+
+    def test_client_caches_services(self, tmpdir):
+        """ Check services and discovery docs are only fetched once."""
+        size = json.dumps({'sheets': [
+            {'properties': {'gridProperties': {'rowCount': 1000}}}
+            ]})
+        values = json.dumps({'values': [
+            ['T1', 'Type', 'Test', '2', '20 October 2010']
+            ]})
+        http = HttpMockSequence([
+            ({'status': '200'}, sheets_discovery_doc()),
+            ({'status': '200'}, size),
+            ({'status': '200'}, values),
+            ({'status': '200'}, size),
+            ({'status': '200'}, values)
+            ])
+        client = ApiClient(http=http, cache_dir=str(tmpdir))
+        assert client.sheets is client.sheets
+        tasks = get_tasks_from_sheet('sheet', service=client.sheets)
+        tasks = get_tasks_from_sheet('sheet', service=client.sheets)
+        assert len(tasks) == 1 and tasks[0].esttimemins == 120
+        assert len(http.request_sequence) == 5
+        # A new client uses the discovery doc cached on disk
+        http = HttpMockSequence([])
+        client = ApiClient(http=http, cache_dir=str(tmpdir))
+        assert client.sheets
+        assert len(http.request_sequence) == 0
+
+    def test_get_work_blocks_pages(self):
+        """ Check all pages in the horizon are fetched."""
+        def block(day):
+            return {
+                'start': {
+                    'dateTime': '2018-01-{0:02d}T09:00:00Z'.format(day),
+                    'timeZone': 'UTC'
+                },
+                'end': {
+                    'dateTime': '2018-01-{0:02d}T12:00:00Z'.format(day),
+                    'timeZone': 'UTC'
+                }
+            }
+        http, service = calendar_service([
+            ({'status': '200'}, json.dumps({
+                'items': [block(d) for d in range(1, 21)],
+                'nextPageToken': 'page2'
+                })),
+            ({'status': '200'}, json.dumps({
+                'items': [block(d) for d in range(21, 32)]
+                }))
+            ])
+        blocks = get_work_blocks(
+            'cal', service=service, time_min=datetime(2018, 1, 1),
+            time_max=datetime(2018, 2, 1)
+            )
+        assert len(blocks) == 31
+        assert 'timeMax=2018-02-01T00%3A00%3A00Z' in \
+            http.request_sequence[0][0]
+        assert 'pageToken=page2' in http.request_sequence[1][0]
+
+    def test_expand_recurring_events(self):
+        """ Check recurring events are expanded with their exceptions."""
+        master = {
+            'id': 'm',
+            'start': {
+                'dateTime': '2018-03-19T09:00:00Z',
+                'timeZone': 'Europe/London'
+            },
+            'end': {
+                'dateTime': '2018-03-19T12:00:00Z',
+                'timeZone': 'Europe/London'
+            },
+            'recurrence': [
+                'RRULE:FREQ=DAILY;BYDAY=MO,TU,WE,TH,FR',
+                'EXDATE;TZID=Europe/London:20180321T090000'
+            ]
+        }
+        moved = {
+            'id': 'm_20180322T090000Z',
+            'recurringEventId': 'm',
+            'originalStartTime': {
+                'dateTime': '2018-03-22T09:00:00Z',
+                'timeZone': 'Europe/London'
+            },
+            'start': {
+                'dateTime': '2018-03-22T13:00:00Z',
+                'timeZone': 'Europe/London'
+            },
+            'end': {
+                'dateTime': '2018-03-22T16:00:00Z',
+                'timeZone': 'Europe/London'
+            }
+        }
+        cancelled = {
+            'id': 'm_20180323T090000Z',
+            'recurringEventId': 'm',
+            'status': 'cancelled',
+            'originalStartTime': {
+                'dateTime': '2018-03-23T09:00:00Z',
+                'timeZone': 'Europe/London'
+            }
+        }
+        # All day events and their exceptions are skipped
+        all_day = {
+            'id': 'd', 'start': {'date': '2018-03-19'},
+            'end': {'date': '2018-03-20'}, 'recurrence': ['RRULE:FREQ=DAILY']
+        }
+        all_day_moved = {
+            'id': 'd_20180320', 'recurringEventId': 'd',
+            'originalStartTime': {'date': '2018-03-20'},
+            'start': {'date': '2018-03-21'}, 'end': {'date': '2018-03-22'}
+        }
+        events = expand_recurring_events(
+            [master, moved, cancelled, all_day, all_day_moved],
+            datetime(2018, 3, 19), datetime(2018, 3, 31)
+            )
+        starts = [e['start']['dateTime'] for e in events]
+        assert starts == [
+            '2018-03-19T09:00:00+00:00',
+            '2018-03-20T09:00:00+00:00',
+            '2018-03-22T13:00:00Z',
+            # Clocks change on 25 March - still 9am local time
+            '2018-03-26T09:00:00+01:00',
+            '2018-03-27T09:00:00+01:00',
+            '2018-03-28T09:00:00+01:00',
+            '2018-03-29T09:00:00+01:00',
+            '2018-03-30T09:00:00+01:00'
+            ]
+        assert events[0]['id'] == 'm_20180319T090000Z'
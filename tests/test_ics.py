@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+
+from dateutil import tz
+
+from scheduler import ics
+from scheduler.core import run
+from scheduler.fakes import FakeGoogle
+from scheduler.models import TimePeriod, make_event
+
+from tests.test_fakes import HEADER
+
+CALENDAR = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//test//test//EN
+BEGIN:VEVENT
+UID:single
+SUMMARY:Work
+DTSTART:20101010T120000Z
+DTEND:20101010T123000Z
+BEGIN:VALARM
+ACTION:DISPLAY
+TRIGGER:-PT5M
+END:VALARM
+END:VEVENT
+BEGIN:VEVENT
+UID:offset
+SUMMARY:Work
+DTSTART;TZID=Europe/London:20100611T090000
+DTEND;TZID=Europe/London:20100611T100000
+END:VEVENT
+BEGIN:VEVENT
+UID:allday
+DTSTART;VALUE=DATE:20101011
+DTEND;VALUE=DATE:20101012
+END:VEVENT
+BEGIN:VEVENT
+UID:cancelled
+STATUS:CANCELLED
+DTSTART:20101012T120000Z
+DTEND:20101012T130000Z
+END:VEVENT
+BEGIN:VEVENT
+UID:weekly
+SUMMARY:Work
+DTSTART:20101013T090000Z
+DTEND:20101013T100000Z
+RRULE:FREQ=WEEKLY;COUNT=3
+END:VEVENT
+BEGIN:VEVENT
+UID:weekly
+RECURRENCE-ID:20101020T090000Z
+SUMMARY:Work
+DTSTART:20101020T140000Z
+DTEND:20101020T150000Z
+END:VEVENT
+END:VCALENDAR
+""".replace('\n', '\r\n')
+
+TIME_MIN = datetime(2010, 10, 1)
+TIME_MAX = datetime(2010, 11, 1)
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=tz.UTC)
+
+
+def write_calendar(tmpdir, text=CALENDAR):
+    path = tmpdir.join('blocks.ics')
+    path.write_binary(text.encode('utf-8'))
+    return str(path)
+
+
+class TestIcs:
+
+    def test_work_blocks(self, tmpdir):
+        """ Test single and recurring work blocks are read in the time
+        range, skipping all day and cancelled events."""
+        path = write_calendar(tmpdir)
+        events = list(ics.get_work_block_events(path, TIME_MIN, TIME_MAX))
+        assert [e['id'] for e in events] == [
+            'single', 'weekly_20101013T090000Z', 'weekly_20101020T090000Z',
+            'weekly_20101027T090000Z'
+            ]
+        blocks = ics.get_work_blocks(path, TIME_MIN, TIME_MAX)
+        assert [(b.startdatetime, b.enddatetime) for b in blocks] == [
+            (utc(2010, 10, 10, 12), utc(2010, 10, 10, 12, 30)),
+            (utc(2010, 10, 13, 9), utc(2010, 10, 13, 10)),
+            (utc(2010, 10, 20, 14), utc(2010, 10, 20, 15)),
+            (utc(2010, 10, 27, 9), utc(2010, 10, 27, 10))
+            ]
+
+    def test_long_exdate(self, tmpdir):
+        """ Test a folded EXDATE line excludes all of its dates."""
+        excluded = ','.join(
+            '201010{0:02d}T090000Z'.format(day) for day in range(2, 27)
+            )
+        text = CALENDAR.replace(
+            'RRULE:FREQ=WEEKLY;COUNT=3\r\n',
+            'RRULE:FREQ=DAILY;COUNT=40\r\nEXDATE:{0}\r\n'.format(excluded)
+            )
+        path = write_calendar(tmpdir, text)
+        events = ics.get_work_block_events(path, TIME_MIN, TIME_MAX)
+        starts = [
+            e['start']['dateTime'] for e in events
+            if e.get('recurringEventId') == 'weekly'
+            ]
+        # Days from the 13th to the 26th are excluded, apart from the moved
+        # instance on the 20th
+        assert [s[:13] for s in starts] == [
+            '2010-10-20T14', '2010-10-27T09', '2010-10-28T09',
+            '2010-10-29T09', '2010-10-30T09', '2010-10-31T09'
+            ]
+
+    def test_utf8(self, tmpdir, monkeypatch):
+        """ Test files are read as UTF-8 whatever the locale's encoding."""
+        def ascii_open(*args, **kwargs):
+            kwargs.setdefault('encoding', 'ascii')
+            return open(*args, **kwargs)
+
+        monkeypatch.setattr(ics, 'open', ascii_open, raising=False)
+        path = write_calendar(tmpdir, CALENDAR.replace(
+            'SUMMARY:Work', u'SUMMARY:Wörk', 1
+            ))
+        assert str(next(ics.read_vevents(path))['SUMMARY']) == u'Wörk'
+
+    def test_timezones(self, tmpdir):
+        """ Test events with a TZID are converted in their own timezone."""
+        path = write_calendar(tmpdir)
+        events = ics.get_work_block_events(
+            path, datetime(2010, 6, 1), datetime(2010, 7, 1)
+            )
+        blocks = [ics._event_to_timeperiod(e) for e in events]
+        # British Summer Time is an hour ahead of UTC
+        assert [b.startdatetime for b in blocks] == [utc(2010, 6, 11, 8)]
+
+    def test_streaming(self, tmpdir):
+        """ Test events are parsed one at a time as the file is read."""
+        path = write_calendar(tmpdir)
+        events = ics.read_vevents(path)
+        assert str(next(events)['UID']) == 'single'
+        assert str(next(events)['UID']) == 'offset'
+
+    def test_round_trip(self, tmpdir):
+        """ Test written events can be read back with their keys."""
+        start = datetime(2010, 10, 10, 12)
+        events = [
+            make_event('T{0}'.format(i), u'Tâsk', start + timedelta(hours=i),
+                       start + timedelta(hours=i, minutes=30))
+            for i in range(3)
+            ]
+        bad = {'summary': 'Bad', 'start': {}, 'end': {}}
+        errors = list()
+        path = str(tmpdir.join('out.ics'))
+        written = ics.post_assigned_time(
+            iter(events + [bad]), path, errors=errors
+            )
+        assert written == events
+        assert [e['item'] for e in errors] == [bad]
+        read = list(ics.get_work_block_events(path, TIME_MIN, TIME_MAX))
+        assert [e['summary'] for e in read] == ['T0', 'T1', 'T2']
+        assert [e['description'] for e in read] == [u'Tâsk'] * 3
+        assert [ics.event_key(e) for e in read] == \
+            [ics.event_key(e) for e in events]
+        assert len(set(e['id'] for e in read)) == 3
+        ics.clear_events(path)
+        assert not tmpdir.join('out.ics').exists()
+
+    def test_run(self, tmpdir):
+        """ Test a run reading and writing iCalendar files."""
+        start = datetime.utcnow().replace(microsecond=0, second=0) + \
+            timedelta(days=1)
+        block = TimePeriod(start, start + timedelta(hours=2))
+        blocks = str(tmpdir.join('blocks.ics'))
+        ics.post_assigned_time([block.as_event()], blocks)
+        output = str(tmpdir.join('out.ics'))
+        backend = FakeGoogle()
+        due = (start + timedelta(days=7)).strftime('%d %B %Y')
+        backend.add_sheet('sheet', [HEADER, ['T1', 'Type', 'One', '1', due]])
+        errors, posted = run(
+            client=backend.client(), sheet_id='sheet',
+            work_blocks_file=blocks, output_file=output
+            )
+        assert errors == []
+        assert [e['summary'] for e in posted] == ['T1']
+        assert [e['summary'] for e in ics.get_work_block_events(output)] \
+            == ['T1']
+        # Only the sheet was read from Google
+        assert [path for _, path in backend.requests] == [
+            '/v4/spreadsheets/sheet',
+            '/v4/spreadsheets/sheet/values/Todo%21A2%3AF1001'
+            ]
+
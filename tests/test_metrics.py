@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+import pytest
+
+from scheduler import metrics
+from scheduler import __main__ as cli
+from scheduler.fakes import CALENDAR_BATCH
+
+from tests.test_fakes import fake, run_fake  # noqa: F401
+
+
+@pytest.fixture
+def memory():
+    sink = metrics.add_sink(metrics.MemorySink())
+    yield sink
+    metrics.remove_sink(sink)
+
+
+class TestMetrics:
+
+    def test_no_sinks(self):
+        """ Check nothing is timed when there are no sinks."""
+        with metrics.span('test') as span:
+            metrics.incr('test')
+        assert span.started is None
+
+    def test_run(self, session, fake, memory):  # noqa: F811
+        """ Check the stages of a run and its SQL, commits, HTTP requests
+        and splits are recorded."""
+        run_fake(fake)
+        for name in ('run.clear', 'run.fetch_work_blocks', 'run.schedule',
+                     'run.post', 'google.get_sheet_chunk',
+                     'google.list_events', 'google.batch'):
+            assert memory.spans[name]['count'] >= 1
+        assert memory.counters[metrics.SQL_STATEMENTS] > 0
+        assert memory.counters[metrics.COMMITS] >= 1
+        # Requests in a batch are counted, not the batch itself
+        assert memory.counters[metrics.HTTP_REQUESTS] == len([
+            r for r in fake.requests if r[1] != CALENDAR_BATCH
+            ])
+        # Each task fills a one hour block exactly
+        assert metrics.SLOT_SPLITS not in memory.counters
+        assert 'run.schedule' in memory.summary()
+
+    def test_log_sink(self, caplog):
+        """ Check spans are logged as they end and counters on flush."""
+        sink = metrics.add_sink(metrics.LogSink())
+        try:
+            with caplog.at_level(logging.INFO, logger='scheduler.metrics'):
+                with metrics.span('stage'):
+                    metrics.incr('things', 2)
+                metrics.flush()
+        finally:
+            metrics.remove_sink(sink)
+        assert '"span": "stage"' in caplog.records[0].getMessage()
+        assert caplog.records[1].getMessage() == '{"counters": {"things": 2}}'
+
+    def test_prometheus_sink(self, tmpdir):
+        """ Check metrics are written in the Prometheus text format."""
+        path = str(tmpdir.join('scheduler.prom'))
+        sink = metrics.add_sink(metrics.PrometheusSink(path))
+        try:
+            with metrics.span('stage'):
+                metrics.incr(metrics.COMMITS)
+            metrics.flush()
+        finally:
+            metrics.remove_sink(sink)
+        with open(path) as f:
+            lines = f.read().splitlines()
+        assert 'scheduler_span_count{span="stage"} 1' in lines
+        assert 'scheduler_commits_total 1' in lines
+
+    def test_profile_flag(self, session, monkeypatch, capsys):
+        """ Check --profile prints the recorded metrics and fragment
+        counts."""
+        monkeypatch.setattr(cli, 'run', lambda **kwargs: ([], []))
+        assert cli.main(['--profile']) == ([], [])
+        assert metrics._sinks == []
+        out = capsys.readouterr().out
+        assert 'run ' in out
+        assert 'time periods: adjacent=' in out
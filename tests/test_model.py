@@ -4,6 +4,10 @@
 
 from datetime import datetime
 
+from sqlalchemy import event
+
+from scheduler import db_conf
+from scheduler.db_conf import unit_of_work, engine
 from scheduler.models import (
     Task, TimePeriod
 )
@@ -39,6 +43,8 @@ class TestModel:
         unassigned = TimePeriod.unassigned_in_range(startdate, enddate)
         assert "10 October 2010 - 12 30" in unassigned.__repr__()
         assert "2010-10-10" in unassigned.as_event()['start']['dateTime']
+        assert unassigned.as_event()['extendedProperties']['private'][
+            'schedulerKey'] == "None|2010-10-10T12:00:00"
 
     def test_tasks(self, tasks):
         """ Test task functions."""
@@ -63,3 +69,67 @@ class TestModel:
         assert "test1" in tps[0].as_event()['description']
         tasks[0].reset_assignments()
         assert tps[0].available and not tps[1].available
+
+    def test_unit_of_work(self, tasks):
+        """ Check commits are deferred until the unit of work exits."""
+        with unit_of_work() as session:
+            Task.delete_all()
+            Task(datetime(2010, 10, 20), 30, description="test3").save()
+            Task.save_all([
+                Task(datetime(2010, 10, 21), 30, description="test4"),
+                Task(datetime(2010, 10, 22), 30, description="test5")
+                ])
+            assert session.in_transaction()
+            assert len(Task.get_all()) == 3
+        assert not session.in_transaction()
+        try:
+            with unit_of_work():
+                Task.delete_all()
+                raise ValueError
+        except ValueError:
+            pass
+        assert len(Task.get_all()) == 3
+        try:
+            with unit_of_work():
+                Task.delete_all()
+                raise KeyboardInterrupt
+        except KeyboardInterrupt:
+            pass
+        assert db_conf._depth == 0
+        assert len(Task.get_all()) == 3
+
+    def test_report(self, tasks, timeperiods):
+        """ Check SQL-side durations and the task report."""
+        tps = TimePeriod.get_all()
+        tasks = Task.get_all()
+        tps[0].task = tasks[1]
+        tps[1].task = tasks[1]
+        tps[1].enddatetime = datetime(2010, 10, 11, 19, 40, 0, 500)
+        tps[0].save()
+        assert tasks[1].assigned_minutes == 30 + 41
+        assert tasks[1].assigned
+        report = dict((row.id, row) for row in Task.report())
+        assert report[tasks[0].id].assigned == 0
+        assert report[tasks[0].id].remaining == 30
+        assert report[tasks[1].id].assigned == 71
+        assert report[tasks[1].id].remaining == 0
+
+    def test_iter_assigned_events(self, tasks, timeperiods):
+        """ Check events are exported with a single query."""
+        tps = TimePeriod.get_all()
+        tasks = Task.get_all()
+        tps[0].task = tasks[0]
+        tps[1].task = tasks[1]
+        tps[0].save()
+        expected = [tp.as_event() for tp in tps]
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            events = list(TimePeriod.iter_assigned_events(batch_size=1))
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+        assert events == expected
+        assert len(statements) == 1
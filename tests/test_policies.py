@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+
+import pytest
+
+from scheduler.models import Task
+from scheduler.policies import get_policy, CriticalFirst
+
+
+def make_task(ref, due, critical=False):
+    task = Task(due, 30, taskref=ref)
+    task.critical = critical
+    return task
+
+
+class TestPolicies:
+
+    def test_orders(self):
+        """ Test each policy's task order."""
+        tasks = [
+            make_task('a', datetime(2010, 10, 20)),
+            make_task('b', datetime(2010, 10, 10), critical=True),
+            make_task('c', datetime(2010, 10, 5)),
+            make_task('d', datetime(2010, 10, 10))
+            ]
+        def refs(policy):
+            return [t.taskref for t in get_policy(policy).order(tasks)]
+        assert refs(None) == ['a', 'b', 'c', 'd']
+        assert refs('edf') == ['c', 'b', 'd', 'a']
+        assert refs(CriticalFirst()) == ['b', 'c', 'd', 'a']
+
+    def test_unknown_policy(self):
+        with pytest.raises(ValueError):
+            get_policy('random')
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from scheduler.core import schedule_all
+from scheduler.models import Task, TimePeriod
+from scheduler.precheck import precheck
+from scheduler.slots import MINUTE, Slot, SlotArray, to_epoch
+
+START = datetime(2010, 10, 9, 12, 00)
+
+
+def workload(n_slots, n_tasks, seed=0):
+    rng = random.Random(seed)
+    first = to_epoch(START)
+    slots = SlotArray(
+        Slot(
+            first + i * 60 * MINUTE,
+            first + i * 60 * MINUTE + rng.randint(1, 60) * MINUTE
+            )
+        for i in range(n_slots)
+        )
+    tasks = list()
+    for i in range(n_tasks):
+        due = START + timedelta(hours=rng.uniform(-10, n_slots + 10))
+        task = Task(due, rng.randint(0, 600))
+        task.progress = rng.choice([0, 50])
+        if i % 11 == 0:
+            task.due = None
+        tasks.append(task)
+    return tasks, slots
+
+
+class TestPrecheck:
+
+    def test_precheck(self, tasks, timeperiods):
+        """ Test capacity and slack against the fixture time periods."""
+        tasks = Task.get_all()
+        result = precheck(tasks, TimePeriod.get_all(), START, use_numpy=False)
+        # 30 minute periods on 10th and 11th October, the second task is
+        # due first (at midnight on the 20th)
+        assert [t['capacity'] for t in result['tasks']] == [60, 60]
+        assert [t['remaining'] for t in result['tasks']] == [30, 60]
+        assert [t['slack'] for t in result['tasks']] == [-30, 0]
+        assert not result['feasible']
+        later = precheck(
+            tasks, TimePeriod.get_all(), datetime(2010, 10, 11),
+            use_numpy=False
+            )
+        assert [t['capacity'] for t in later['tasks']] == [30, 30]
+
+    def test_feasible(self):
+        """ Test a workload that fits is feasible."""
+        slots = SlotArray([
+            Slot(0, 60 * MINUTE), Slot(120 * MINUTE, 150 * MINUTE)
+            ])
+        tasks = [Task(datetime(1970, 1, 1, 1), 60),
+                 Task(datetime(1970, 1, 1, 3), 30)]
+        for task in tasks:
+            task.progress = 0
+        result = precheck(tasks, slots, use_numpy=False)
+        assert result['feasible']
+        assert [t['slack'] for t in result['tasks']] == [0, 0]
+
+    def test_capacity(self):
+        """ Test capacity against summing the slots for each task."""
+        tasks, slots = workload(200, 50)
+        result = precheck(tasks, slots, START, use_numpy=False)
+        for task, checked in zip(tasks, result['tasks']):
+            expected = 0
+            if task.due is not None:
+                expected = sum(
+                    s.duration for s in slots
+                    if s.start >= to_epoch(START) and
+                    s.end <= to_epoch(task.due)
+                    )
+            assert checked['capacity'] == expected
+
+    def test_numpy_matches_python(self):
+        """ Test the NumPy and pure Python checks agree."""
+        pytest.importorskip('numpy')
+        tasks, slots = workload(2000, 300)
+        fast = precheck(tasks, slots, START, use_numpy=True)
+        slow = precheck(tasks, slots, START, use_numpy=False)
+        assert fast['feasible'] == slow['feasible']
+        for a, b in zip(fast['tasks'], slow['tasks']):
+            assert a['capacity'] == b['capacity']
+            assert a['slack'] == pytest.approx(b['slack'])
+
+    def test_prune(self, tasks, timeperiods):
+        """ Test pruned tasks are reported without being scheduled."""
+        task = Task.get_all()[1]
+        task.due = datetime(2010, 10, 10, 12, 00)
+        errors = schedule_all(START, prune=True)
+        assert [(e['task'].id, e['timeleft']) for e in errors] == \
+            [(task.id, 60)]
+        assert task.timeperiods == []
+        assert len(Task.get_all()[0].timeperiods) == 1
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+from apiclient.errors import HttpError
+
+from scheduler.google_api import BatchWriter, DELETED_STATUSES
+from scheduler.retry import TokenBucket, RequestExecutor, is_retryable
+
+from tests.test_google_api import batch_response, calendar_service
+
+
+class FakeClock(object):
+    """ Clock that only moves when something sleeps."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def executor(clock, **kwargs):
+    return RequestExecutor(
+        clock=clock, sleep=clock.sleep, jitter=lambda: 1.0, **kwargs
+        )
+
+
+def error_response(status, reason=None):
+    body = {'error': {'code': status, 'message': 'error'}}
+    if reason:
+        body['error']['errors'] = [{'reason': reason}]
+    return ({'status': str(status)}, json.dumps(body))
+
+
+class TestRetry:
+
+    def test_token_bucket(self):
+        """ Check requests over the burst wait for tokens at the rate."""
+        clock = FakeClock()
+        bucket = TokenBucket(2, 3, clock, clock.sleep)
+        waits = [bucket.acquire() for _ in range(5)]
+        assert waits == [0, 0, 0, 0.5, 0.5]
+        assert clock.now == 1.0
+
+    def test_token_bucket_large(self):
+        """ Check requests larger than the bucket are paid for in full."""
+        clock = FakeClock()
+        bucket = TokenBucket(10, 20, clock, clock.sleep)
+        assert bucket.acquire(50) == 3.0
+        assert bucket.acquire(10) == 1.0
+        # 60 tokens at 10 a second, less the 20 the bucket started with
+        assert clock.now == 4.0
+
+    def test_is_retryable(self):
+        """ Check rate limits and server errors are retried, not others."""
+        def error(status, reason=None):
+            headers, content = error_response(status, reason)
+            return HttpError(
+                type('Resp', (object,), {'status': status, 'reason': ''})(),
+                content.encode('utf-8')
+                )
+        assert is_retryable(error(429))
+        assert is_retryable(error(503))
+        assert is_retryable(error(403, 'rateLimitExceeded'))
+        assert not is_retryable(error(403, 'forbidden'))
+        assert not is_retryable(error(404))
+
+    def test_execute_retries(self):
+        """ Check a request is retried with backoff until it succeeds."""
+        clock = FakeClock()
+        http, service = calendar_service([
+            error_response(429),
+            error_response(403, 'userRateLimitExceeded'),
+            ({'status': '200'}, json.dumps({'items': []}))
+            ])
+        retrier = executor(clock, base_delay=1.0)
+        result = retrier.execute(service.events().list(calendarId='cal'))
+        assert result == {'items': []}
+        assert clock.sleeps == [1.0, 2.0]
+        assert retrier.stats['requests'] == 3
+        assert retrier.stats['retries'] == 2
+        assert retrier.stats['backoff_seconds'] == 3.0
+
+    def test_execute_gives_up(self):
+        """ Check errors are raised once the retries are used up."""
+        clock = FakeClock()
+        http, service = calendar_service([error_response(500)] * 3)
+        retrier = executor(clock, max_retries=2)
+        with pytest.raises(HttpError):
+            retrier.execute(service.events().list(calendarId='cal'))
+        assert retrier.stats['retries'] == 2
+        assert retrier.stats['failures'] == 1
+
+    def test_batch_resumes(self):
+        """ Check only failed requests of a batch are sent again."""
+        clock = FakeClock()
+        http, service = calendar_service([
+            batch_response([200, 503, 200], [{'id': '0'}, {}, {'id': '2'}]),
+            batch_response([200], [{'id': '1'}], ids=[1])
+            ])
+        writer = BatchWriter(service, executor=executor(clock))
+        for i in range(3):
+            writer.add(
+                service.events().insert(calendarId='cal', body={}), i
+                )
+        results = writer.execute()
+        assert [r['id'] for r in results] == ['0', '1', '2']
+        assert writer.errors == []
+        assert len(http.request_sequence) == 2
+        assert http.request_sequence[1][2].count('POST /calendar') == 1
+        assert writer.executor.stats['requests'] == 4
+
+    def test_batch_retried_whole(self):
+        """ Check a batch that fails as a whole is sent again."""
+        clock = FakeClock()
+        http, service = calendar_service([
+            error_response(502),
+            batch_response([404, 204])
+            ])
+        writer = BatchWriter(service, executor=executor(clock))
+        for i in range(2):
+            writer.add(
+                service.events().delete(calendarId='cal', eventId=str(i)),
+                i, ok_statuses=DELETED_STATUSES
+                )
+        writer.execute()
+        # Already deleted events are not errors
+        assert writer.errors == []
+        assert writer.executor.stats['retries'] == 1
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+import sys
+from datetime import datetime, timedelta
+
+import pytz
+
+from scheduler.engine import SlotIndex, fit_minutes
+from scheduler.flow import remaining_minutes
+from scheduler.models import Task, TimePeriod
+from scheduler.slots import (
+    EPOCH, MINUTE, SECOND, Slot, SlotArray, defragment, fragment_counts,
+    from_epoch, to_epoch, slots_from_timeperiods, timeperiods_from_slots
+)
+
+START = datetime(2010, 10, 10, 9)
+
+
+def add_periods(spans, task=None):
+    """ Save time periods for (start, end) minutes after START."""
+    for start, end in spans:
+        tp = TimePeriod(
+            START + timedelta(minutes=start), START + timedelta(minutes=end)
+            )
+        tp.task = task
+        tp.save()
+
+
+class TestSlots:
+
+    def test_convert(self):
+        """ Test converting time periods to slots and back."""
+        tz = pytz.timezone("US/Pacific")
+        start = tz.localize(datetime(2010, 10, 11, 12, 00))
+        tp = TimePeriod(start, start + timedelta(minutes=90, seconds=1))
+        slot = slots_from_timeperiods([tp])[0]
+        assert slot.startdatetime == datetime(2010, 10, 11, 19, 00)
+        assert slot.duration == tp.duration == 91
+        back = timeperiods_from_slots([slot])[0]
+        assert back.startdatetime == slot.startdatetime
+        assert back.enddatetime == slot.enddatetime
+        assert from_epoch(to_epoch(back.enddatetime)) == back.enddatetime
+
+    def test_pop_first(self):
+        """ Test free slots are found in start order within a range."""
+        day = to_epoch(datetime(2010, 10, 10))
+        slots = SlotArray([
+            Slot(day + 120 * MINUTE, day + 150 * MINUTE, id=2),
+            Slot(day, day + 60 * MINUTE, id=1),
+            Slot(day + 120 * MINUTE, day + 130 * MINUTE, id=3)
+            ])
+        assert len(slots) == 3
+        end = from_epoch(day + 8000 * SECOND)
+        assert slots.pop_first(from_epoch(day + MINUTE), end).id == 3
+        assert slots.pop_first(from_epoch(day + MINUTE), end) is None
+        assert slots.pop_first(from_epoch(day), end).id == 1
+
+    def test_schedule(self, tasks, timeperiods):
+        """ Test assigning and splitting slots and saving them."""
+        task = Task.get_all()[0]
+        slots = SlotArray.load()
+        slot = slots.pop_first(datetime(2010, 10, 9), task.due)
+        assert slots.assign(slot, task, 20) == 20
+        slots.save()
+        assigned = TimePeriod.get_assigned()
+        assert [tp.duration for tp in assigned] == [20]
+        assert assigned[0].task is task
+        assert len(TimePeriod.get_unassigned()) == 2
+
+    def test_fractional_split(self, tasks, timeperiods):
+        """ Test slots split at the same microsecond as time periods in a
+        SlotIndex for fractional minutes."""
+        task = Task.get_all()[0]
+        task.esttimemins = 29
+        task.progress = 33
+        start = datetime(2010, 10, 9)
+        slots = SlotArray.load()
+        slot = slots.pop_first(start, task.due)
+        slots.assign(slot, task, remaining_minutes(task))
+        index = SlotIndex.load()
+        tp = index.pop_first(start, task.due)
+        index.assign(tp, task, remaining_minutes(task))
+        assert tp.enddatetime == slot.enddatetime == \
+            datetime(2010, 10, 10, 12, 19, 25, 800000)
+        index.save()
+
+    def test_compact(self):
+        """ Test a year of one minute slots takes about 24 bytes each."""
+        start = to_epoch(datetime(2010, 1, 1))
+        count = 365 * 24 * 60
+        slots = SlotArray(
+            Slot(start + i * MINUTE, start + (i + 1) * MINUTE, id=i + 1)
+            for i in range(count)
+            )
+        size = sum(
+            sys.getsizeof(a) for a in (slots._starts, slots._ends, slots._ids)
+            )
+        assert len(slots) == count
+        assert size < 30 * count
+
+    def test_min_minutes(self):
+        """ Test slots are not split into parts shorter than min_minutes."""
+        assert fit_minutes(60, 20) == 20
+        assert fit_minutes(60, 20, 15) == 30
+        assert fit_minutes(60, 50, 15) == 60
+        assert fit_minutes(60, 40, 30) == 60
+        task = Task(datetime(2010, 10, 20), 50)
+        slots = SlotArray([Slot(0, 120 * MINUTE)], min_minutes=15)
+        assert slots.assign(slots.pop_first(EPOCH, task.due), task, 50) == 60
+        assert [s.duration for s in slots] == [60]
+
+    def test_defragment(self, tasks, timeperiods):
+        """ Test touching periods of a task, and free ones, are merged and
+        short free periods dropped."""
+        TimePeriod.delete_all()
+        first, second = Task.get_all()
+        add_periods([(0, 30), (30, 60), (90, 100)], first)
+        add_periods([(60, 90)], second)
+        add_periods([(100, 110), (110, 115), (120, 125), (200, 300)])
+        assert fragment_counts(15) == {
+            'total': 8, 'free': 4, 'assigned': 4, 'adjacent': 2, 'short': 4
+            }
+        assert defragment(15) == 3
+        periods = sorted(TimePeriod.get_all(), key=lambda tp: tp.startdatetime)
+        assert [(tp.task_id, tp.duration) for tp in periods] == [
+            (first.id, 60), (second.id, 30), (first.id, 10), (None, 15),
+            (None, 100)
+            ]
+        assert fragment_counts(15)['adjacent'] == 0
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Generous limit on the cumulative import time of scheduler.core, to catch
+# a slow library being imported at module level again
+IMPORT_BUDGET_SECONDS = 2.0
+GOOGLE_MODULES = ('googleapiclient', 'apiclient', 'oauth2client', 'httplib2')
+# Only needed when a precheck runs
+NUMPY_MODULES = ('numpy',)
+
+
+def import_times(module, cwd):
+    """ Import a module in a fresh interpreter with -X importtime.
+
+    Returns a dict of module name to cumulative import time in seconds.
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    output = subprocess.check_output(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        cwd=cwd, env=env, stderr=subprocess.STDOUT
+        ).decode('utf-8')
+    times = dict()
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+class TestStartup:
+
+    def test_core_import(self, tmpdir):
+        """ Check importing scheduler.core does not load the Google
+        libraries or NumPy or create a DB, and stays within the time
+        budget."""
+        times = import_times('scheduler.core', str(tmpdir))
+        loaded = [
+            name for name in times
+            if name.split('.')[0] in GOOGLE_MODULES + NUMPY_MODULES
+            ]
+        assert loaded == []
+        assert not tmpdir.join('data.db').exists()
+        assert times['scheduler.core'] < IMPORT_BUDGET_SECONDS, \
+            'scheduler.core took {0:.3f}s to import'.format(
+                times['scheduler.core'])
+
+    def test_schema_created_on_first_use(self, tmpdir):
+        """ Check the DB and schema are created on first query."""
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        subprocess.check_call([
+            sys.executable, '-c',
+            'from scheduler.models import Task; Task.get_all()'
+            ], cwd=str(tmpdir), env=env)
+        assert tmpdir.join('data.db').exists()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from apiclient.http import HttpMockSequence
+
+from scheduler.google_api import ApiClient
+from scheduler.tenants import Tenant, run_tenants
+
+from tests.test_google_api import batch_response, sheets_discovery_doc
+
+
+def tenant_http(hours):
+    """ Fake transport for one tenant's fetch and post requests."""
+    values = [
+        ['Ref', 'Type', 'Description', 'Hours', 'Due'],
+        ['T1', 'Type', 'Test', str(hours), '20 October 2030'],
+        ['T2', 'Type', 'Bad', 'x', '20 October 2030']
+        ]
+    block = {
+        'start': {'dateTime': '2030-10-10T09:00:00Z', 'timeZone': 'UTC'},
+        'end': {'dateTime': '2030-10-10T12:00:00Z', 'timeZone': 'UTC'}
+    }
+    return HttpMockSequence([
+        ({'status': '200'}, sheets_discovery_doc()),
+        ({'status': '200'}, json.dumps({'values': values})),
+        ({'status': '200'}, json.dumps({'items': [block]})),
+        ({'status': '200'}, json.dumps({'items': []})),
+        batch_response([200], [{'id': 'posted'}])
+        ])
+
+
+class TestTenants:
+
+    def test_run_tenants(self, tmpdir):
+        """ Test each tenant is fetched, scheduled and posted separately."""
+        tenants = [
+            Tenant(
+                name, name + '-sheet', name + '-in', name + '-out',
+                client=ApiClient(
+                    http=tenant_http(hours), cache_dir=str(tmpdir.mkdir(name))
+                    )
+                )
+            for name, hours in (('a', 1), ('b', 4))
+            ]
+        results = run_tenants(tenants, threads=2, processes=2)
+        assert [r['tenant'] for r in results] == ['a', 'b']
+        for result, tenant in zip(results, tenants):
+            assert result['error'] is None
+            assert len(result['posted']) == 1
+            assert set(result['timings']) == set(
+                ['fetch', 'schedule', 'post', 'total']
+                )
+            assert tenant.client.http._iterable == []
+            assert '"summary": "T1"' in \
+                tenant.client.http.request_sequence[-1][2]
+        # The invalid row is reported for both tenants
+        for result in results:
+            assert result['errors'][0]['row'] == 3
+            assert result['errors'][0]['ref'] == 'T2'
+        assert results[0]['errors'][1:] == []
+        assert results[1]['errors'][1:] == [{'task': 'T1', 'timeleft': 60}]